@@ -0,0 +1,106 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Adaptive sampling interval, driven by how fast the readings are changing.
+"""
+
+import math
+from typing import Dict, Optional, Tuple
+
+
+class AdaptiveInterval:
+    """
+    Choose a sampling interval between a minimum and a maximum from the volatility of some feeds.
+
+    For each watched feed, the rate of change per minute between consecutive
+    readings is tracked as an exponentially weighted mean and variance. A
+    feed's volatility is the magnitude of its mean rate plus one standard
+    deviation, relative to its threshold. When any feed reaches its threshold
+    the interval is halved, down to the minimum, to catch fronts and storms;
+    while every feed stays below half of its threshold the interval grows by
+    half, up to the maximum. In between, the interval is left alone, so it
+    doesn't flap.
+    """
+    TIGHTEN = 0.5
+    RELAX = 1.5
+    CALM = 0.5
+
+    def __init__(
+        self, minimum: float, maximum: float, thresholds: Dict[str, float], initial: float, alpha: float = 0.3
+    ):
+        """
+        Parameters
+        ----------
+        minimum: The shortest interval, in seconds.
+        maximum: The longest interval, in seconds.
+        thresholds: A dict mapping the feeds to watch to the rate of change,
+            per minute, at which sampling should speed up.
+        initial: The interval to start with, in seconds; clamped to the range.
+        alpha: The weight of each new rate in the moving averages, between 0 and 1.
+        """
+        if minimum <= 0 or maximum < minimum:
+            raise ValueError(f"Invalid interval range: {minimum} to {maximum}.")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.thresholds = dict(thresholds)
+        self.alpha = alpha
+        self.interval = min(max(initial, minimum), maximum)
+        # feed -> (timestamp, value) of its last reading
+        self._last: Dict[str, Tuple[float, float]] = {}
+        # feed -> (mean, variance) of its rate of change per minute
+        self._rates: Dict[str, Tuple[float, float]] = {}
+
+    def volatility(self) -> float:
+        """
+        Get the volatility of the most volatile feed, relative to its threshold; 1 or more is volatile.
+        """
+        return max(
+            (
+                (abs(mean) + math.sqrt(variance)) / self.thresholds[feed]
+                for feed, (mean, variance) in self._rates.items()
+            ),
+            default=0.0
+        )
+
+    def update(self, data: Dict[str, float], timestamp: float) -> Optional[float]:
+        """
+        Add a cycle's readings, and adjust the interval if any watched feed has a new rate of change.
+
+        Parameters
+        ----------
+        data: A dict mapping feed names to values; feeds which aren't watched are ignored.
+        timestamp: When the readings were taken, in seconds.
+
+        Returns
+        -------
+        The new interval in seconds if it changed, otherwise None.
+        """
+        updated = False
+        for feed, value in data.items():
+            if feed not in self.thresholds:
+                continue
+            last = self._last.get(feed)
+            self._last[feed] = (timestamp, value)
+            if last is None or timestamp <= last[0]:
+                continue
+            updated = True
+            rate = (value - last[1]) * 60.0 / (timestamp - last[0])
+            mean, variance = self._rates.get(feed, (rate, 0.0))
+            diff = rate - mean
+            mean += self.alpha * diff
+            variance = (1 - self.alpha) * (variance + self.alpha * diff * diff)
+            self._rates[feed] = (mean, variance)
+        if not updated:
+            return None
+        volatility = self.volatility()
+        if volatility >= 1.0:
+            interval = max(self.minimum, round(self.interval * self.TIGHTEN))
+        elif volatility < self.CALM:
+            interval = min(self.maximum, round(self.interval * self.RELAX))
+        else:
+            return None
+        if interval == self.interval:
+            return None
+        self.interval = interval
+        return interval
@@ -0,0 +1,154 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Windowed aggregation of high-rate sensor samples.
+"""
+
+from array import array
+import dataclasses
+import math
+from typing import Dict, Iterator, Optional
+
+
+class RingBuffer:
+    """
+    Fixed-size ring buffer of floats, backed by a compact array.
+
+    Once full, each new value overwrites the oldest one, so the memory used
+    never grows past capacity * 8 bytes.
+    """
+    def __init__(self, capacity: int):
+        """
+        Parameters
+        ----------
+        capacity: The maximum number of values to keep.
+        """
+        if capacity <= 0:
+            raise ValueError(f"Capacity must be positive, not {capacity}.")
+        self._values = array('d', bytes(8 * capacity))
+        self._start = 0
+        self._count = 0
+
+    @property
+    def capacity(self) -> int:
+        """
+        Get the maximum number of values kept
+        """
+        return len(self._values)
+
+    def append(self, value: float) -> None:
+        """
+        Add a value, overwriting the oldest one if the buffer is full.
+        """
+        end = (self._start + self._count) % self.capacity
+        self._values[end] = value
+        if self._count < self.capacity:
+            self._count += 1
+        else:
+            self._start = (self._start + 1) % self.capacity
+
+    def clear(self) -> None:
+        """
+        Remove all values.
+        """
+        self._start = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[float]:
+        for i in range(self._count):
+            yield self._values[(self._start + i) % self.capacity]
+
+    def to_array(self) -> array:
+        """
+        Get a copy of the values, oldest first.
+        """
+        end = self._start + self._count
+        if end <= self.capacity:
+            return self._values[self._start:end]
+        return self._values[self._start:] + self._values[:end - self.capacity]
+
+
+@dataclasses.dataclass
+class Aggregate:
+    """
+    Summary statistics of the samples in one window.
+    """
+    mean: float
+    min: float
+    max: float
+    stddev: float
+    count: int
+
+    @classmethod
+    def of(cls, buffer: RingBuffer) -> Optional["Aggregate"]:
+        """
+        Summarize the values in a buffer.
+
+        Parameters
+        ----------
+        buffer: The buffer to summarize.
+
+        Returns
+        -------
+        The summary statistics, or None if the buffer is empty.
+        """
+        count = len(buffer)
+        if count == 0:
+            return None
+        values = buffer.to_array()
+        mean = math.fsum(values) / count
+        variance = math.fsum((value - mean) ** 2 for value in values) / (count - 1) if count > 1 else 0.0
+        return cls(mean, min(values), max(values), math.sqrt(variance), count)
+
+
+class WindowAggregator:
+    """
+    Collect samples for several feeds, and summarize each feed's window on demand.
+    """
+    STATISTICS = ("min", "max", "stddev", "count")
+
+    def __init__(self, capacity: int):
+        """
+        Parameters
+        ----------
+        capacity: The maximum number of samples to keep per feed and window.
+        """
+        self.capacity = capacity
+        self.buffers: Dict[str, RingBuffer] = {}
+
+    def add(self, feed: str, value: float) -> None:
+        """
+        Add a sample to a feed's current window.
+
+        Parameters
+        ----------
+        feed: The name of the feed.
+        value: The sampled value.
+        """
+        buffer = self.buffers.get(feed)
+        if buffer is None:
+            buffer = self.buffers[feed] = RingBuffer(self.capacity)
+        buffer.append(value)
+
+    def flush(self, feed: str) -> Optional[Aggregate]:
+        """
+        Summarize a feed's current window, and start a new one.
+
+        Parameters
+        ----------
+        feed: The name of the feed.
+
+        Returns
+        -------
+        The summary statistics, or None if there were no samples in the window.
+        """
+        buffer = self.buffers.get(feed)
+        if buffer is None:
+            return None
+        aggregate = Aggregate.of(buffer)
+        buffer.clear()
+        return aggregate
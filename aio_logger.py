@@ -5,17 +5,47 @@
 Wrapper class for Adafruit.IO.
 """
 
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
 from datetime import datetime, timezone
 import dataclasses
+import itertools
 import json
-from typing import Any, Optional
+import threading
+import urllib.parse
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-from urllib3.util import Retry
-from requests import RequestException, Session
-from requests.adapters import HTTPAdapter
-from Adafruit_IO import Client, Group, Feed, AdafruitIOError
+from requests import RequestException
+from Adafruit_IO import Client, Group, Feed, AdafruitIOError, RequestError, ThrottlingError
 
+from circuit_breaker import CircuitBreaker
+from deadline import budget, request_timeout
 from eprint import eprint
+from feed_cache import FeedCache
+from http_transport import TRANSPORT
+from metrics import DATA_SKIPPED, HTTP_REQUEST_SECONDS, REGISTRY
+from mqtt_transport import MQTTTransport, MQTTUnavailable
+from outbox import Outbox, QueuedDatum
+from rate_limit import RateLimited, TokenBucket
+
+_DATA_SENT = REGISTRY.counter("tempmon_data_sent_total", "Data points sent to Adafruit.IO.")
+_DATA_FAILED = REGISTRY.counter(
+    "tempmon_data_failed_total", "Data points which failed to send to Adafruit.IO (and may be retried)."
+)
+
+
+def _status(exc: Exception) -> Optional[int]:
+    """
+    Get the HTTP status code of the response an Adafruit.IO error was raised for, if any.
+    """
+    return getattr(exc, 'status', None)
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """
+    Get how long Adafruit.IO asked to wait before trying again after throttling, in seconds, if it said.
+    """
+    return getattr(exc, 'retry_after', None)
 
 
 @dataclasses.dataclass
@@ -31,19 +61,24 @@ class Metadata:
 class AIOClient(Client):
     """
     Adafruit.IO Client wrapper to better handle request retries.
+
+    Requests are sent over the shared HTTP transport, so its connections are
+    kept alive between uploads. If a rate limiter is given, every data point sent takes a token from it,
+    and 429 responses are left to the limiter instead of being retried. Every
+    request and retry takes its timeouts from the current deadline budget.
     """
-    def __init__(self, username, key, proxies=None, base_url='https://io.adafruit.com'):
+    def __init__(
+        self, username, key, proxies=None, base_url='https://io.adafruit.com',
+        limiter: Optional[TokenBucket] = None
+    ):
         super().__init__(username, key, proxies, base_url)
-        self.session = Session()
-        self.session.proxies = proxies
-        retry_strategy = Retry(
-            total=5,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET", "PUT", "POST", "DELETE", "OPTIONS", "TRACE"]
+        self.limiter = limiter
+        self._host = urllib.parse.urlsplit(base_url).hostname or ""
+        self._priority: ContextVar[int] = ContextVar('priority', default=TokenBucket.HIGH)
+        self._budget_known = False
+        self.session = TRANSPORT.session(
+            proxies, [500, 502, 503, 504] if limiter is not None else [429, 500, 502, 503, 504]
         )
-        self.session.mount('https://', HTTPAdapter(max_retries=retry_strategy))
-        self.session.mount('http://', HTTPAdapter(max_retries=retry_strategy))
 
     def _build_headers(self, content_type: Optional[str] = None):
         headers = {'X-AIO-Key': self.key}
@@ -52,67 +87,409 @@ class AIOClient(Client):
         return headers
 
     def _get(self, path, params=None):
-        response = self.session.get(
-            self._compose_url(path),
-            headers=self._build_headers(),
-            params=params
-        )
-        self._last_response = response
+        with HTTP_REQUEST_SECONDS.labels("GET", self._host).time():
+            response = self.session.get(
+                self._compose_url(path),
+                headers=self._build_headers(),
+                params=params,
+                timeout=request_timeout(self._host)
+            )
+        self._observe(response)
         self._handle_error(response)
         return response.json()
 
     def _post(self, path, data):
-        response = self.session.post(
-            self._compose_url(path),
-            headers=self._build_headers('application/json'),
-            data=json.dumps(data)
-        )
-        self._last_response = response
+        self.acquire(self._data_points(path, data))
+        with HTTP_REQUEST_SECONDS.labels("POST", self._host).time():
+            response = self.session.post(
+                self._compose_url(path),
+                headers=self._build_headers('application/json'),
+                data=json.dumps(data),
+                timeout=request_timeout(self._host)
+            )
+        self._observe(response)
         self._handle_error(response)
         return response.json()
 
-    def _delete(self, path):
-        response = self.session.delete(
-            self._compose_url(path),
-            headers=self._build_headers('application/json')
-        )
+    @staticmethod
+    def _handle_error(response):
+        try:
+            Client._handle_error(response)
+        except (AdafruitIOError, RequestError) as exc:
+            # kept with the error, as the client is shared by threads which may
+            # have had other responses by the time it is handled
+            exc.status = response.status_code
+            try:
+                exc.retry_after = float(response.headers.get("Retry-After", ""))
+            except ValueError:
+                exc.retry_after = None
+            raise
+
+    def _observe(self, response) -> None:
+        """
+        Record a response, and let the rate limiter learn from it.
+        """
         self._last_response = response
+        if self.limiter is not None:
+            self.limiter.observe(response.status_code, response.headers)
+
+    def acquire(self, data_points: int) -> None:
+        """
+        Take budget for sending some data points from the rate limiter, if
+        there is one, at the current priority, e.g. for data sent over MQTT.
+
+        Raises
+        ------
+        RateLimited: when the data can't be sent yet.
+        """
+        if self.limiter is not None:
+            self._learn_budget()
+            self.limiter.acquire(data_points, self._priority.get())
+
+    def release(self, data_points: int) -> None:
+        """
+        Give back budget taken for data points which weren't sent after all, e.g.
+        so that sending them over REST instead doesn't pay for them twice.
+        """
+        if self.limiter is not None:
+            self.limiter.release(data_points)
+
+    def _learn_budget(self) -> None:
+        """
+        Set the rate limiter to the account's data rate, the first time data is sent.
+        """
+        if self._budget_known or self.limiter is None:
+            return
+        self._budget_known = True
+        try:
+            throttle = self._get('throttle')
+            self.limiter.set_rate(
+                float(throttle['data_rate_limit']),
+                float(throttle.get('active_data_rate', 0))
+            )
+        except (AdafruitIOError, RequestError, ThrottlingError, RequestException, LookupError, ValueError):
+            eprint("WARN: Unable to look up the Adafruit.IO data rate - using the configured one.")
+
+    @staticmethod
+    def _data_points(path: str, data: Dict) -> int:
+        """
+        Count the data points a POST request creates, for rate limiting.
+        """
+        if not (path.endswith('/data') or path.endswith('/data/batch')):
+            return 0
+        if 'feeds' in data:
+            return len(data['feeds'])
+        if isinstance(data.get('data'), list):
+            return len(data['data'])
+        return 1
+
+    @contextmanager
+    def low_priority(self) -> Iterator[None]:
+        """
+        Send data at low priority within this context, i.e. only if it leaves
+        rate limit budget in reserve, and without waiting for it.
+        """
+        token = self._priority.set(TokenBucket.LOW)
+        try:
+            yield
+        finally:
+            self._priority.reset(token)
+
+    def send_group_data(
+        self, group_key: str, values: Dict[str, Any], metadata: Optional[Dict] = None
+    ) -> List[Dict]:
+        """
+        Send values for several feeds of a group in a single request.
+
+        Parameters
+        ----------
+        group_key: The key of the group which owns the feeds.
+        values: A dict mapping feed keys (within the group) to values.
+        metadata: Optional dict with lat, lon, ele and created_at, shared by all values.
+
+        Returns
+        -------
+        A list of the data records created, as returned by Adafruit.IO.
+        """
+        payload: Dict[str, Any] = {
+            'feeds': [{'key': key, 'value': value} for key, value in values.items()]
+        }
+        if metadata is not None:
+            if any(metadata.get(field) is not None for field in ('lat', 'lon', 'ele')):
+                payload['location'] = {
+                    'lat': metadata.get('lat'),
+                    'lon': metadata.get('lon'),
+                    'ele': metadata.get('ele')
+                }
+            if metadata.get('created_at') is not None:
+                payload['created_at'] = metadata['created_at']
+        return self._post(f"groups/{group_key}/data", payload)
+
+    def send_feed_batch(self, feed_key: str, records: List[Dict]) -> List[Dict]:
+        """
+        Send several values to a single feed in one request.
+
+        Parameters
+        ----------
+        feed_key: The full key of the feed.
+        records: A list of dicts, each with a value and optionally created_at, lat, lon and ele.
+
+        Returns
+        -------
+        A list of the data records created, as returned by Adafruit.IO.
+        """
+        return self._post(f"feeds/{feed_key}/data/batch", {'data': records})
+
+    def iter_data(
+        self,
+        feed_key: str,
+        start_time: Optional[str] = None,
+        end_time: Optional[str] = None,
+        page_size: int = 1000
+    ) -> Iterator[Dict]:
+        """
+        Iterate over the data of a feed, newest first, one page at a time.
+
+        Unlike Client.data(), only one page is held in memory at once, so a
+        feed's whole history can be streamed. Each page ends where the next
+        begins, by timestamp; data at the boundary which is returned twice is
+        only yielded once.
+
+        Parameters
+        ----------
+        feed_key: The full key of the feed.
+        start_time: Optional ISO 8601 time of the oldest data wanted.
+        end_time: Optional ISO 8601 time after which data isn't wanted.
+        page_size: The most data to fetch in one request.
+
+        Returns
+        -------
+        An iterator of data records, as returned by Adafruit.IO.
+        """
+        params: Dict[str, Any] = {'limit': page_size}
+        if start_time is not None:
+            params['start_time'] = start_time
+        seen: Set[str] = set()
+        while True:
+            if end_time is not None:
+                params['end_time'] = end_time
+            page = self._get(f"feeds/{feed_key}/data", params=dict(params))
+            fresh = [record for record in page if record.get('id') not in seen]
+            yield from fresh
+            if len(page) < page_size or not fresh:
+                return
+            end_time = page[-1]['created_at']
+            seen = {record.get('id') for record in page if record['created_at'] == end_time}
+
+    def _delete(self, path):
+        with HTTP_REQUEST_SECONDS.labels("DELETE", self._host).time():
+            response = self.session.delete(
+                self._compose_url(path),
+                headers=self._build_headers('application/json'),
+                timeout=request_timeout(self._host)
+            )
+        self._observe(response)
         self._handle_error(response)
 
 
 class AIOLogger:
     """
     Adafruit.IO API Data Logger.
+
+    One logger can serve several stations, each sending to its own feed group
+    with its own metadata, while sharing one HTTP session (and so one
+    connection pool), one index of group and feed keys, and one outbox. Methods
+    taking a group_name default to the group the logger was created with.
+
+    With an MQTT transport, the latest data of each group is published over its
+    persistent connection instead of a REST request per group; REST is still
+    used for looking up groups and feeds, for replaying a backlog in bulk with
+    its original timestamps, and whenever MQTT is unavailable.
+
+    When data is sent directly, rather than through an outbox, circuit breakers
+    keep failures cheap: one for the server, which stops every send while it is
+    unreachable, and one per feed, which stops sending to a feed whose data
+    keeps being rejected, without holding up the rest of the group. (The outbox
+    drainer backs off on its own, and keeps the data until it can be sent.)
     """
-    def __init__(self, aio_user: str, aio_key: str, group_name: str = "Default"):
+    _DRAIN_BATCH_SIZE = 100
+    _DRAIN_MIN_DELAY = 15.0
+    _DRAIN_MAX_DELAY = 900.0
+
+    def __init__(
+        self,
+        aio_user: str,
+        aio_key: str,
+        group_name: str = "Default",
+        outbox: Optional[Outbox] = None,
+        feed_cache: Optional[FeedCache] = None,
+        limiter: Optional[TokenBucket] = None,
+        base_url: str = 'https://io.adafruit.com',
+        mqtt: Optional[MQTTTransport] = None,
+        breaker_factory: Callable[[str], CircuitBreaker] = CircuitBreaker,
+        send_budget: float = 20.0
+    ):
         """
         Parameters
         ----------
         aio_user: Username for Adafruit.IO.
         aio_key: Authentication Key for Adafruit.IO.
-        group_name: Name of group to use at Adafruit.IO.
+        group_name: Name of the default group to use at Adafruit.IO.
+        outbox: Optional durable queue; when given, data is stored there first
+            and sent by a background drainer thread.
+        feed_cache: Optional on-disk cache of group and feed keys, to save
+            looking them up at every start.
+        limiter: Optional rate limiter, to keep within the Adafruit.IO data rate.
+        base_url: The Adafruit.IO server to use, e.g. a local stand-in for testing.
+        mqtt: Optional MQTT connection to publish data over, with REST as the fallback.
+        breaker_factory: Makes the circuit breaker for a component, given its name.
+        send_budget: The deadline budget for sending each chunk of queued data,
+            including retries, in seconds.
         """
-        self.aio = AIOClient(aio_user, aio_key)
+        self.send_budget = send_budget
+        self.aio = AIOClient(aio_user, aio_key, base_url=base_url, limiter=limiter)
+        self._breaker_factory = breaker_factory
+        self._server_breaker = breaker_factory(f"Adafruit.IO at {urllib.parse.urlsplit(base_url).hostname}")
+        self._feed_breakers: Dict[str, CircuitBreaker] = {}
+        self.feed_cache = feed_cache
+        self.group_keys: Dict[str, str] = {}
+        self.feed_keys: Set[str] = set()
+        self.groups: Dict[str, Group] = {}
+        self._feed_names: Set[Tuple[str, str]] = set()
+        self.load_index()
         self.group = self.get_feed_group(group_name)
-        self.feeds = self.aio.feeds()
-        self.metadata: Optional[Metadata] = None
+        self.metadata: Dict[str, Metadata] = {}
+        self.outbox = outbox
+        self.mqtt = mqtt
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        # the outbox rows published over MQTT, kept until the broker acknowledges them
+        self._in_flight: Set[int] = set()
+        self._in_flight_lock = threading.Lock()
+        self._drainer: Optional[threading.Thread] = None
+        self._retry_after = 0.0
+        if self.outbox is not None:
+            self._drainer = threading.Thread(target=self._drain_loop, name="outbox-drainer", daemon=True)
+            self._drainer.start()
+            # replay anything left over from before a restart
+            self._wake.set()
 
     def set_metadata(
         self,
         latitude: Optional[float] = None,
         longitude: Optional[float] = None,
-        elevation: Optional[float] = None
+        elevation: Optional[float] = None,
+        group_name: Optional[str] = None
     ):
         """
-        Set the metadata to use when posting to Adafruit.IO.
+        Set the metadata to use when posting to a group at Adafruit.IO.
 
         Parameters
         ----------
         latitude: Latitude of the sensor.
         longitude: Longitude of the sensor.
         elevation: Elevation of the sensor.
+        group_name: The name of the group; defaults to the logger's group.
+        """
+        self.metadata[group_name or self.group.name] = Metadata(latitude, longitude, elevation)
+
+    def _group(self, group_name: Optional[str]) -> Group:
+        """
+        Get a group we send to, by name, creating it if needed; None means the logger's group.
+        """
+        if group_name is None:
+            return self.group
+        group = self.groups.get(group_name)
+        if group is None:
+            group = self.get_feed_group(group_name)
+        return group
+
+    def load_index(self) -> None:
+        """
+        Load the index of group and feed keys, from the feed cache if it is fresh.
+        """
+        if self.feed_cache is not None and self.feed_cache.is_fresh():
+            self.group_keys = dict(self.feed_cache.groups)
+            self.feed_keys = set(self.feed_cache.feeds)
+        else:
+            self.refresh_index()
+
+    def refresh_index(self) -> None:
+        """
+        Rebuild the index of group and feed keys from Adafruit.IO, and cache it.
+        """
+        group_list: list[Group] = self.aio.groups()
+        feed_list: list[Feed] = self.aio.feeds()
+        self.group_keys = {group.name: group.key for group in group_list}
+        self.feed_keys = {feed.key for feed in feed_list}
+        self._save_index(refreshed=True)
+
+    def _save_index(self, refreshed: bool = False) -> None:
+        """
+        Save the index of group and feed keys to the feed cache, if there is one.
+
+        Parameters
+        ----------
+        refreshed: Whether the whole index was just rebuilt from Adafruit.IO,
+            rather than added to.
         """
-        self.metadata = Metadata(latitude, longitude, elevation)
+        if self.feed_cache is not None:
+            self.feed_cache.update(self.group_keys, self.feed_keys, refreshed)
+
+    def _create(self, create: Callable[[], str], find: Callable[[], Optional[str]]) -> str:
+        """
+        Create a group or feed at Adafruit.IO, and get its key.
+
+        If Adafruit.IO refuses, the index is refreshed and the group or feed is
+        looked for again before giving up: a cached index can be missing one
+        made since it was saved, e.g. in the web UI or by another station,
+        which can't be created again.
+
+        Parameters
+        ----------
+        create: Creates the group or feed, returning its key.
+        find: Looks the group or feed up in the index, returning its key, or None.
+
+        Returns
+        -------
+        The key of the group or feed.
+        """
+        try:
+            return create()
+        except ThrottlingError:
+            raise
+        except (AdafruitIOError, RequestError):
+            self.refresh_index()
+            key = find()
+            if key is None:
+                raise
+            return key
+
+    def _check_not_found(self, exc: Exception) -> None:
+        """
+        Re-resolve our group and feeds if a request failed with 404 Not Found.
+
+        A 404 means the cached keys are stale, e.g. because a feed was deleted.
+
+        Parameters
+        ----------
+        exc: The error the request failed with.
+        """
+        if _status(exc) != 404:
+            return
+        eprint("WARN: Adafruit.IO group or feed not found - refreshing feed cache.")
+        if self.feed_cache is not None:
+            self.feed_cache.invalidate()
+        try:
+            self.refresh_index()
+            for group_name in list(self.groups):
+                self.get_feed_group(group_name)
+            self.group = self.groups[self.group.name]
+            # a copy, as other threads may be adding feeds
+            for group_name, feed_name in list(self._feed_names):
+                self.get_feed(feed_name, group_name)
+        except (AdafruitIOError, RequestError, ThrottlingError, RequestException):
+            eprint("WARN: Unable to refresh feed cache - will retry.")
 
     def get_feed_group(self, group_name: str) -> Group:
         """
@@ -126,53 +503,538 @@ class AIOLogger:
         -------
         A Feed Group object.
         """
-        group_list: list[Group] = self.aio.groups()
-        for group in group_list:
-            if group.name == group_name:
-                return group
-        # didn't find the feed group, so create it
-        group = Group(name=group_name)
-        return self.aio.create_group(group)
+        group_key = self.group_keys.get(group_name)
+        if group_key is None:
+            # didn't find the feed group, so create it
+            group_key = self._create(
+                lambda: self.aio.create_group(Group(name=group_name)).key, lambda: self.group_keys.get(group_name)
+            )
+            self.group_keys[group_name] = group_key
+            self._save_index()
+        group = Group(name=group_name, key=group_key)
+        self.groups[group_name] = group
+        return group
 
-    def get_feed(self, feed_name: str) -> Feed:
+    def get_feed(self, feed_name: str, group_name: Optional[str] = None) -> Feed:
         """
         Get a Feed object based on the feed_name parameter, creating one if needed.
 
-        The Feed will be associated with our feed group.
+        The Feed will be associated with a feed group.
 
         Parameters
         ----------
         feed_name: The name of the feed to retrieve/create.
+        group_name: The name of the group; defaults to the logger's group.
 
         Returns
         -------
         A Feed object.
         """
-        feed_key = f"{self.group.key}.{feed_name}"
-        feed_list: list[Feed] = self.aio.feeds()
-        for feed in feed_list:
-            if feed.key == feed_key:
-                return feed
-        # didn't find the feed, so create it
-        feed = Feed(name=feed_name)
-        return self.aio.create_feed(feed, group_key=self.group.key)
+        group = self._group(group_name)
+        self._feed_names.add((group.name, feed_name))
+        feed_key = f"{group.key}.{feed_name}"
+        if feed_key not in self.feed_keys:
+            # didn't find the feed, so create it
+            feed_key = self._create(
+                lambda: self.aio.create_feed(Feed(name=feed_name), group_key=group.key).key,
+                lambda: feed_key if feed_key in self.feed_keys else None
+            )
+            self.feed_keys.add(feed_key)
+            self._save_index()
+        return Feed(name=feed_name, key=feed_key)
 
-    def log(self, feed_name: str, datapoint: Any):
+    def _build_metadata(self, created_at: Optional[str] = None, group_name: Optional[str] = None) -> Optional[Dict]:
+        """
+        Build the metadata dict to send along with a datapoint.
+
+        Parameters
+        ----------
+        created_at: The ISO 8601 timestamp of the datapoint; defaults to the current time.
+        group_name: The name of the group; defaults to the logger's group.
+
+        Returns
+        -------
+        A dict containing the metadata, or None if no metadata has been set.
+        """
+        station = self.metadata.get(group_name or self.group.name)
+        if station is None:
+            return None
+        metadata = dataclasses.asdict(station)
+        metadata['created_at'] = created_at or datetime.now(timezone.utc).isoformat()
+        return metadata
+
+    def _server_failed(self, exc: Exception) -> bool:
+        """
+        Check whether a failed request is the server's fault, rather than the data's.
+        """
+        return isinstance(exc, RequestException) or (_status(exc) or 0) >= 500
+
+    def _feed_breaker(self, feed_key: str) -> CircuitBreaker:
+        """
+        Get the circuit breaker of a feed, by its full key.
+        """
+        breaker = self._feed_breakers.get(feed_key)
+        if breaker is None:
+            breaker = self._feed_breakers.setdefault(feed_key, self._breaker_factory(f"feed {feed_key}"))
+        return breaker
+
+    def log(self, feed_name: str, datapoint: Any, group_name: Optional[str] = None) -> bool:
         """
         Log data to Adafruit.IO.
 
+        The data is skipped without being sent while the server's or the
+        feed's circuit breaker is open.
+
         Parameters
         ----------
         feed_name: The name of the feed to which the data belongs.
         datapoint: The data to add to the feed.
+        group_name: The name of the group; defaults to the logger's group.
+
+        Returns
+        -------
+        True if the data was transmitted, False if it was skipped.
         """
-        if self.metadata is not None:
-            metadata = dataclasses.asdict(self.metadata)
-            metadata['created_at'] = datetime.now(timezone.utc).isoformat()
-        else:
-            metadata = None
-        feed_key = f"{self.group.key}.{feed_name}"
+        feed_key = f"{self._group(group_name).key}.{feed_name}"
+        if not self._server_breaker.allow() or not self._feed_breaker(feed_key).allow():
+            DATA_SKIPPED.labels("circuit_open").inc()
+            return False
+        return self._log(feed_name, datapoint, group_name)
+
+    def _log(self, feed_name: str, datapoint: Any, group_name: Optional[str] = None) -> bool:
+        """
+        Log data to Adafruit.IO, once the circuit breakers have let it through, and report the outcome to them.
+
+        Parameters
+        ----------
+        feed_name: The name of the feed to which the data belongs.
+        datapoint: The data to add to the feed.
+        group_name: The name of the group; defaults to the logger's group.
+
+        Returns
+        -------
+        True if the data was transmitted, False if it was skipped.
+        """
+        metadata = self._build_metadata(group_name=group_name)
+        feed_key = f"{self._group(group_name).key}.{feed_name}"
         try:
             self.aio.send(feed_key, datapoint, metadata)
-        except (AdafruitIOError, RequestException):
+        except (AdafruitIOError, RequestError, ThrottlingError, RequestException, RateLimited) as exc:
+            if self._server_failed(exc):
+                self._server_breaker.record_failure()
+            elif isinstance(exc, (AdafruitIOError, RequestError)) and not isinstance(exc, ThrottlingError):
+                self._feed_breaker(feed_key).record_failure()
+            self._check_not_found(exc)
             eprint(f"WARN: Unable to transmit data ({datapoint}) to feed {feed_key} - skipped.")
+            DATA_SKIPPED.labels("unsent").inc()
+            return False
+        self._server_breaker.record_success()
+        self._feed_breaker(feed_key).record_success()
+        _DATA_SENT.inc()
+        return True
+
+    def log_batch(self, data: Dict[str, Any], group_name: Optional[str] = None) -> List[str]:
+        """
+        Log data for several feeds of a group to Adafruit.IO in a single request.
+
+        All datapoints share the same metadata and timestamp. If Adafruit.IO rejects
+        the batch as invalid (400 or 422), each datapoint is retried on its own so
+        that one bad feed doesn't cost the others their data. If the server can't
+        be reached at all, or is throttling us, the whole batch is skipped.
+
+        Feeds whose circuit breaker is open are skipped without being sent, as
+        is everything while the server's breaker is open.
+
+        Parameters
+        ----------
+        data: A dict mapping feed names to the data to add to each feed.
+        group_name: The name of the group; defaults to the logger's group.
+
+        Returns
+        -------
+        A list of the feed names whose data could not be transmitted.
+        """
+        if not data:
+            return []
+        group = self._group(group_name)
+        if not self._server_breaker.allow():
+            DATA_SKIPPED.labels("circuit_open").inc(len(data))
+            return list(data)
+        skipped = [feed for feed in data if not self._feed_breaker(f"{group.key}.{feed}").allow()]
+        if skipped:
+            DATA_SKIPPED.labels("circuit_open").inc(len(skipped))
+            data = {feed: datapoint for feed, datapoint in data.items() if feed not in skipped}
+            if not data:
+                return skipped
+        metadata = self._build_metadata(group_name=group_name)
+        try:
+            unsent = self._publish(group.key, data, metadata)
+            if len(unsent) < len(data):
+                for feed in data:
+                    if feed not in unsent:
+                        self._feed_breaker(f"{group.key}.{feed}").record_success()
+                _DATA_SENT.inc(len(data) - len(unsent))
+                data = unsent
+                if not data:
+                    return skipped
+            records = self.aio.send_group_data(group.key, data, metadata)
+        except (RequestException, RateLimited, ThrottlingError) as exc:
+            # throttled: sending the feeds one at a time would only make it worse,
+            # so the batch is skipped, while the rate limiter pauses
+            if isinstance(exc, RequestException):
+                self._server_breaker.record_failure()
+            eprint(f"WARN: Unable to transmit data ({data}) to group {group.key} - skipped.")
+            DATA_SKIPPED.labels("unsent").inc(len(data))
+            return skipped + list(data)
+        except (AdafruitIOError, RequestError) as exc:
+            if _status(exc) not in (400, 422):
+                if self._server_failed(exc):
+                    self._server_breaker.record_failure()
+                self._check_not_found(exc)
+                eprint(f"WARN: Unable to transmit data ({data}) to group {group.key} - skipped.")
+                DATA_SKIPPED.labels("unsent").inc(len(data))
+                return skipped + list(data)
+            eprint(f"WARN: Batch rejected by group {group.key} - sending feeds one at a time.")
+            return skipped + [feed for feed, datapoint in data.items() if not self._log(feed, datapoint, group_name)]
+        self._server_breaker.record_success()
+        accepted = {
+            str(record.get('feed_key', '')).rsplit('.', 1)[-1]
+            for record in records if isinstance(record, dict)
+        }
+        if not accepted:
+            # nothing to check the response against, so trust the status code
+            accepted = set(data)
+        failed = [feed for feed in data if feed not in accepted]
+        for feed in data:
+            if feed in failed:
+                eprint(f"WARN: Unable to transmit data ({data[feed]}) to feed {group.key}.{feed} - skipped.")
+                self._feed_breaker(f"{group.key}.{feed}").record_failure()
+            else:
+                self._feed_breaker(f"{group.key}.{feed}").record_success()
+        _DATA_SENT.inc(len(data) - len(failed))
+        DATA_SKIPPED.labels("unsent").inc(len(failed))
+        return skipped + failed
+
+    def queue_batch(
+        self, data: Dict[str, Any], created_at: Optional[str] = None, group_name: Optional[str] = None
+    ) -> None:
+        """
+        Store data for several feeds of a group in the outbox and wake the drainer.
+
+        Falls back to log_batch() if no outbox was configured.
+
+        Parameters
+        ----------
+        data: A dict mapping feed names to the data to add to each feed.
+        created_at: The ISO 8601 timestamp of the data; defaults to the current time.
+        group_name: The name of the group; defaults to the logger's group.
+        """
+        self.queue_batches([(data, created_at, group_name)])
+
+    def queue_batches(self, batches: Iterable[Tuple[Dict[str, Any], Optional[str], Optional[str]]]) -> None:
+        """
+        Store several batches, e.g. from different stations, in the outbox in one
+        transaction, and wake the drainer once.
+
+        Falls back to log_batch() for each batch if no outbox was configured.
+
+        Parameters
+        ----------
+        batches: (data, created_at, group_name) tuples, as for queue_batch().
+        """
+        if self.outbox is None:
+            for data, _created_at, group_name in batches:
+                self.log_batch(data, group_name)
+            return
+        entries = []
+        for data, created_at, group_name in batches:
+            station = self.metadata.get(group_name or self.group.name)
+            entries.append((
+                self._group(group_name).key,
+                data,
+                created_at or datetime.now(timezone.utc).isoformat(),
+                dataclasses.asdict(station) if station is not None else None
+            ))
+        self.outbox.put_many(entries)
+        self._wake.set()
+
+    def resolve_pending(self, group_names: Iterable[str]) -> None:
+        """
+        Give the data stored in the outbox before the groups were known, with
+        Outbox.put_pending(), their group keys, and wake the drainer to send it.
+
+        Parameters
+        ----------
+        group_names: The names of the groups the data may belong to.
+        """
+        if self.outbox is None:
+            return
+        if sum(self.outbox.resolve(group_name, self._group(group_name).key) for group_name in group_names):
+            self._wake.set()
+
+    def _publish(
+        self,
+        group_key: str,
+        values: Dict[str, Any],
+        metadata: Optional[Dict],
+        on_ack: Optional[Callable[[str], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Publish values for several feeds of a group over MQTT, if it is available.
+
+        Values which paho queued but which weren't acknowledged in time are in
+        flight: paho resends them once reconnected, so they count as sent.
+        Only those it never queued are left to be sent over REST, and the rate
+        limit budget taken for them is given back, to be taken again then.
+        on_ack is called with the key of each feed whose value the broker has
+        acknowledged, as for MQTTTransport.publish_data().
+
+        Returns
+        -------
+        The values to send over REST instead: all of them if MQTT isn't available.
+
+        Raises
+        ------
+        RateLimited: when the data can't be sent yet.
+        """
+        if self.mqtt is None or not self.mqtt.connected:
+            return values
+        self.aio.acquire(len(values))
+        try:
+            self.mqtt.publish_data(group_key, values, metadata, on_ack)
+        except MQTTUnavailable as exc:
+            self.aio.release(len(exc.unsent))
+            if exc.unsent:
+                eprint(
+                    f"WARN: Unable to publish {len(exc.unsent)} of {len(values)} data to group {group_key} "
+                    f"over MQTT ({exc}) - using REST for those."
+                )
+            else:
+                eprint(
+                    f"WARN: Data published to group {group_key} over MQTT not acknowledged ({exc}) - left in flight."
+                )
+            return exc.unsent
+        # e.g. the probe of a server breaker which opened while REST was down
+        self._server_breaker.record_success()
+        return {}
+
+    def close(self) -> None:
+        """
+        Stop the drainer thread, and close the outbox and MQTT connection.
+        """
+        if self._drainer is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._drainer.join(timeout=10)
+            self._drainer = None
+        # first, so no acknowledgement arrives once the outbox is closed
+        if self.mqtt is not None:
+            self.mqtt.close()
+            self.mqtt = None
+        if self.outbox is not None:
+            self.outbox.close()
+            self.outbox = None
+
+    def _drain_loop(self) -> None:
+        """
+        Send the outbox backlog whenever woken, backing off while sends are failing.
+        """
+        delay = 0.0
+        while not self._stopping.is_set():
+            if delay:
+                # while backing off, new data doesn't trigger an early retry
+                self._stopping.wait(delay)
+            else:
+                self._wake.wait()
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            if self.drain():
+                delay = 0.0
+            elif self._retry_after:
+                delay, self._retry_after = self._retry_after, 0.0
+            else:
+                delay = min(max(delay * 2, self._DRAIN_MIN_DELAY), self._DRAIN_MAX_DELAY)
+
+    def drain(self) -> bool:
+        """
+        Send everything in the outbox, oldest first, in bulk.
+
+        The latest sampling cycle of each group is sent at high priority. A
+        backlog is replayed at low priority: if sending it now would eat into
+        the rate limit budget needed for new data, it is held back, to go out in
+        bigger batches later. Each chunk has send_budget seconds to be sent,
+        retries included. If Adafruit.IO rejects a chunk as invalid, it is sent
+        again in halves, so that only the data it rejects on their own is dropped.
+
+        Returns
+        -------
+        True if the outbox was emptied, False if sending failed and should be retried later.
+        """
+        if self.outbox is None:
+            return True
+        max_size = self._DRAIN_BATCH_SIZE
+        if self.aio.limiter is not None:
+            max_size = min(max_size, self.aio.limiter.max_cost(TokenBucket.LOW))
+        while True:
+            with self._in_flight_lock:
+                in_flight = set(self._in_flight)
+            # the data published over MQTT stays in the outbox until acknowledged, but isn't sent again
+            batch = [
+                datum for datum in self.outbox.peek(self._DRAIN_BATCH_SIZE + len(in_flight))
+                if datum.rowid not in in_flight
+            ][:self._DRAIN_BATCH_SIZE]
+            if not batch:
+                return True
+            chunk: List[QueuedDatum] = []
+            try:
+                for chunk, backlog in self._split_queued(batch, max_size):
+                    with self.aio.low_priority() if backlog else nullcontext(), budget(self.send_budget):
+                        try:
+                            self._send_queued(chunk)
+                            _DATA_SENT.inc(len(chunk))
+                            self._server_breaker.record_success()
+                        except (AdafruitIOError, RequestError) as exc:
+                            if _status(exc) not in (400, 422):
+                                self._check_not_found(exc)
+                                raise
+                            self._send_bisected(chunk)
+                        self._remove_sent(chunk)
+            except RateLimited as exc:
+                eprint(f"Holding back {len(self.outbox)} queued data for {exc.wait:.0f}s to stay within the data rate.")
+                self._retry_after = exc.wait
+                return False
+            except (AdafruitIOError, RequestError, ThrottlingError, RequestException) as exc:
+                if self._server_failed(exc):
+                    self._server_breaker.record_failure()
+                eprint(f"WARN: Unable to transmit {len(self.outbox)} queued data - will retry.")
+                _DATA_FAILED.inc(len(chunk))
+                return False
+
+    def _send_bisected(self, chunk: List[QueuedDatum]) -> None:
+        """
+        Send a chunk of queued data which Adafruit.IO rejected as invalid in halves,
+        and those in halves, and so on, dropping only the data rejected on its own.
+
+        Each half is removed from the outbox once it has been sent or dropped.
+
+        Parameters
+        ----------
+        chunk: The chunk which was rejected, as for _send_queued().
+        """
+        if len(chunk) == 1:
+            datum = chunk[0]
+            eprint(
+                f"WARN: Adafruit.IO rejected queued data ({datum.value}) for feed {datum.group}.{datum.feed}"
+                " as invalid - dropped."
+            )
+            DATA_SKIPPED.labels("rejected").inc()
+            return
+        middle = len(chunk) // 2
+        for half in (chunk[:middle], chunk[middle:]):
+            try:
+                self._send_queued(half)
+                _DATA_SENT.inc(len(half))
+            except (AdafruitIOError, RequestError) as exc:
+                if _status(exc) not in (400, 422):
+                    raise
+                self._send_bisected(half)
+            self._remove_sent(half)
+
+    def _remove_sent(self, chunk: List[QueuedDatum]) -> None:
+        """
+        Remove queued data which has been sent, or dropped, from the outbox,
+        leaving any published over MQTT until it is acknowledged.
+        """
+        if self.outbox is None:
+            return
+        with self._in_flight_lock:
+            self.outbox.remove(datum.rowid for datum in chunk if datum.rowid not in self._in_flight)
+
+    @staticmethod
+    def _split_queued(batch: List[QueuedDatum], max_size: int) -> List[Tuple[List[QueuedDatum], bool]]:
+        """
+        Split a batch of queued data into the chunks to send in one request each.
+
+        The batch is split by group first, so the stations sharing the outbox
+        are all sent in the same pass. A group holding a single sampling cycle
+        is sent whole, as group data; a longer backlog is split up by feed, into
+        chunks of at most max_size.
+
+        Parameters
+        ----------
+        batch: The queued data to send, in timestamp order.
+        max_size: The most data to put in one chunk of a backlog.
+
+        Returns
+        -------
+        A list of (chunk, backlog) tuples, each chunk in timestamp order, and
+        backlog True if it is part of a backlog.
+        """
+        by_group: Dict[str, List[QueuedDatum]] = {}
+        for datum in batch:
+            by_group.setdefault(datum.group, []).append(datum)
+        chunks = []
+        for group_data in by_group.values():
+            if len({datum.created_at for datum in group_data}) == 1:
+                chunks.append((group_data, False))
+                continue
+            by_feed = sorted(group_data, key=lambda datum: datum.feed)
+            for _feed, data in itertools.groupby(by_feed, key=lambda datum: datum.feed):
+                feed_data = list(data)
+                chunks.extend((feed_data[i:i + max_size], True) for i in range(0, len(feed_data), max_size))
+        return chunks
+
+    def _acknowledged(self, rowid: int) -> None:
+        """
+        Remove a datum published over MQTT from the outbox, now that the broker has acknowledged it.
+        """
+        with self._in_flight_lock:
+            self._in_flight.discard(rowid)
+            if self.outbox is not None:
+                self.outbox.remove([rowid])
+
+    def _send_queued(self, chunk: List[QueuedDatum]) -> None:
+        """
+        Send a chunk of queued data in one request, keeping their original timestamps.
+
+        A single sampling cycle is published over MQTT if it is available; the
+        data published stays in the outbox, marked as in flight, until the
+        broker acknowledges it, so that it isn't lost if the process stops
+        first. It may then be sent twice, but never not at all.
+
+        Parameters
+        ----------
+        chunk: Either data from a single sampling cycle, or data for a single feed.
+        """
+        first = chunk[0]
+        if all(datum.created_at == first.created_at for datum in chunk):
+            metadata = {
+                'lat': first.lat, 'lon': first.lon, 'ele': first.ele,
+                'created_at': first.created_at
+            }
+            rowids = {datum.feed: datum.rowid for datum in chunk}
+            with self._in_flight_lock:
+                self._in_flight.update(rowids.values())
+            # if publishing fails outright, none of them are left in flight
+            unsent: Dict[str, Any] = dict(rowids)
+            try:
+                unsent = self._publish(
+                    first.group,
+                    {datum.feed: datum.value for datum in chunk},
+                    metadata,
+                    lambda feed: self._acknowledged(rowids[feed])
+                )
+            finally:
+                with self._in_flight_lock:
+                    self._in_flight.difference_update(rowids[feed] for feed in unsent)
+            if unsent:
+                self.aio.send_group_data(first.group, unsent, metadata)
+            return
+        records = []
+        for datum in chunk:
+            record: Dict[str, Any] = {'value': datum.value, 'created_at': datum.created_at}
+            if datum.lat is not None or datum.lon is not None or datum.ele is not None:
+                record.update(lat=datum.lat, lon=datum.lon, ele=datum.ele)
+            records.append(record)
+        self.aio.send_feed_batch(f"{first.group}.{first.feed}", records)
@@ -0,0 +1,426 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Bulk export of feed history from Adafruit.IO, and backfill of it to Adafruit.IO.
+
+Usage:
+    python3 aio_transfer.py export outdoor.temperature temperature.csv --since 30d
+    python3 aio_transfer.py export outdoor.pressure pressure.tcf --format columnar
+    python3 aio_transfer.py backfill outdoor.temperature temperature.csv
+"""
+
+import argparse
+from array import array
+import csv
+from datetime import datetime, timezone
+import itertools
+import json
+import math
+import os
+import struct
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from requests import RequestException
+from Adafruit_IO import AdafruitIOError, RequestError, ThrottlingError
+
+from aio_logger import AIOClient, AIOLogger, retry_after
+from deadline import budget
+from eprint import eprint
+from rate_limit import RateLimited, TokenBucket
+from settings import Settings
+from tsdb import parse_duration
+
+FIELDS = ('created_at', 'value', 'lat', 'lon', 'ele')
+# the wait after throttling without a Retry-After, doubling each time in a row, in seconds
+THROTTLE_MIN_WAIT = 5.0
+THROTTLE_MAX_WAIT = 300.0
+
+
+def _to_epoch(timestamp: str) -> float:
+    """
+    Convert an ISO 8601 timestamp, as used by Adafruit.IO, to seconds since the epoch.
+    """
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp()
+
+
+def _to_iso(epoch: float) -> str:
+    """
+    Convert seconds since the epoch to an ISO 8601 timestamp in UTC.
+    """
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+
+class ColumnarFile:
+    """
+    Compact columnar file of feed data, written and read one block at a time.
+
+    The file is a sequence of blocks, each a header with the number of rows
+    and whether there is location data, then little-endian float64 columns of
+    that many values: the timestamp in seconds since the epoch and the value,
+    and only if there is location data, lat, lon and ele (NaN where missing).
+    Only numeric values can be stored. Blocks keep memory use constant however
+    long the file is.
+    """
+    MAGIC = b'TCF1'
+    _BLOCK = struct.Struct('<4sIB')
+    _HAS_LOCATION = 0x01
+    BLOCK_ROWS = 1000
+
+    @classmethod
+    def write(cls, path: str, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Write feed data to a columnar file.
+
+        Parameters
+        ----------
+        path: The file to write.
+        records: Data records, each with created_at, value, lat, lon and ele.
+
+        Returns
+        -------
+        The number of records written.
+
+        Raises
+        ------
+        ValueError: when a value isn't numeric.
+        """
+        written = 0
+        with open(path, 'wb') as file:
+            records = iter(records)
+            while True:
+                block = list(itertools.islice(records, cls.BLOCK_ROWS))
+                if not block:
+                    return written
+                columns = [array('d') for _field in FIELDS]
+                for record in block:
+                    columns[0].append(_to_epoch(record['created_at']))
+                    try:
+                        columns[1].append(float(record['value']))
+                    except (TypeError, ValueError) as exc:
+                        raise ValueError(
+                            f"Value {record['value']!r} isn't numeric - use the csv format instead."
+                        ) from exc
+                    for column, field in zip(columns[2:], FIELDS[2:]):
+                        value = record.get(field)
+                        column.append(math.nan if value is None else float(value))
+                has_location = any(not math.isnan(value) for column in columns[2:] for value in column)
+                if not has_location:
+                    columns = columns[:2]
+                file.write(cls._BLOCK.pack(cls.MAGIC, len(block), cls._HAS_LOCATION if has_location else 0))
+                for column in columns:
+                    if sys.byteorder == 'big':
+                        column.byteswap()
+                    file.write(column.tobytes())
+                written += len(block)
+
+    @classmethod
+    def read(cls, path: str) -> Iterator[Dict[str, Any]]:
+        """
+        Read feed data from a columnar file, one block at a time.
+
+        Parameters
+        ----------
+        path: The file to read.
+
+        Returns
+        -------
+        An iterator of data records, each with created_at, value, lat, lon and ele.
+
+        Raises
+        ------
+        ValueError: when the file isn't a columnar file.
+        """
+        with open(path, 'rb') as file:
+            while True:
+                header = file.read(cls._BLOCK.size)
+                if not header:
+                    return
+                magic, rows, flags = cls._BLOCK.unpack(header)
+                if magic != cls.MAGIC:
+                    raise ValueError(f"{path} is not a columnar feed data file.")
+                columns = []
+                for _field in FIELDS if flags & cls._HAS_LOCATION else FIELDS[:2]:
+                    column = array('d')
+                    column.frombytes(file.read(rows * column.itemsize))
+                    if sys.byteorder == 'big':
+                        column.byteswap()
+                    columns.append(column)
+                for row in zip(*columns):
+                    record: Dict[str, Any] = {'created_at': _to_iso(row[0]), 'value': str(row[1])}
+                    for index, field in enumerate(FIELDS[2:], 2):
+                        value = row[index] if index < len(row) else math.nan
+                        record[field] = None if math.isnan(value) else value
+                    yield record
+
+    @classmethod
+    def detect(cls, path: str) -> bool:
+        """
+        Check whether a file is a columnar file, rather than CSV.
+        """
+        with open(path, 'rb') as file:
+            return file.read(len(cls.MAGIC)) == cls.MAGIC
+
+
+def write_csv(path: str, records: Iterable[Dict[str, Any]]) -> int:
+    """
+    Write feed data to a CSV file, with a header row.
+
+    Parameters
+    ----------
+    path: The file to write.
+    records: Data records, each with created_at, value, lat, lon and ele.
+
+    Returns
+    -------
+    The number of records written.
+    """
+    written = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(FIELDS)
+        for record in records:
+            writer.writerow(['' if record.get(field) is None else record[field] for field in FIELDS])
+            written += 1
+    return written
+
+
+def read_csv(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read feed data from a CSV file, as written by write_csv().
+
+    Parameters
+    ----------
+    path: The file to read.
+
+    Returns
+    -------
+    An iterator of data records, each with created_at, value, lat, lon and ele.
+    """
+    with open(path, newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            record: Dict[str, Any] = {'created_at': row['created_at'], 'value': row['value']}
+            for field in FIELDS[2:]:
+                record[field] = float(row[field]) if row.get(field) else None
+            yield record
+
+
+def export(
+    aio: AIOClient,
+    feed_key: str,
+    path: str,
+    columnar: bool = False,
+    start_time: Optional[str] = None,
+    page_budget: float = 60.0
+) -> int:
+    """
+    Stream the history of a feed to a file, one page at a time, newest first.
+
+    Parameters
+    ----------
+    aio: The Adafruit.IO client.
+    feed_key: The full key of the feed, e.g. outdoor.temperature.
+    path: The file to write.
+    columnar: Whether to write a columnar file rather than CSV.
+    start_time: Optional ISO 8601 time of the oldest data wanted.
+    page_budget: The deadline budget for fetching each page, in seconds.
+
+    Returns
+    -------
+    The number of records written.
+    """
+    def records() -> Iterator[Dict[str, Any]]:
+        pages = aio.iter_data(feed_key, start_time=start_time)
+        while True:
+            with budget(page_budget):
+                record = next(pages, None)
+            if record is None:
+                return
+            yield record
+
+    if columnar:
+        return ColumnarFile.write(path, records())
+    return write_csv(path, records())
+
+
+class Checkpoint:
+    """
+    Progress of a backfill, saved after every chunk so an interrupted backfill can resume.
+    """
+    def __init__(self, path: str, feed_key: str, source: str):
+        """
+        Parameters
+        ----------
+        path: The checkpoint file.
+        feed_key: The full key of the feed being backfilled.
+        source: The file being backfilled from.
+        """
+        self.path = path
+        self.feed_key = feed_key
+        self.source = os.path.abspath(source)
+        self.done = 0
+        try:
+            with open(path, encoding='utf-8') as file:
+                saved = json.load(file)
+            if saved.get('feed') == feed_key and saved.get('source') == self.source:
+                self.done = int(saved.get('done', 0))
+        except (OSError, ValueError):
+            pass
+
+    def save(self, done: int) -> None:
+        """
+        Record that the first done records have been sent.
+        """
+        self.done = done
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'feed': self.feed_key, 'source': self.source, 'done': done}, file)
+        os.replace(temp_path, self.path)
+
+    def remove(self) -> None:
+        """
+        Remove the checkpoint, once the backfill is complete.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def backfill(
+    logger: AIOLogger,
+    feed_key: str,
+    records: Iterable[Dict[str, Any]],
+    checkpoint: Checkpoint,
+    chunk_size: int = 100,
+    chunk_budget: float = 60.0
+) -> int:
+    """
+    Send records to a feed in chunked batch uploads, resuming from a checkpoint.
+
+    Chunks are sent at low priority, so that a monitor sharing the account's
+    data rate keeps its reserve, and the backfill waits for the rate limiter
+    rather than failing. If Adafruit.IO throttles a chunk anyway, it is sent
+    again after the wait asked for, or else after a backoff.
+
+    Parameters
+    ----------
+    logger: The Adafruit.IO logger whose client to use.
+    feed_key: The full key of the feed.
+    records: Data records, each with created_at, value, lat, lon and ele.
+    checkpoint: Where progress is saved; records already sent are skipped.
+    chunk_size: The most records to send in one request.
+    chunk_budget: The deadline budget for sending each chunk, in seconds.
+
+    Returns
+    -------
+    The number of records sent, including those sent before resuming.
+
+    Raises
+    ------
+    RequestException, AdafruitIOError or RequestError: when a chunk can't be sent.
+    """
+    aio = logger.aio
+    # learn the account's data rate, to size the chunks to it
+    aio.acquire(0)
+    if aio.limiter is not None:
+        chunk_size = min(chunk_size, aio.limiter.max_cost(TokenBucket.LOW))
+    done = checkpoint.done
+    pending = itertools.islice(records, done, None)
+    throttle_wait = THROTTLE_MIN_WAIT
+    while True:
+        chunk: List[Dict[str, Any]] = []
+        for record in itertools.islice(pending, chunk_size):
+            item: Dict[str, Any] = {'value': record['value'], 'created_at': record['created_at']}
+            if any(record.get(field) is not None for field in FIELDS[2:]):
+                item.update({field: record.get(field) for field in FIELDS[2:]})
+            chunk.append(item)
+        if not chunk:
+            return done
+        while True:
+            try:
+                with aio.low_priority(), budget(chunk_budget):
+                    aio.send_feed_batch(feed_key, chunk)
+                break
+            except RateLimited as exc:
+                time.sleep(exc.wait)
+            except ThrottlingError as exc:
+                wait = retry_after(exc)
+                if wait is None:
+                    wait = throttle_wait
+                    throttle_wait = min(throttle_wait * 2, THROTTLE_MAX_WAIT)
+                eprint(f"WARN: Throttled by Adafruit.IO - trying again in {wait:.0f}s.")
+                time.sleep(wait)
+        throttle_wait = THROTTLE_MIN_WAIT
+        done += len(chunk)
+        checkpoint.save(done)
+        eprint(f"Backfilled {done} data to {feed_key}.")
+
+
+def main() -> None:
+    """
+    Entry point function when run from command line.
+    """
+    parser = argparse.ArgumentParser(description="Export feed history from Adafruit.IO, or backfill it.")
+    parser.add_argument('--config', default='config.ini', help="settings file (default: config.ini)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help="stream a feed's history to a file, newest first")
+    export_parser.add_argument('--format', choices=['csv', 'columnar'], default='csv')
+    export_parser.add_argument('--since', type=parse_duration, default=None, help="e.g. 30d (default: everything)")
+    backfill_parser = commands.add_parser('backfill', help="send a file of feed data to a feed, resumably")
+    backfill_parser.add_argument('--chunk-size', type=int, default=100, help="data per request (default: 100)")
+    backfill_parser.add_argument(
+        '--checkpoint', default=None, help="progress file (default: the data file with .checkpoint added)"
+    )
+    for command in (export_parser, backfill_parser):
+        command.add_argument('feed', help="full feed key, e.g. outdoor.temperature")
+        command.add_argument('file')
+    args = parser.parse_args()
+
+    try:
+        settings = Settings(args.config)
+    except RuntimeError as exc:
+        eprint(exc)
+        sys.exit(1)
+    logger: Optional[AIOLogger] = None
+    try:
+        if args.command == 'export':
+            aio = AIOClient(settings.adafruit_username, settings.adafruit_key)
+            start_time = _to_iso(time.time() - args.since) if args.since is not None else None
+            count = export(aio, args.feed, args.file, args.format == 'columnar', start_time, settings.upload_budget)
+            eprint(f"Exported {count} data from {args.feed} to {args.file}.")
+        else:
+            logger = AIOLogger(
+                settings.adafruit_username,
+                settings.adafruit_key,
+                group_name=settings.stations[0].group,
+                limiter=TokenBucket(settings.data_rate)
+            )
+            group_key, _sep, feed_name = args.feed.rpartition('.')
+            group_name = next((name for name, key in logger.group_keys.items() if key == group_key), None)
+            if group_key and group_name is None:
+                eprint(f"ERR: There is no group with the key {group_key} at Adafruit.IO - create it first.")
+                sys.exit(1)
+            # creates the feed if needed, e.g. when moving to a new account
+            feed_key = logger.get_feed(feed_name, group_name).key
+            records = ColumnarFile.read(args.file) if ColumnarFile.detect(args.file) else read_csv(args.file)
+            checkpoint = Checkpoint(args.checkpoint or f"{args.file}.checkpoint", feed_key, args.file)
+            if checkpoint.done:
+                eprint(f"Resuming after {checkpoint.done} data already sent.")
+            count = backfill(logger, feed_key, records, checkpoint, args.chunk_size, settings.upload_budget)
+            checkpoint.remove()
+            eprint(f"Backfilled {count} data from {args.file} to {feed_key}.")
+    except (AdafruitIOError, RequestError, RequestException, OSError, ValueError) as exc:
+        eprint(f"ERR: {args.command.capitalize()} failed: {exc}")
+        if args.command == 'backfill':
+            eprint("Run the same command again to resume.")
+        sys.exit(1)
+    finally:
+        if logger is not None:
+            logger.close()
+
+
+if __name__ == '__main__':
+    main()
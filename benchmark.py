@@ -0,0 +1,251 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark the logging pipeline against fake sensors and a local fake Adafruit.IO.
+
+Usage:
+    python3 benchmark.py --cycles 500
+    python3 benchmark.py --outbox --server-latency 0.1 --throttle-rate 0.05 --error-rate 0.02
+    python3 benchmark.py --api-calls 200 --json
+    python3 benchmark.py --outbox --mqtt --server-latency 0.05
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+from aio_logger import AIOLogger
+from fakes import FakeAdafruitIO, FakeAM2320, FakeBMP388, FakeMQTTBroker
+from get_api import GetApi
+from mqtt_transport import MQTTTransport
+from outbox import Outbox
+from rate_limit import TokenBucket
+from sensors import Sensor, SensorRegistry
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """
+    Get the median, 90th and 99th percentiles and maximum of some samples.
+    """
+    if len(samples) < 2:
+        value = samples[0] if samples else 0.0
+        return {'p50': value, 'p90': value, 'p99': value, 'max': value}
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {'p50': cuts[49], 'p90': cuts[89], 'p99': cuts[98], 'max': max(samples)}
+
+
+def run_pipeline(
+    args: argparse.Namespace, server: FakeAdafruitIO, workdir: str, broker: Optional[FakeMQTTBroker] = None
+) -> Dict[str, Any]:
+    """
+    Run sampling cycles through an AIOLogger, and measure them.
+
+    Each cycle reads every station's fake sensors through its sensor registry,
+    rounds the data and hands it all to the logger at once, as the monitor
+    does. With an outbox, uploads happen on the drainer thread, and the run
+    only ends once the outbox is empty or the drain timeout has passed. With a
+    broker, data is published to it over MQTT.
+    """
+    outbox = Outbox(os.path.join(workdir, "outbox.sqlite3")) if args.outbox else None
+    limiter = TokenBucket(args.data_rate) if args.data_rate else None
+    mqtt = None
+    if broker is not None:
+        mqtt = MQTTTransport("bench", "bench-key", host="127.0.0.1", port=broker.port, tls=False, limiter=limiter)
+        mqtt.wait_connected(5.0)
+    aio_logger = AIOLogger(
+        "bench", "bench-key", group_name="outdoor", outbox=outbox, limiter=limiter, base_url=server.url, mqtt=mqtt
+    )
+    stations: Dict[str, SensorRegistry] = {}
+    for number in range(1, args.stations + 1):
+        group = "outdoor" if args.stations == 1 else f"outdoor-{number}"
+        bmp388 = FakeBMP388(args.sensor_latency, args.sensor_failure_rate, args.seed)
+        am2320 = FakeAM2320(args.sensor_latency, args.sensor_failure_rate, args.seed)
+        sensors = SensorRegistry([
+            Sensor(
+                "am2320", am2320, f"{number}-1", {"temperature": "temperature", "humidity": "relative_humidity"},
+                args.sensor_timeout
+            ),
+            Sensor(
+                "bmp388", bmp388, f"{number}-1" if args.shared_bus else f"{number}-2", {"pressure": "pressure"},
+                args.sensor_timeout
+            )
+        ])
+        for feed in sensors.feeds:
+            aio_logger.get_feed(feed, group)
+        stations[group] = sensors
+
+    latencies: List[float] = []
+    sensor_failures = 0
+    start = time.perf_counter()
+    for _cycle in range(args.cycles):
+        cycle_start = time.perf_counter()
+        created_at = datetime.now(timezone.utc).isoformat()
+        batches = []
+        for group, sensors in stations.items():
+            try:
+                data = {feed: round(value, 1) for feed, value in sensors.read(sensors.feeds).items()}
+            except OSError:
+                sensor_failures += 1
+                continue
+            batches.append((data, created_at, group))
+        if batches:
+            aio_logger.queue_batches(batches)
+        latencies.append(time.perf_counter() - cycle_start)
+        if args.interval > 0:
+            time.sleep(max(0.0, args.interval - (time.perf_counter() - cycle_start)))
+    if outbox is not None:
+        deadline = time.perf_counter() + args.drain_timeout
+        while len(outbox) and time.perf_counter() < deadline:
+            time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    unsent = len(outbox) if outbox is not None else 0
+    for sensors in stations.values():
+        sensors.close()
+    aio_logger.close()
+    return {
+        'cycles': args.cycles,
+        'stations': args.stations,
+        'sensor_failures': sensor_failures,
+        'cycle_ms': {name: value * 1000 for name, value in percentiles(latencies).items()},
+        'elapsed_s': elapsed,
+        'data_uploaded': server.data_points,
+        'uploads_per_s': server.data_points / elapsed if elapsed else 0.0,
+        'requests': server.requests,
+        'requests_per_s': server.requests / elapsed if elapsed else 0.0,
+        'mqtt_publishes': broker.publishes if broker is not None else 0,
+        'throttled': server.throttled,
+        'server_errors': server.errors,
+        'unsent': unsent
+    }
+
+
+def run_get_api(args: argparse.Namespace, server: FakeAdafruitIO) -> Dict[str, Any]:
+    """
+    Make uncached GET API calls to the fake server, and measure them.
+    """
+    api = GetApi()
+    url = api.build_url(server.url, "api/v2/bench/throttle", {'x-aio-key': "bench-key"})
+    latencies: List[float] = []
+    failures = 0
+    for _call in range(args.api_calls):
+        call_start = time.perf_counter()
+        try:
+            api.call_get_api(url, lambda json_data: json_data['data_rate_limit'])
+        except (LookupError, TypeError, ValueError, OSError):
+            # requests' exceptions are all OSErrors
+            failures += 1
+        latencies.append(time.perf_counter() - call_start)
+    return {
+        'calls': args.api_calls,
+        'failures': failures,
+        'call_ms': {name: value * 1000 for name, value in percentiles(latencies).items()}
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """
+    Print a benchmark report in a readable form.
+    """
+    pipeline = report.get('pipeline')
+    if pipeline is not None:
+        cycle = pipeline['cycle_ms']
+        print(
+            f"Cycles:         {pipeline['cycles']} of {pipeline['stations']} station(s) "
+            f"({pipeline['sensor_failures']} sensor failures)"
+        )
+        print(
+            f"Cycle latency:  p50 {cycle['p50']:.2f} ms, p90 {cycle['p90']:.2f} ms, "
+            f"p99 {cycle['p99']:.2f} ms, max {cycle['max']:.2f} ms"
+        )
+        print(
+            f"Uploads:        {pipeline['data_uploaded']} data in {pipeline['elapsed_s']:.2f}s "
+            f"({pipeline['uploads_per_s']:.1f}/s), {pipeline['unsent']} unsent"
+        )
+        print(
+            f"Requests:       {pipeline['requests']} ({pipeline['requests_per_s']:.1f}/s), "
+            f"{pipeline['throttled']} throttled, {pipeline['server_errors']} server errors"
+        )
+        if pipeline['mqtt_publishes']:
+            print(f"MQTT:           {pipeline['mqtt_publishes']} publishes")
+    api = report.get('get_api')
+    if api is not None:
+        call = api['call_ms']
+        print(
+            f"GET API:        {api['calls']} calls ({api['failures']} failed), p50 {call['p50']:.2f} ms, "
+            f"p90 {call['p90']:.2f} ms, p99 {call['p99']:.2f} ms, max {call['max']:.2f} ms"
+        )
+    memory = report['memory']
+    print(
+        f"Memory:         peak traced {memory['traced_peak_kib']:.0f} KiB, "
+        f"max RSS {memory['max_rss_kib']:.0f} KiB"
+    )
+
+
+def main() -> None:
+    """
+    Entry point function when run from command line.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the logging pipeline without hardware or network.")
+    parser.add_argument('--cycles', type=int, default=200, help="sampling cycles to run (default: 200)")
+    parser.add_argument('--stations', type=int, default=1, help="stations sharing the logger (default: 1)")
+    parser.add_argument('--interval', type=float, default=0.0, help="seconds between cycles (default: none)")
+    parser.add_argument('--outbox', action='store_true', help="queue data in an outbox, as the monitor does")
+    parser.add_argument('--mqtt', action='store_true', help="publish data over MQTT to a fake broker")
+    parser.add_argument('--data-rate', type=int, default=0, help="client-side rate limit, per minute")
+    parser.add_argument('--drain-timeout', type=float, default=60.0, help="longest to wait for the outbox")
+    parser.add_argument('--sensor-latency', type=float, default=0.0, help="seconds per sensor read")
+    parser.add_argument('--sensor-timeout', type=float, default=2.0, help="seconds before a read is abandoned")
+    parser.add_argument('--shared-bus', action='store_true', help="put both sensors on one I2C bus")
+    parser.add_argument('--sensor-failure-rate', type=float, default=0.0, help="fraction of failed reads")
+    parser.add_argument('--server-latency', type=float, default=0.0, help="seconds per response")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of 429 responses")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of 5xx responses")
+    parser.add_argument('--server-data-rate', type=int, default=None, help="server-side data rate, per minute")
+    parser.add_argument('--api-calls', type=int, default=0, help="GET API calls to make (default: none)")
+    parser.add_argument('--seed', type=int, default=None, help="seed for fake readings and failures")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    server = FakeAdafruitIO(
+        latency=args.server_latency,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        data_rate=args.server_data_rate,
+        seed=args.seed
+    )
+    broker = FakeMQTTBroker(server, latency=args.server_latency) if args.mqtt else None
+    report: Dict[str, Any] = {}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            if args.cycles > 0:
+                report['pipeline'] = run_pipeline(args, server, workdir, broker)
+            if args.api_calls > 0:
+                report['get_api'] = run_get_api(args, server)
+    finally:
+        if broker is not None:
+            broker.close()
+        server.close()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report['memory'] = {
+        'traced_peak_kib': peak / 1024,
+        # ru_maxrss is in KiB on Linux
+        'max_rss_kib': float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Circuit breakers, to stop spending time on a component which keeps failing.
+"""
+
+import threading
+import time
+from typing import Callable
+
+from eprint import eprint
+from metrics import REGISTRY
+
+_CIRCUIT_OPEN = REGISTRY.gauge(
+    "tempmon_circuit_open", "1 while a component's circuit breaker is open or half-open, otherwise 0.", ["component"]
+)
+_CIRCUIT_REJECTED = REGISTRY.counter(
+    "tempmon_circuit_rejected_total", "Calls skipped because a component's circuit breaker was open.", ["component"]
+)
+
+
+class CircuitBreaker:
+    """
+    Stop calling a component after repeated failures, and probe it now and then.
+
+    While closed, every call is allowed and consecutive failures are counted.
+    After failure_threshold failures in a row the breaker opens: calls are
+    refused, at no cost, until reset_timeout has passed. It is then half-open,
+    and lets a single probe call through. If the probe succeeds the breaker
+    closes again; if it fails, the breaker reopens for twice as long as before,
+    up to max_reset_timeout, so a component which stays dead is probed less and
+    less often.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        max_reset_timeout: float = 600.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Parameters
+        ----------
+        name: The component protected, for logging and metrics, e.g. sensor am2320.
+        failure_threshold: The failures in a row which open the breaker.
+        reset_timeout: How long the breaker first stays open before a probe, in seconds.
+        max_reset_timeout: The longest the breaker stays open before a probe, in seconds.
+        clock: The time source, in seconds.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._open_for = reset_timeout
+        self._retry_at = 0.0
+        _CIRCUIT_OPEN.labels(name).set(0)
+
+    @property
+    def state(self) -> str:
+        """
+        Get the state of the breaker: closed, open or half-open
+        """
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        Check whether a call may be made now.
+
+        Once the breaker has been open long enough, this lets one probe
+        through; the caller must then report its outcome. A probe which is
+        never reported is given up on after reset_timeout.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            now = self._clock()
+            if now >= self._retry_at:
+                self._state = self.HALF_OPEN
+                self._retry_at = now + self.reset_timeout
+                return True
+        _CIRCUIT_REJECTED.labels(self.name).inc()
+        return False
+
+    def record_success(self) -> None:
+        """
+        Report a successful call, closing the breaker.
+        """
+        with self._lock:
+            recovered = self._state != self.CLOSED
+            self._state = self.CLOSED
+            self._failures = 0
+            self._open_for = self.reset_timeout
+        if recovered:
+            _CIRCUIT_OPEN.labels(self.name).set(0)
+            eprint(f"{self.name} recovered.")
+
+    def record_failure(self) -> None:
+        """
+        Report a failed call, opening the breaker after too many in a row.
+        """
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN:
+                self._open_for = min(self._open_for * 2, self.max_reset_timeout)
+            elif self._state == self.OPEN or self._failures < self.failure_threshold:
+                return
+            self._state = self.OPEN
+            self._retry_at = self._clock() + self._open_for
+            open_for = self._open_for
+        _CIRCUIT_OPEN.labels(self.name).set(1)
+        eprint(f"WARN: {self.name} failed {self._failures} times in a row - not trying again for {open_for:.0f}s.")
@@ -0,0 +1,97 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Send-on-delta filter, to avoid uploading values which haven't changed.
+"""
+
+import time
+from typing import Dict, Optional, Tuple
+
+# slack for comparing a change with a deadband, as rounded readings don't
+# subtract exactly, e.g. 20.3 - 20.1 is a little under 0.2
+_TOLERANCE = 1e-9
+
+
+class DeltaFilter:
+    """
+    Send-on-delta filter with a heartbeat.
+
+    A value is only sent if it differs from the last value sent to the same feed
+    by at least that feed's deadband (a change of exactly the deadband counts,
+    despite floating-point rounding), or if nothing has been sent to the feed for
+    heartbeat seconds. Feeds without a deadband are always sent. A sibling feed
+    such as temperature-max uses the deadband of its base feed, unless it has
+    one of its own.
+    """
+    def __init__(self, deadbands: Dict[str, float], heartbeat: float = 900):
+        """
+        Parameters
+        ----------
+        deadbands: A dict mapping feed names to the smallest change worth sending.
+        heartbeat: The longest time to go without sending a feed's value, in seconds.
+        """
+        self.deadbands = dict(deadbands)
+        self.heartbeat = heartbeat
+        self.sent = 0
+        self.suppressed = 0
+        self._last: Dict[str, Tuple[float, float]] = {}
+
+    def _deadband(self, feed: str) -> float:
+        """
+        Get the deadband of a feed, falling back to that of its base feed.
+        """
+        if feed in self.deadbands:
+            return self.deadbands[feed]
+        return self.deadbands.get(feed.partition("-")[0], 0.0)
+
+    def should_send(self, feed: str, value: float, now: Optional[float] = None) -> bool:
+        """
+        Decide whether a value should be sent, and count the decision.
+
+        Parameters
+        ----------
+        feed: The name of the feed.
+        value: The value to send.
+        now: The current monotonic time; defaults to time.monotonic().
+
+        Returns
+        -------
+        True if the value should be sent.
+        """
+        if now is None:
+            now = time.monotonic()
+        last = self._last.get(feed)
+        if (
+            last is None
+            or abs(value - last[0]) >= self._deadband(feed) - _TOLERANCE
+            or now - last[1] >= self.heartbeat
+        ):
+            self._last[feed] = (value, now)
+            self.sent += 1
+            return True
+        self.suppressed += 1
+        return False
+
+    def filter(self, data: Dict[str, float]) -> Dict[str, float]:
+        """
+        Filter a cycle's data, keeping only the values which should be sent.
+
+        Parameters
+        ----------
+        data: A dict mapping feed names to values.
+
+        Returns
+        -------
+        A dict with only the values which should be sent.
+        """
+        now = time.monotonic()
+        return {feed: value for feed, value in data.items() if self.should_send(feed, value, now)}
+
+    @property
+    def suppression_ratio(self) -> float:
+        """
+        Get the fraction of values which were suppressed
+        """
+        total = self.sent + self.suppressed
+        return self.suppressed / total if total else 0.0
@@ -0,0 +1,155 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Deadline budgets, which flow down from a unit of work to every HTTP request and retry within it.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+from typing import Iterator, Optional, Tuple
+
+from requests.exceptions import Timeout
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry, RequestHistory
+
+from metrics import HTTP_RETRIES, REGISTRY
+
+# connect timeout, and read timeout, for requests made without a budget
+DEFAULT_TIMEOUT = (5.0, 30.0)
+# the least time worth starting a request or retry with
+MIN_ATTEMPT = 0.5
+
+_DEADLINE: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+_DEADLINE_EXCEEDED = REGISTRY.counter(
+    "tempmon_deadline_exceeded_total",
+    "HTTP requests and retries abandoned because their deadline budget ran out, by host.",
+    ["host"]
+)
+
+
+class DeadlineExceeded(Timeout):
+    """
+    The deadline budget ran out before a request could be made or retried.
+    """
+
+
+@contextmanager
+def budget(seconds: float) -> Iterator[None]:
+    """
+    Give the body of a with statement a deadline budget.
+
+    Every HTTP request made within the body, on this thread or on tasks and
+    threads started with a copy of its context (e.g. asyncio.to_thread), takes
+    its timeouts from what is left of the budget. A budget nested in another
+    can only shorten it.
+
+    Parameters
+    ----------
+    seconds: The budget, in seconds from now.
+    """
+    deadline = time.monotonic() + seconds
+    outer = _DEADLINE.get()
+    token = _DEADLINE.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """
+    Get the seconds left in the current deadline budget, or None if there isn't one.
+    """
+    deadline = _DEADLINE.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def request_timeout(host: str) -> Tuple[float, float]:
+    """
+    Get the (connect, read) timeouts to give a request, from what is left of the budget.
+
+    Parameters
+    ----------
+    host: The host the request is for, for metrics.
+
+    Raises
+    ------
+    DeadlineExceeded: when too little of the budget is left to start a request.
+    """
+    left = remaining()
+    if left is None:
+        return DEFAULT_TIMEOUT
+    if left < MIN_ATTEMPT:
+        _DEADLINE_EXCEEDED.labels(host).inc()
+        raise DeadlineExceeded(f"deadline budget for {host} exhausted")
+    return min(DEFAULT_TIMEOUT[0], left), left
+
+
+def attempt_timeout(timeout: Optional[float]) -> Optional[float]:
+    """
+    Cut a socket timeout short at the end of the current deadline budget.
+
+    urllib3 gives every retry of a request the timeouts the request started
+    with, so each attempt is cut short here instead, rather than being let
+    run a whole read timeout past the deadline.
+
+    Parameters
+    ----------
+    timeout: The timeout, in seconds, or None to block.
+
+    Returns
+    -------
+    The timeout to use, in seconds, or None to block.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    # a timeout of 0 would make the socket non-blocking, rather than time out
+    left = max(left, 0.001)
+    return left if timeout is None else min(timeout, left)
+
+
+class CountingRetry(Retry):
+    """
+    urllib3 Retry strategy which counts the retries it makes; not the last
+    attempt, which gives up once the retries are exhausted.
+    """
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        host = _pool.host if _pool is not None else "unknown"
+        HTTP_RETRIES.labels(host).inc()
+        return retry
+
+
+class DeadlineRetry(CountingRetry):
+    """
+    urllib3 Retry strategy which counts its retries, and abandons one which
+    couldn't be finished within the current deadline budget, rather than
+    sleeping through a backoff that would overrun it. A retry which does start
+    has its timeouts cut short by the connection, with attempt_timeout().
+
+    Only the statuses in status_forcelist are retried, even when the response
+    has a Retry-After header, so that e.g. 429 can be left to a rate limiter.
+    """
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code in self.RETRY_AFTER_STATUS_CODES and status_code not in (self.status_forcelist or ()):
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        left = remaining()
+        if left is not None:
+            wait = self.new(history=self.history + (RequestHistory(method, url, error, None, None),)).get_backoff_time()
+            if response is not None and self.respect_retry_after_header and response.status in self.RETRY_AFTER_STATUS_CODES:
+                wait = self.get_retry_after(response) or wait
+            if left < wait + MIN_ATTEMPT:
+                host = _pool.host if _pool is not None else "unknown"
+                _DEADLINE_EXCEEDED.labels(host).inc()
+                raise MaxRetryError(
+                    _pool, url, DeadlineExceeded(f"no time left in the deadline budget to retry {host}")
+                ) from error
+        return super().increment(method, url, response, error, _pool, _stacktrace)
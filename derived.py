@@ -0,0 +1,187 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Metrics derived from the measured ones: dew point, heat index and sea-level pressure.
+
+The formulas work on whole NumPy arrays at once, so that a window of samples
+is converted in one pass rather than sample by sample.
+"""
+
+import dataclasses
+from typing import Dict, Mapping, Optional, Tuple
+
+import numpy as np
+
+# Magnus formula coefficients, from Alduchov and Eskridge (1996)
+_MAGNUS_B = 17.625
+_MAGNUS_C = 243.04  # °C
+# standard atmosphere lapse rate, and the exponent g·M / (R·L) of the barometric formula
+_LAPSE_RATE = 0.0065  # K/m
+_BAROMETRIC_EXPONENT = 5.257
+_KELVIN = 273.15
+# standard temperature at sea level, for when none is measured
+_STANDARD_TEMPERATURE = 15.0  # °C
+
+
+def dew_point(temperature: np.ndarray, humidity: np.ndarray) -> np.ndarray:
+    """
+    Calculate the dew point, with the Magnus formula.
+
+    Parameters
+    ----------
+    temperature: Air temperatures, in °C.
+    humidity: Relative humidities, in %.
+
+    Returns
+    -------
+    The dew points, in °C; NaN where the humidity isn't positive.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gamma = np.log(humidity / 100.0) + _MAGNUS_B * temperature / (_MAGNUS_C + temperature)
+        return np.where(humidity > 0, _MAGNUS_C * gamma / (_MAGNUS_B - gamma), np.nan)
+
+
+def heat_index(temperature: np.ndarray, humidity: np.ndarray) -> np.ndarray:
+    """
+    Calculate the heat index, as the US National Weather Service does.
+
+    Steadman's simple formula is used in mild weather; once it gives 80 °F or
+    more, the Rothfusz regression is used instead, with its adjustments for
+    very dry and very humid air.
+
+    Parameters
+    ----------
+    temperature: Air temperatures, in °C.
+    humidity: Relative humidities, in %.
+
+    Returns
+    -------
+    The heat indices, in °C.
+    """
+    t = temperature * 1.8 + 32.0
+    rh = humidity
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    regression = (
+        -42.379 + 2.04901523 * t + 10.14333127 * rh - 0.22475541 * t * rh - 6.83783e-3 * t * t
+        - 5.481717e-2 * rh * rh + 1.22874e-3 * t * t * rh + 8.5282e-4 * t * rh * rh - 1.99e-6 * t * t * rh * rh
+    )
+    dry = (rh < 13.0) & (t >= 80.0) & (t <= 112.0)
+    regression -= np.where(dry, (13.0 - rh) / 4.0 * np.sqrt(np.clip(17.0 - np.abs(t - 95.0), 0.0, None) / 17.0), 0.0)
+    humid = (rh > 85.0) & (t >= 80.0) & (t <= 87.0)
+    regression += np.where(humid, (rh - 85.0) / 10.0 * (87.0 - t) / 5.0, 0.0)
+    index = np.where((simple + t) / 2.0 >= 80.0, regression, simple)
+    return (index - 32.0) / 1.8
+
+
+def sea_level_pressure(pressure: np.ndarray, elevation: float, temperature: np.ndarray) -> np.ndarray:
+    """
+    Reduce station pressure to sea level, with the barometric formula.
+
+    Parameters
+    ----------
+    pressure: Station pressures, in hPa.
+    elevation: The station's elevation, in metres.
+    temperature: Air temperatures at the station, in °C; NaN where unknown,
+        to assume the standard atmosphere.
+
+    Returns
+    -------
+    The pressures at sea level, in hPa.
+    """
+    rise = _LAPSE_RATE * elevation
+    sea_level = np.where(np.isnan(temperature), _STANDARD_TEMPERATURE - rise, temperature) + rise + _KELVIN
+    return pressure * (1.0 - rise / sea_level) ** -_BAROMETRIC_EXPONENT
+
+
+@dataclasses.dataclass
+class DerivedMetric:
+    """
+    A metric derived from measured quantities.
+    """
+    # the quantities it can't be calculated without
+    inputs: Tuple[str, ...]
+    unit: str
+
+
+METRICS: Dict[str, DerivedMetric] = {
+    'dewpoint': DerivedMetric(('temperature', 'humidity'), "°C"),
+    'heatindex': DerivedMetric(('temperature', 'humidity'), "°C"),
+    'sealevelpressure': DerivedMetric(('pressure',), "hPa"),
+}
+# the quantities the metrics are derived from, in the column order of a window
+QUANTITIES = ('temperature', 'humidity', 'pressure')
+
+
+class DerivedWindow:
+    """
+    Buffer the inputs of a derived metric, and calculate its mean over the window on demand.
+
+    Each sample is one row of temperature, humidity and pressure, with NaN for
+    whatever wasn't measured at the time, so the quantities stay aligned even
+    when a sensor fails or feeds are sampled at different intervals. Rows
+    missing an input of the metric are left out of its mean. Once full, each
+    new row overwrites the oldest one.
+    """
+    def __init__(self, metric: str, capacity: int, elevation: Optional[float] = None):
+        """
+        Parameters
+        ----------
+        metric: The name of the metric to calculate, one of METRICS.
+        capacity: The maximum number of samples to keep.
+        elevation: The station's elevation, in metres; sea-level pressure is
+            only calculated once it is known.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown derived metric: {metric}.")
+        if capacity <= 0:
+            raise ValueError(f"Capacity must be positive, not {capacity}.")
+        self.metric = metric
+        self.elevation = elevation
+        self._rows = np.full((capacity, len(QUANTITIES)), np.nan)
+        self._next = 0
+        self._count = 0
+
+    @property
+    def capacity(self) -> int:
+        """
+        Get the maximum number of samples kept
+        """
+        return len(self._rows)
+
+    def add(self, values: Mapping[str, float]) -> None:
+        """
+        Add a sample of the input quantities.
+
+        Parameters
+        ----------
+        values: The values measured, keyed by quantity; others are recorded as missing.
+        """
+        if not any(quantity in values for quantity in QUANTITIES):
+            return
+        self._rows[self._next] = [values.get(quantity, np.nan) for quantity in QUANTITIES]
+        self._next = (self._next + 1) % len(self._rows)
+        self._count = min(self._count + 1, len(self._rows))
+
+    def flush(self) -> Optional[float]:
+        """
+        Calculate the mean of the metric over the window, and start a new one.
+
+        Returns
+        -------
+        The mean, or None if the metric couldn't be calculated for any sample in the window.
+        """
+        temperature, humidity, pressure = self._rows[:self._count].T.copy()
+        self._rows[:] = np.nan
+        self._next = 0
+        self._count = 0
+        if self.metric == 'dewpoint':
+            values = dew_point(temperature, humidity)
+        elif self.metric == 'heatindex':
+            values = heat_index(temperature, humidity)
+        elif self.elevation is not None:
+            values = sea_level_pressure(pressure, self.elevation, temperature)
+        else:
+            return None
+        values = values[np.isfinite(values)]
+        return float(values.mean()) if values.size else None
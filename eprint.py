@@ -3,13 +3,353 @@
 
 """
 Wrapper function for print() to use stderr instead of stdout.
+
+Once configure_logging() has been called, eprint() goes through a structured
+logging layer instead: messages get a level from their "ERR:" or "WARN:"
+prefix, can be written as plain text, JSON or logfmt, are buffered and written
+in batches by a background thread, and repeats of the same message are
+suppressed for a while. Routine messages can be sampled, so that a monitor in
+its steady state hardly writes anything.
 """
 
+from datetime import datetime, timezone
+import json
+import logging
 import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, TextIO, Tuple
+
+FORMATS = ("plain", "json", "logfmt")
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+_PREFIXES = (("ERR:", logging.ERROR), ("WARN:", logging.WARNING))
 
+_LOGGER: Optional[logging.Logger] = None
+_SAMPLE_EVERY = 1
+_sampled: Dict[str, int] = {}
+_sampled_lock = threading.Lock()
 
-def eprint(*args, **kwargs):
+
+def eprint(
+    *args,
+    sampled: bool = False,
+    sep: str = " ",
+    end: str = "\n",
+    file: Optional[TextIO] = None,
+    flush: bool = False
+):
     """
     Wrapper function for print() to use stderr instead of stdout.
+
+    Parameters
+    ----------
+    args: The values to print, as for print().
+    sampled: Whether this is a routine message, e.g. once per sampling cycle,
+        which only needs logging now and then. Sampled messages with the same
+        first argument are counted together.
+    sep: The string to put between the values, as for print().
+    end: The string to put after the values, as for print(). A logged message
+        is always a line of its own, so only what comes before a final
+        newline is kept.
+    file: The stream to print to instead of stderr; messages printed to
+        another stream bypass the logging layer.
+    flush: Whether to write the message, and any buffered before it, straight away.
+    """
+    if _LOGGER is None or file not in (None, sys.stderr):
+        print(*args, sep=sep, end=end, file=file if file is not None else sys.stderr, flush=flush)
+        return
+    if sampled and _SAMPLE_EVERY > 1:
+        key = str(args[0]) if args else ""
+        with _sampled_lock:
+            count = _sampled.get(key, 0)
+            _sampled[key] = count + 1
+        if count % _SAMPLE_EVERY:
+            return
+    message = sep.join(str(arg) for arg in args) + end.rstrip("\n")
+    level = logging.INFO
+    for prefix, prefix_level in _PREFIXES:
+        if message.startswith(prefix):
+            level = prefix_level
+            break
+    _LOGGER.log(level, message)
+    if flush:
+        for handler in _LOGGER.handlers:
+            handler.flush()
+
+
+def _strip_prefix(message: str) -> str:
+    """
+    Remove the level prefix from a message, for formats which record the level separately.
+    """
+    for prefix, _level in _PREFIXES:
+        if message.startswith(prefix):
+            return message[len(prefix):].lstrip()
+    return message
+
+
+class PlainFormatter(logging.Formatter):
+    """
+    Format records as the message alone, as eprint() always has.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        repeats = getattr(record, 'repeats', 0)
+        if repeats:
+            message += f" (repeated {repeats} more times)"
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line, with ts, level and msg fields.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        fields: Dict[str, Any] = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'msg': _strip_prefix(record.getMessage())
+        }
+        repeats = getattr(record, 'repeats', 0)
+        if repeats:
+            fields['repeats'] = repeats
+        return json.dumps(fields, ensure_ascii=False)
+
+
+class LogfmtFormatter(logging.Formatter):
+    """
+    Format records as logfmt key=value pairs, with ts, level and msg keys.
+    """
+    @staticmethod
+    def _quote(value: str) -> str:
+        if value and not any(char in value for char in ' ="\\\n'):
+            return value
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+    def format(self, record: logging.LogRecord) -> str:
+        parts = [
+            f"ts={datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')}",
+            f"level={record.levelname.lower()}",
+            f"msg={self._quote(_strip_prefix(record.getMessage()))}"
+        ]
+        repeats = getattr(record, 'repeats', 0)
+        if repeats:
+            parts.append(f"repeats={repeats}")
+        return " ".join(parts)
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Suppress a message repeated within a window, e.g. the same failure every cycle.
+
+    The first occurrence is logged. Repeats within window seconds of it are
+    only counted; the next occurrence after the window is logged with the
+    count, in its repeats attribute, and starts a new window. So that a count
+    isn't held back for as long as the message stops recurring, the repeats
+    counted so far are also reported, as a copy of the last one, whenever a
+    different message is logged, and by flush().
+    """
+    _PRUNE_AT = 1000
+
+    def __init__(
+        self, window: float, emit: Callable[[logging.LogRecord], None], clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Parameters
+        ----------
+        window: How long to suppress repeats of a message for, in seconds.
+        emit: Writes out a record reporting repeats, e.g. the logger's callHandlers.
+        clock: The time source, in seconds.
+        """
+        super().__init__()
+        self.window = window
+        self._emit = emit
+        self._clock = clock
+        self._lock = threading.Lock()
+        # message -> (time it was last logged, repeats suppressed since, the last of them)
+        self._seen: Dict[str, Tuple[float, int, Optional[logging.LogRecord]]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        now = self._clock()
+        with self._lock:
+            seen = self._seen.get(message)
+            if seen is not None and now - seen[0] < self.window:
+                self._seen[message] = (seen[0], seen[1] + 1, record)
+                return False
+            pending = self._take_pending()
+            if len(self._seen) >= self._PRUNE_AT:
+                self._seen = {key: value for key, value in self._seen.items() if now - value[0] < self.window}
+            self._seen[message] = (now, 0, None)
+        self._report(pending)
+        record.repeats = seen[1] if seen is not None else 0
+        return True
+
+    def flush(self) -> None:
+        """
+        Report the repeats counted so far, e.g. before logging is closed.
+        """
+        with self._lock:
+            pending = self._take_pending()
+        self._report(pending)
+
+    def _take_pending(self) -> List[Tuple[logging.LogRecord, int]]:
+        """
+        Take the last repeat of each message with repeats to report, with its count. Call with the lock held.
+        """
+        pending = []
+        for message, (logged_at, repeats, last) in self._seen.items():
+            if repeats and last is not None:
+                pending.append((last, repeats))
+                self._seen[message] = (logged_at, 0, None)
+        return pending
+
+    def _report(self, pending: List[Tuple[logging.LogRecord, int]]) -> None:
+        """
+        Write out a record for each message with repeats to report.
+        """
+        for last, repeats in pending:
+            summary = logging.makeLogRecord(last.__dict__)
+            summary.repeats = repeats
+            self._emit(summary)
+
+
+class BufferedHandler(logging.Handler):
+    """
+    Handler which buffers formatted records, and writes them on a background thread.
+
+    The buffer is written in one go when it holds capacity records, when
+    flush_interval seconds have passed, or straight away for records at
+    flush_level or above; logging never waits for the stream.
+    """
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        capacity: int = 100,
+        flush_interval: float = 10.0,
+        flush_level: int = logging.ERROR
+    ):
+        """
+        Parameters
+        ----------
+        stream: The stream to write to; stderr by default.
+        capacity: The most records to buffer before writing them.
+        flush_interval: The longest to keep a record buffered, in seconds.
+        flush_level: The level at which records are written straight away.
+        """
+        super().__init__()
+        self.stream = stream if stream is not None else sys.stderr
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self._buffer: List[str] = []
+        self._cond = threading.Condition()
+        self._urgent = False
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._writer.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            line = self.format(record)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        with self._cond:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.capacity or record.levelno >= self.flush_level:
+                self._urgent = True
+                self._cond.notify()
+
+    def flush(self) -> None:
+        """
+        Have the buffered records written now, without waiting for them.
+        """
+        with self._cond:
+            self._urgent = True
+            self._cond.notify()
+
+    def _run(self) -> None:
+        """
+        Write the buffer whenever it is full, urgent or old enough, until closed.
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._urgent or self._closed, timeout=self.flush_interval)
+                lines, self._buffer = self._buffer, []
+                self._urgent = False
+                closed = self._closed
+            if lines:
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                except (OSError, ValueError):
+                    pass
+            if closed:
+                return
+
+    def close(self) -> None:
+        """
+        Write whatever is still buffered, and stop the writer thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._writer.join(timeout=5)
+        super().close()
+
+
+def configure_logging(
+    log_format: str = "plain",
+    level: str = "info",
+    buffer: int = 0,
+    flush_interval: float = 10.0,
+    repeat_window: float = 0.0,
+    sample_every: int = 1,
+    stream: Optional[TextIO] = None
+) -> None:
+    """
+    Send eprint() through the structured logging layer, or change how it is set up.
+
+    Parameters
+    ----------
+    log_format: One of FORMATS: plain text as before, JSON or logfmt.
+    level: The least level to log, one of LEVELS.
+    buffer: The most messages to buffer before writing them; 0 writes each one straight away.
+    flush_interval: The longest to keep a message buffered, in seconds.
+    repeat_window: How long to suppress repeats of a message for, in seconds; 0 never does.
+    sample_every: Log only one in this many of each sampled message.
+    stream: The stream to write to; stderr by default.
+    """
+    global _LOGGER, _SAMPLE_EVERY  # pylint: disable=global-statement
+    logger = logging.getLogger("tempmon")
+    close_logging()
+    formatter = {"plain": PlainFormatter, "json": JsonFormatter, "logfmt": LogfmtFormatter}[log_format]()
+    handler: logging.Handler
+    if buffer > 0:
+        handler = BufferedHandler(stream, buffer, flush_interval)
+    else:
+        handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    if repeat_window > 0:
+        logger.addFilter(RepeatFilter(repeat_window, logger.callHandlers))
+    logger.setLevel(LEVELS[level])
+    logger.propagate = False
+    _SAMPLE_EVERY = max(1, sample_every)
+    _LOGGER = logger
+
+
+def close_logging() -> None:
+    """
+    Write any buffered messages, and send eprint() straight to stderr again.
     """
-    print(*args, file=sys.stderr, **kwargs)
+    global _LOGGER  # pylint: disable=global-statement
+    logger = logging.getLogger("tempmon")
+    for log_filter in list(logger.filters):
+        if isinstance(log_filter, RepeatFilter):
+            log_filter.flush()
+        logger.removeFilter(log_filter)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    _LOGGER = None
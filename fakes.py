@@ -0,0 +1,593 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Stand-ins for the sensors and for Adafruit.IO, for benchmarking without hardware or network access.
+
+The fake Adafruit.IO server can also be run on its own, e.g. to point a logger at:
+    python3 fakes.py --port 8080 --latency 0.2 --throttle-rate 0.05
+    python3 fakes.py --port 8080 --mqtt-port 1883
+"""
+
+import argparse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import random
+import re
+import socketserver
+import struct
+import threading
+import time
+import urllib.parse
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class FakeSensor:
+    """
+    A sensor whose readings wander randomly, with configurable read latency and failures.
+    """
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        Parameters
+        ----------
+        latency: How long each read takes, in seconds.
+        failure_rate: The fraction of reads which raise OSError, from 0 to 1.
+        seed: Optional seed for the random readings and failures.
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.reads = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = {}
+
+    def _read(self, quantity: str, start: float, step: float) -> float:
+        """
+        Take a reading of a quantity, after the read latency.
+
+        Raises
+        ------
+        OSError: for the injected fraction of reads.
+        """
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._lock:
+            self.reads += 1
+            if self._random.random() < self.failure_rate:
+                self.failures += 1
+                raise OSError(5, "Input/output error (injected)")
+            value = self._values.get(quantity, start) + self._random.gauss(0.0, step)
+            self._values[quantity] = value
+            return value
+
+
+class FakeBMP388(FakeSensor):
+    """
+    Stand-in for adafruit_bmp3xx.BMP3XX_I2C.
+    """
+    @property
+    def pressure(self) -> float:
+        """
+        Get the pressure, in hPa
+        """
+        return self._read('pressure', 1013.25, 0.05)
+
+    @property
+    def temperature(self) -> float:
+        """
+        Get the temperature, in °C
+        """
+        return self._read('temperature', 20.0, 0.02)
+
+
+class FakeAM2320(FakeSensor):
+    """
+    Stand-in for adafruit_am2320.AM2320.
+    """
+    @property
+    def temperature(self) -> float:
+        """
+        Get the temperature, in °C
+        """
+        return self._read('temperature', 20.0, 0.02)
+
+    @property
+    def relative_humidity(self) -> float:
+        """
+        Get the relative humidity, in %
+        """
+        return self._read('relative_humidity', 50.0, 0.1)
+
+
+class FakeAdafruitIO:
+    """
+    Local HTTP server mimicking the Adafruit.IO REST API, on a background thread.
+
+    Groups, feeds, data, group data, batch data and throttle endpoints are
+    supported, for any username. Every request can be delayed, and a fraction
+    of them answered with 429 Too Many Requests or 5xx errors. If a data rate
+    is given, data beyond it in any one minute is also refused with a 429.
+    """
+    def __init__(
+        self,
+        port: int = 0,
+        host: str = "127.0.0.1",
+        latency: float = 0.0,
+        throttle_rate: float = 0.0,
+        error_rate: float = 0.0,
+        data_rate: Optional[int] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        Parameters
+        ----------
+        port: The TCP port to listen on; 0 picks a free one.
+        host: The address to listen on.
+        latency: How long to delay every response, in seconds.
+        throttle_rate: The fraction of requests to answer with 429, from 0 to 1.
+        error_rate: The fraction of requests to answer with a 5xx error, from 0 to 1.
+        data_rate: Optional data points allowed per minute, as for an Adafruit.IO account.
+        seed: Optional seed for the injected failures.
+        """
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.data_rate = data_rate
+        self.requests = 0
+        self.data_points = 0
+        self.throttled = 0
+        self.errors = 0
+        self.groups: Dict[str, Dict[str, Any]] = {}
+        self.feeds: Dict[str, Dict[str, Any]] = {}
+        self.data: Dict[str, List[Dict[str, Any]]] = {}
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._window: List[Tuple[float, int]] = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Route requests to the fake server.
+            """
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _handle(self, method: str) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, payload, headers = fake.handle(method, self.path, self.headers, body)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                Handle a GET request.
+                """
+                self._handle("GET")
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """
+                Handle a POST request.
+                """
+                self._handle("POST")
+
+            def do_DELETE(self):  # pylint: disable=invalid-name
+                """
+                Handle a DELETE request.
+                """
+                self._handle("DELETE")
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-aio", daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        """
+        Get the base URL to give an Adafruit.IO client
+        """
+        host, port = self._server.server_address[:2]
+        if isinstance(host, bytes):
+            host = host.decode()
+        return f"http://{host}:{port}"
+
+    @staticmethod
+    def _slug(name: str) -> str:
+        """
+        Turn a name into a key, the way Adafruit.IO does.
+        """
+        return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+    def _used(self, now: float) -> int:
+        """
+        Get the data points accepted in the last minute. Call with the lock held.
+        """
+        self._window = [(stamp, count) for stamp, count in self._window if now - stamp < 60]
+        return sum(count for _stamp, count in self._window)
+
+    def _rate_headers(self, now: float) -> Dict[str, str]:
+        """
+        Get the data rate headers to send with a response. Call with the lock held.
+        """
+        if self.data_rate is None:
+            return {}
+        return {
+            "X-AIO-Datarate-Limit": str(self.data_rate),
+            "X-AIO-Datarate-Remaining": str(max(0, self.data_rate - self._used(now)))
+        }
+
+    def _new_datum(self, feed_key: str, record: Dict[str, Any], **defaults: Any) -> Dict[str, Any]:
+        """
+        Store a datum in a feed. Call with the lock held.
+        """
+        datum = {
+            'id': str(next(self._ids)),
+            'feed_key': feed_key,
+            'value': str(record.get('value')),
+            'created_at': record.get('created_at') or defaults.get('created_at')
+            or datetime.now(timezone.utc).isoformat(),
+            'lat': record.get('lat', defaults.get('lat')),
+            'lon': record.get('lon', defaults.get('lon')),
+            'ele': record.get('ele', defaults.get('ele'))
+        }
+        self.data.setdefault(feed_key, []).append(datum)
+        return datum
+
+    def _new_feed(self, name: str, group_key: Optional[str]) -> Dict[str, Any]:
+        """
+        Create a feed, or get the existing one with the same key. Call with the lock held.
+        """
+        key = self._slug(name) if group_key is None else f"{group_key}.{self._slug(name)}"
+        if key not in self.feeds:
+            self.feeds[key] = {'id': next(self._ids), 'name': name, 'key': key}
+            if group_key is not None:
+                self.groups[group_key]['feeds'].append(self.feeds[key])
+        return self.feeds[key]
+
+    def handle(
+        self, method: str, path: str, headers: Any, body: bytes
+    ) -> Tuple[int, Any, Dict[str, str]]:
+        """
+        Handle one request.
+
+        Parameters
+        ----------
+        method: The HTTP method.
+        path: The request path, including any query string.
+        headers: The request headers.
+        body: The request body.
+
+        Returns
+        -------
+        A tuple of the HTTP status, the JSON response and any extra headers.
+        """
+        if self.latency > 0:
+            time.sleep(self.latency)
+        url = urllib.parse.urlsplit(path)
+        parts = [part for part in url.path.split('/') if part]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            roll = self._random.random()
+            if roll < self.throttle_rate:
+                self.throttled += 1
+                return 429, {'error': "throttled (injected)"}, {"Retry-After": "1", **self._rate_headers(now)}
+            if roll < self.throttle_rate + self.error_rate:
+                self.errors += 1
+                return self._random.choice([500, 502, 503, 504]), {'error': "server error (injected)"}, {}
+            if headers.get("X-AIO-Key") is None and 'x-aio-key' not in query:
+                return 401, {'error': "not authorized"}, {}
+            if parts[:2] != ['api', 'v2'] or len(parts) < 4:
+                return 404, {'error': "not found"}, {}
+            try:
+                payload = json.loads(body) if body else {}
+                return self._route(method, parts[3:], query, payload, now)
+            except (LookupError, TypeError, ValueError) as exc:
+                return 400, {'error': f"bad request: {exc}"}, {}
+
+    def _route(
+        self, method: str, parts: List[str], query: Dict[str, str], payload: Any, now: float
+    ) -> Tuple[int, Any, Dict[str, str]]:
+        """
+        Route a request within a user's API. Call with the lock held.
+        """
+        # pylint: disable=too-many-return-statements
+        if parts == ['throttle'] and method == "GET":
+            used = self._used(now)
+            return 200, {'data_rate_limit': self.data_rate or 30, 'active_data_rate': used}, {}
+        if parts == ['groups']:
+            if method == "GET":
+                return 200, list(self.groups.values()), {}
+            key = self._slug(payload['name'])
+            group = self.groups.setdefault(
+                key, {'id': next(self._ids), 'name': payload['name'], 'key': key, 'feeds': []}
+            )
+            return 201, group, {}
+        if parts == ['feeds']:
+            if method == "GET":
+                return 200, list(self.feeds.values()), {}
+            return 201, self._new_feed(payload['feed']['name'], None), {}
+        if len(parts) == 3 and parts[0] == 'groups' and parts[2] == 'feeds' and method == "POST":
+            if parts[1] not in self.groups:
+                return 404, {'error': "group not found"}, {}
+            return 201, self._new_feed(payload['feed']['name'], parts[1]), {}
+        if len(parts) >= 3 and parts[0] in ('groups', 'feeds') and parts[2] == 'data':
+            return self._route_data(method, parts, query, payload, now)
+        return 404, {'error': "not found"}, {}
+
+    def _route_data(
+        self, method: str, parts: List[str], query: Dict[str, str], payload: Any, now: float
+    ) -> Tuple[int, Any, Dict[str, str]]:
+        """
+        Route a request to a data endpoint. Call with the lock held.
+        """
+        kind, key = parts[0], parts[1]
+        if (kind == 'groups' and key not in self.groups) or (kind == 'feeds' and key not in self.feeds):
+            return 404, {'error': f"{kind[:-1]} not found"}, {}
+        if method == "GET" and kind == 'feeds':
+            limit = int(query.get('limit', 1000))
+            data = self.data.get(key, [])
+            end = query.get('end_time')
+            if end is not None:
+                data = [datum for datum in data if datum['created_at'] < end]
+            return 200, list(reversed(data[-limit:])), self._rate_headers(now)
+        if method != "POST":
+            return 404, {'error': "not found"}, {}
+        if kind == 'groups':
+            location = payload.get('location') or {}
+            records = [
+                (f"{key}.{item['key']}", item, dict(location, created_at=payload.get('created_at')))
+                for item in payload['feeds']
+            ]
+        elif parts[3:] == ['batch']:
+            records = [(key, item, {}) for item in payload['data']]
+        else:
+            records = [(key, payload, {})]
+        if self.data_rate is not None and self._used(now) + len(records) > self.data_rate:
+            self.throttled += 1
+            return 429, {'error': "data rate limit reached"}, {"Retry-After": "60", **self._rate_headers(now)}
+        for feed_key, _item, _defaults in records:
+            if feed_key not in self.feeds:
+                return 404, {'error': f"feed {feed_key} not found"}, {}
+        created = [self._new_datum(feed_key, item, **defaults) for feed_key, item, defaults in records]
+        self._window.append((now, len(created)))
+        self.data_points += len(created)
+        result = created[0] if kind == 'feeds' and parts[3:] != ['batch'] else created
+        return 200, result, self._rate_headers(now)
+
+    def close(self) -> None:
+        """
+        Stop serving.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeMQTTBroker:
+    """
+    Minimal local MQTT 3.1.1 broker mimicking the Adafruit.IO MQTT API, on a background thread.
+
+    Data published to {username}/feeds/{key} or {username}/feeds/{key}/json is
+    stored in the feeds of a fake Adafruit.IO server, and acknowledged at QoS 1.
+    Data beyond the server's data rate, or for unknown feeds, is dropped, and
+    reported on the {username}/throttle or {username}/errors topic, as
+    Adafruit.IO does. Only what a publishing client needs is supported:
+    there is no retained data, will or message routing between clients.
+    """
+    def __init__(self, aio: FakeAdafruitIO, port: int = 0, host: str = "127.0.0.1", latency: float = 0.0):
+        """
+        Parameters
+        ----------
+        aio: The fake Adafruit.IO server to store data in.
+        port: The TCP port to listen on; 0 picks a free one.
+        host: The address to listen on.
+        latency: How long to delay every acknowledgement, in seconds.
+        """
+        self.aio = aio
+        self.latency = latency
+        self.connections = 0
+        self.publishes = 0
+        self.rejected = 0
+        broker = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            """
+            Serve one client connection.
+            """
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                broker.serve(self.rfile, self.wfile)
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-mqtt", daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self) -> int:
+        """
+        Get the TCP port the broker listens on
+        """
+        return self._server.server_address[1]
+
+    @staticmethod
+    def _packet(kind: int, body: bytes) -> bytes:
+        """
+        Build an MQTT packet from its fixed header byte and body.
+        """
+        length = len(body)
+        encoded = bytearray()
+        while True:
+            byte, length = length % 128, length // 128
+            encoded.append(byte | (0x80 if length else 0))
+            if not length:
+                break
+        return bytes([kind]) + bytes(encoded) + body
+
+    @staticmethod
+    def _read_packet(rfile: Any) -> Optional[Tuple[int, bytes]]:
+        """
+        Read one MQTT packet, or None at the end of the connection.
+        """
+        header = rfile.read(1)
+        if not header:
+            return None
+        length, shift = 0, 0
+        while True:
+            byte = rfile.read(1)
+            if not byte:
+                return None
+            length += (byte[0] & 0x7f) << shift
+            shift += 7
+            if not byte[0] & 0x80:
+                break
+        body = rfile.read(length)
+        if len(body) < length:
+            return None
+        return header[0], body
+
+    def serve(self, rfile: Any, wfile: Any) -> None:
+        """
+        Serve the packets of one client connection, until it closes.
+        """
+        username = ""
+        subscriptions = set()
+        while True:
+            packet = self._read_packet(rfile)
+            if packet is None:
+                return
+            kind, body = packet
+            kind_type = kind >> 4
+            if kind_type == 1:
+                # CONNECT: the username follows the protocol name, level, flags, keep-alive and client id
+                offset = 2 + struct.unpack_from("!H", body)[0] + 4
+                flags = body[offset - 3]
+                fields = []
+                while offset < len(body):
+                    size = struct.unpack_from("!H", body, offset)[0]
+                    fields.append(body[offset + 2:offset + 2 + size])
+                    offset += 2 + size
+                # client id, then will topic and message if the will flag is set
+                name_index = 3 if flags & 0x04 else 1
+                if flags & 0x80 and len(fields) > name_index:
+                    username = fields[name_index].decode("utf-8")
+                self.connections += 1
+                wfile.write(self._packet(0x20, b"\x00\x00" if username else b"\x00\x04"))
+                if not username:
+                    return
+            elif kind_type == 3:
+                qos = (kind >> 1) & 0x03
+                size = struct.unpack_from("!H", body)[0]
+                topic = body[2:2 + size].decode("utf-8")
+                offset = 2 + size
+                packet_id = body[offset:offset + 2] if qos else b""
+                notice = self._publish(username, topic, body[offset + len(packet_id):])
+                if self.latency > 0:
+                    time.sleep(self.latency)
+                if qos:
+                    wfile.write(self._packet(0x40, packet_id))
+                if notice is not None and notice[0] in subscriptions:
+                    topic_bytes = notice[0].encode("utf-8")
+                    wfile.write(self._packet(
+                        0x30, struct.pack("!H", len(topic_bytes)) + topic_bytes + notice[1].encode("utf-8")
+                    ))
+            elif kind_type == 8:
+                packet_id, offset, granted = body[:2], 2, bytearray()
+                while offset < len(body):
+                    size = struct.unpack_from("!H", body, offset)[0]
+                    subscriptions.add(body[offset + 2:offset + 2 + size].decode("utf-8"))
+                    offset += 3 + size
+                    granted.append(0)
+                wfile.write(self._packet(0x90, packet_id + bytes(granted)))
+            elif kind_type == 12:
+                wfile.write(self._packet(0xd0, b""))
+            elif kind_type == 14:
+                return
+
+    def _publish(self, username: str, topic: str, payload: bytes) -> Optional[Tuple[str, str]]:
+        """
+        Store published data in the fake server.
+
+        Returns
+        -------
+        None, or a (topic, message) tuple to report an error or throttling on.
+        """
+        parts = topic.split('/')
+        if len(parts) not in (3, 4) or parts[0] != username or parts[1] != 'feeds' or parts[3:] not in ([], ['json']):
+            self.rejected += 1
+            return f"{username}/errors", f"unsupported topic {topic}"
+        record: Dict[str, Any] = {'value': payload.decode("utf-8")}
+        if parts[3:] == ['json']:
+            record = json.loads(payload)
+        aio = self.aio
+        with aio._lock:  # pylint: disable=protected-access
+            self.publishes += 1
+            now = time.monotonic()
+            if aio.data_rate is not None and aio._used(now) + 1 > aio.data_rate:  # pylint: disable=protected-access
+                aio.throttled += 1
+                return f"{username}/throttle", f"{username} data rate limit reached, 60 seconds until throttle released"
+            if parts[2] not in aio.feeds:
+                self.rejected += 1
+                return f"{username}/errors", f"feed {parts[2]} not found"
+            aio._new_datum(parts[2], record)  # pylint: disable=protected-access
+            aio._window.append((now, 1))  # pylint: disable=protected-access
+            aio.data_points += 1
+        return None
+
+    def close(self) -> None:
+        """
+        Stop serving.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main() -> None:
+    """
+    Entry point function when run from command line.
+    """
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Adafruit.IO REST API.")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--latency', type=float, default=0.0, help="response delay in seconds")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 5xx")
+    parser.add_argument('--data-rate', type=int, default=None, help="data points allowed per minute")
+    parser.add_argument('--mqtt-port', type=int, default=None, help="also run an MQTT broker on this port")
+    args = parser.parse_args()
+    server = FakeAdafruitIO(
+        args.port, args.host, args.latency, args.throttle_rate, args.error_rate, args.data_rate
+    )
+    broker = FakeMQTTBroker(server, args.mqtt_port, args.host, args.latency) if args.mqtt_port is not None else None
+    print(f"Serving a fake Adafruit.IO at {server.url} - press Ctrl+C to stop.")
+    if broker is not None:
+        print(f"Serving its MQTT API at mqtt://{args.host}:{broker.port}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if broker is not None:
+            broker.close()
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
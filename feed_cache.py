@@ -0,0 +1,124 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+On-disk cache of resolved Adafruit.IO group and feed keys.
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+import time
+from typing import Dict, Iterable, Set
+
+from eprint import eprint
+
+
+class FeedCache:
+    """
+    On-disk cache of resolved Adafruit.IO group and feed keys.
+
+    Groups are stored by name and feeds by their full key, along with the time
+    they were all last resolved and the account they belong to. Groups and
+    feeds added since don't make the cache any fresher.
+    """
+    def __init__(self, path: str, username: str, ttl: float = 86400):
+        """
+        Parameters
+        ----------
+        path: Path to the JSON cache file.
+        username: The Adafruit.IO username the keys belong to.
+        ttl: How long the cached keys can be used for, in seconds.
+        """
+        self.path = path
+        self.username = username
+        self.ttl = ttl
+        self.groups: Dict[str, str] = {}
+        self.feeds: Set[str] = set()
+        self.saved_at = 0.0
+        self.load()
+
+    def load(self) -> None:
+        """
+        Load the cache file, if it exists and belongs to our account.
+        """
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                cached = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            eprint(f"WARN: Unable to read feed cache {self.path} - ignored.")
+            return
+        if cached.get('username') != self.username:
+            return
+        self.groups = dict(cached.get('groups', {}))
+        self.feeds = set(cached.get('feeds', []))
+        self.saved_at = float(cached.get('saved_at', 0.0))
+
+    def is_fresh(self) -> bool:
+        """
+        Determine whether the cached keys are recent enough to be used.
+        """
+        return bool(self.groups) and time.time() - self.saved_at < self.ttl
+
+    def update(self, groups: Dict[str, str], feeds: Iterable[str], refreshed: bool = False) -> None:
+        """
+        Replace the cached keys and save them to disk.
+
+        Parameters
+        ----------
+        groups: A dict mapping group names to group keys.
+        feeds: The full keys of all feeds.
+        refreshed: Whether the keys were all just resolved, which restarts the ttl;
+            otherwise, e.g. when a feed was added, it runs on from the last time.
+        """
+        self.groups = dict(groups)
+        self.feeds = set(feeds)
+        if refreshed:
+            self.saved_at = time.time()
+        self.save()
+
+    def save(self) -> None:
+        """
+        Save the cached keys to disk, replacing the cache file atomically.
+
+        Each save writes a temporary file of its own, so that saves from
+        different threads can't mix.
+        """
+        temp_path = None
+        try:
+            handle, temp_path = tempfile.mkstemp(
+                prefix=f"{os.path.basename(self.path)}.", suffix=".tmp", dir=os.path.dirname(os.path.abspath(self.path))
+            )
+            with os.fdopen(handle, "w", encoding="utf-8") as file:
+                json.dump(
+                    {
+                        'username': self.username,
+                        'saved_at': self.saved_at,
+                        'groups': self.groups,
+                        'feeds': sorted(self.feeds)
+                    },
+                    file
+                )
+            os.replace(temp_path, self.path)
+        except OSError:
+            eprint(f"WARN: Unable to write feed cache {self.path} - ignored.")
+            if temp_path is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(temp_path)
+
+    def invalidate(self) -> None:
+        """
+        Forget all cached keys, on disk as well as in memory.
+        """
+        self.groups = {}
+        self.feeds = set()
+        self.saved_at = 0.0
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            eprint(f"WARN: Unable to remove feed cache {self.path} - ignored.")
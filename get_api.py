@@ -5,39 +5,38 @@
 Wrapper for GET API calls.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import urllib.parse
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Sequence
 from collections.abc import Callable
 
-from urllib3.util import Retry
 import requests
-from requests.adapters import HTTPAdapter
 
+from deadline import request_timeout
 from eprint import eprint
+from http_transport import TRANSPORT
+from metrics import HTTP_REQUEST_SECONDS
+from response_cache import CachedResponse, ResponseCache
 
 
 class GetApi:
     """
     Wrapper for GET API calls.
     """
-    def __init__(self, proxies=None) -> None:
+    def __init__(self, proxies=None, cache: Optional[ResponseCache] = None, max_workers: int = 4) -> None:
         """
         Initialize the API.
 
         Parameters
         ----------
         proxies: a dict of proxies to be used by the requests library.
+        cache: an optional on-disk cache of responses.
+        max_workers: the most calls to make at once, in call_get_apis().
         """
-        self.session = requests.Session()
-        self.session.proxies = proxies
-        retry_strategy = Retry(
-            total=5,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET", "PUT", "POST", "DELETE", "OPTIONS", "TRACE"]
-        )
-        self.session.mount('https://', HTTPAdapter(max_retries=retry_strategy))
-        self.session.mount('http://', HTTPAdapter(max_retries=retry_strategy))
+        self.cache = cache
+        self.max_workers = max_workers
+        self.session = TRANSPORT.session(proxies)
 
     def build_url(self, base: str, endpoint: str, params: Dict) -> str:
         """
@@ -60,6 +59,12 @@ class GetApi:
         """
         Call the GET API and return a result.
 
+        If a cache was given, a fresh cached response is used instead of calling
+        the API, and a stale one is used if the API can't be reached.
+
+        The request and its retries take their timeouts from the current
+        deadline budget, if there is one.
+
         Parameters
         ----------
         url: The GET API to call.
@@ -76,16 +81,91 @@ class GetApi:
         RequestException: when the server can't fulfill the request.
         ValueError: when the server doesn't return parsable JSON data.
         """
+        entry = self.cache.get(url) if self.cache is not None else None
+        if entry is not None and self.cache is not None and self.cache.is_fresh(entry):
+            return json_parser(entry.body)
+        host = urllib.parse.urlsplit(url).hostname or ""
         try:
-            response = self.session.get(url)
+            with HTTP_REQUEST_SECONDS.labels("GET", host).time():
+                response = self.session.get(url, timeout=request_timeout(host))
             json_data = response.json()
-            return json_parser(json_data)
         except ValueError as exc:
             eprint("Unable to parse JSON response.")
-            raise exc
+            return self._use_stale(entry, json_parser, exc)
         except requests.ConnectionError as exc:
             eprint("We failed to reach a server.")
-            raise exc
+            return self._use_stale(entry, json_parser, exc)
         except requests.RequestException as exc:
             eprint("The server couldn't fulfill the request.")
+            return self._use_stale(entry, json_parser, exc)
+        if self.cache is None:
+            return json_parser(json_data)
+        try:
+            result = json_parser(json_data)
+        except (LookupError, TypeError, ValueError):
+            # remember that this request doesn't work, to save asking again too soon
+            self.cache.put(url, json_data, ok=False)
+            raise
+        self.cache.put(url, json_data, ok=response.ok)
+        return result
+
+    def call_get_apis(self, urls: Sequence[str], json_parser: Callable[[Any], Any]) -> List[Any]:
+        """
+        Call the GET API for several urls at once, and return their results in the same order.
+
+        Each distinct url is only called once, however often it is given. The
+        calls are made concurrently, on up to max_workers threads, each within
+        the caller's deadline budget.
+
+        Parameters
+        ----------
+        urls: The GET APIs to call.
+        json_parser: A function which parses the json response and returns the desired data.
+
+        Returns
+        -------
+        A list of the results of the parse_json() method applied to the json
+        returned from each API call, one per url.
+
+        Raises
+        ------
+        The exception from the first url, in the order given, whose call failed.
+        """
+        unique = list(dict.fromkeys(urls))
+        if len(unique) <= 1:
+            results = [self.call_get_api(url, json_parser) for url in unique]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique))) as executor:
+                # each call runs in its own copy of the context, to keep the deadline budget
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self.call_get_api, url, json_parser)
+                    for url in unique
+                ]
+                results = [future.result() for future in futures]
+        by_url = dict(zip(unique, results))
+        return [by_url[url] for url in urls]
+
+    def _use_stale(
+        self, entry: Optional[CachedResponse], json_parser: Callable[[Any], Any], exc: Exception
+    ):
+        """
+        Fall back to a stale cached response after a failed API call.
+
+        Parameters
+        ----------
+        entry: The cached response for the request, if any.
+        json_parser: A function which parses the json response and returns the desired data.
+        exc: The exception raised by the failed API call.
+
+        Returns
+        -------
+        The result of the parse_json() method applied to the cached json.
+
+        Raises
+        ------
+        The exception from the failed API call, if there's no usable cached response.
+        """
+        if entry is None or self.cache is None or not self.cache.is_usable_stale(entry):
             raise exc
+        eprint(f"Using cached response from {entry.age / 3600:.1f} hours ago.")
+        return json_parser(entry.body)
@@ -0,0 +1,251 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+One HTTP transport shared by every API client: keep-alive connection pools, TLS set up once.
+
+A TLS handshake costs a slow CPU and link more than the request it is made
+for, so every client's session sends over the same pools, which keep their
+connections open between requests. TCP keep-alive probes stop idle
+connections from being silently dropped along the way, e.g. by a NAT router,
+and find out about dead ones before a request is sent on them. The CA bundle
+is loaded into one TLS context at startup, rather than once per connection,
+and when a connection does have to be made again, the last TLS session with
+the host is offered, so the server can resume it without a full handshake.
+"""
+
+import socket
+import ssl
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.certs import where
+from urllib3 import PoolManager
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from deadline import DeadlineRetry, attempt_timeout
+from metrics import REGISTRY
+
+_CONNECTIONS = REGISTRY.counter(
+    "tempmon_http_connections_total",
+    "HTTP connections opened, each costing a TCP handshake and, for HTTPS, a TLS one, by host.",
+    ["host"]
+)
+_REUSED = REGISTRY.counter(
+    "tempmon_http_connections_reused_total", "HTTP requests sent over a kept-alive connection, by host.", ["host"]
+)
+_TLS_RESUMED = REGISTRY.counter(
+    "tempmon_http_tls_resumed_total", "TLS handshakes which resumed an earlier session, by host.", ["host"]
+)
+# the most hosts to keep a pool of connections to
+_NUM_POOLS = 10
+
+
+class _ResumingContext(ssl.SSLContext):
+    """
+    TLS context which offers each host the last session it gave us, to resume it.
+    """
+    def __init__(self, *args, **kwargs):  # pylint: disable=unused-argument
+        super().__init__()
+        self._sessions: Dict[str, ssl.SSLSession] = {}
+        self._lock = threading.Lock()
+
+    def remember(self, host: str, session: Optional[ssl.SSLSession]) -> None:
+        """
+        Keep a host's TLS session, to offer it next time.
+        """
+        if session is not None:
+            with self._lock:
+                self._sessions[host] = session
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        if session is None and server_hostname is not None:
+            with self._lock:
+                session = self._sessions.get(server_hostname)
+        try:
+            wrapped = super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+        except ssl.SSLError:
+            # don't offer the session again, in case it is what the server objected to
+            with self._lock:
+                self._sessions.pop(server_hostname, None)
+            raise
+        if wrapped.session_reused:
+            _TLS_RESUMED.labels(server_hostname or "unknown").inc()
+        return wrapped
+
+
+class _HTTPConnection(HTTPConnection):
+    """
+    HTTP connection which counts the connections it opens, and the requests it sends over a kept-alive one.
+
+    Each socket operation's timeout is cut short at the end of the current
+    deadline budget, as urllib3 gives each retry the timeouts of the request.
+    """
+    timeout: Optional[float]
+    # whether the connection was opened for the request being sent
+    _fresh = False
+
+    def connect(self) -> None:
+        self.timeout = attempt_timeout(self.timeout)
+        super().connect()
+        self._fresh = True
+        _CONNECTIONS.labels(self.host).inc()
+
+    def request(self, method, url, *args, **kwargs) -> None:
+        # an HTTPS connection is opened before the request is sent, a plain one
+        # while it is being sent
+        if self.sock is not None and not self._fresh:
+            _REUSED.labels(self.host).inc()
+        self.timeout = attempt_timeout(self.timeout)
+        try:
+            super().request(method, url, *args, **kwargs)
+        finally:
+            self._fresh = False
+
+    def getresponse(self):
+        self.timeout = attempt_timeout(self.timeout)
+        return super().getresponse()
+
+
+class _HTTPSConnection(_HTTPConnection, HTTPSConnection):
+    """
+    HTTPS connection which also gives the shared TLS context each session the server sends, to resume.
+    """
+    def getresponse(self):
+        sock = self.sock
+        response = super().getresponse()
+        if isinstance(sock, ssl.SSLSocket) and isinstance(self.ssl_context, _ResumingContext):
+            # TLS 1.3 sends its session ticket after the handshake, so it is only
+            # there once a response has been read
+            self.ssl_context.remember(self.host, sock.session)
+        return response
+
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+def _keepalive_options(idle: float) -> List[Tuple[int, int, int]]:
+    """
+    Get the socket options for TCP keep-alive probes after idle seconds, as far as the platform has them.
+    """
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    for name, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", max(1.0, idle / 4)), ("TCP_KEEPCNT", 3)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), max(1, int(value))))
+    return options
+
+
+class _SharedPoolAdapter(HTTPAdapter):
+    """
+    requests adapter which sends over the transport's pools, rather than pools of its own.
+    """
+    def __init__(self, transport: "HttpTransport", **kwargs: Any) -> None:
+        self.transport = transport
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs) -> None:
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = self.transport.pools
+
+    def cert_verify(self, conn, url, verify, cert) -> None:
+        super().cert_verify(conn, url, verify, cert)
+        if verify is True and url.lower().startswith("https"):
+            # the shared TLS context already trusts the CA bundle
+            conn.ca_certs = None
+
+    def close(self) -> None:
+        # the pools outlive any one session
+        for proxy in self.proxy_manager.values():
+            proxy.clear()
+
+
+class HttpTransport:
+    """
+    Keep-alive connection pools, and a TLS context, shared by every API client.
+
+    Each client gets a session of its own, with its own retry strategy and
+    proxies, from session(); the connections behind them are shared.
+    """
+    def __init__(self, pool_size: int = 4, keepalive: float = 60.0) -> None:
+        """
+        Parameters
+        ----------
+        pool_size: The most connections to keep open to each host.
+        keepalive: How long a connection is idle before TCP keep-alive probes
+            are sent on it, in seconds; 0 sends none.
+        """
+        self.ssl_context = _ResumingContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.ssl_context.minimum_version = ssl.TLSVersion.TLSv1_2
+        self.ssl_context.load_verify_locations(where())
+        self.pool_size = 0
+        self.keepalive = 0.0
+        self.pools = PoolManager(num_pools=_NUM_POOLS, block=False, ssl_context=self.ssl_context)
+        self.pools.pool_classes_by_scheme = {"http": _HTTPConnectionPool, "https": _HTTPSConnectionPool}
+        self.configure(pool_size, keepalive)
+
+    def configure(self, pool_size: int, keepalive: float) -> None:
+        """
+        Set the pool size and keep-alive; if they change, the open connections are closed, to be reopened with them.
+
+        Parameters
+        ----------
+        pool_size: The most connections to keep open to each host.
+        keepalive: How long a connection is idle before TCP keep-alive probes
+            are sent on it, in seconds; 0 sends none.
+        """
+        if pool_size < 1:
+            raise ValueError(f"Pool size must be at least 1, not {pool_size}.")
+        if (pool_size, keepalive) == (self.pool_size, self.keepalive):
+            return
+        options = list(HTTPConnection.default_socket_options)
+        if keepalive > 0:
+            options += _keepalive_options(keepalive)
+        self.pools.connection_pool_kw.update(maxsize=pool_size, socket_options=options)
+        self.pools.clear()
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+
+    def session(
+        self, proxies: Optional[Dict[str, str]] = None, status_forcelist: Sequence[int] = (429, 500, 502, 503, 504)
+    ) -> Session:
+        """
+        Make a session for an API client, sending over the shared pools.
+
+        Requests are retried with backoff within the current deadline budget.
+
+        Parameters
+        ----------
+        proxies: A dict of proxies to be used by the requests library.
+        status_forcelist: The HTTP status codes to retry.
+
+        Returns
+        -------
+        The session.
+        """
+        session = Session()
+        if proxies is not None:
+            session.proxies = proxies
+        retry_strategy = DeadlineRetry(
+            total=5,
+            backoff_factor=1,
+            status_forcelist=list(status_forcelist),
+            allowed_methods=["HEAD", "GET", "PUT", "POST", "DELETE", "OPTIONS", "TRACE"]
+        )
+        adapter = _SharedPoolAdapter(self, max_retries=retry_strategy)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+# shared by every API client; configured from the settings before the first is made
+TRANSPORT = HttpTransport()
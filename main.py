@@ -5,119 +5,967 @@
 Temperature Monitor.
 """
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import dataclasses
+import functools
+import math
+import os
 import signal
-import sys
 import time
-from typing import NoReturn
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Set
 
-import board
-import adafruit_bmp3xx
-import adafruit_am2320
+from startup import STARTUP
+from adaptive import AdaptiveInterval
+from eprint import close_logging, configure_logging, eprint
+from metrics import DATA_SKIPPED, REGISTRY, MetricsServer
+from settings import Settings, Station as StationSettings
+from aggregator import WindowAggregator
+from circuit_breaker import CircuitBreaker
+from deadband import DeltaFilter
+from feed_cache import FeedCache
+from outbox import Outbox
+from rate_limit import TokenBucket
+from scheduler import DeadlineScheduler
+from sensors import SensorRegistry
+from tsdb import TimeSeriesStore
 
-from eprint import eprint
-from settings import Settings
-from positionstack import Positionstack
-from opentopodata import OpenTopoData
-from aio_logger import AIOLogger
+if TYPE_CHECKING:
+    # requests, Adafruit_IO and paho take seconds to import on a small board, so
+    # the network stack is only imported once sampling is under way; see connect()
+    from aio_logger import AIOLogger
+    from derived import DerivedWindow
+    from mqtt_transport import MQTTTransport
+    from opentopodata import OpenTopoData
+    from positionstack import Positionstack
+
+_CYCLE_SECONDS = REGISTRY.histogram(
+    "tempmon_cycle_seconds", "Time taken by a sampling cycle, up to handing data to the uploader."
+)
+_READING = REGISTRY.gauge("tempmon_reading", "Latest reading, by feed group and feed.", ["group", "feed"])
+_SAMPLING_INTERVAL = REGISTRY.gauge(
+    "tempmon_sampling_interval_seconds", "Current adaptive sampling interval, by feed group.", ["group"]
+)
 
 
 @dataclasses.dataclass
-class Sensors:
+class Reading:
     """
-    Collection of sensors used in this project.
+    Sensor data from one sampling cycle of a station, waiting to be uploaded.
     """
-    bmp388: adafruit_bmp3xx.BMP3XX_I2C
-    am2320: adafruit_am2320.AM2320
+    group: str
+    data: Dict[str, float]
+    created_at: str
 
 
-class TemperatureMonitor:
+class Station:
     """
-    Temperature Monitor.
+    One stack of sensors, sending to its own feed group.
     """
-    _FEED_GROUP = "outdoor"
-    _TEMPERATURE_FEED = "temperature"
-    _PRESSURE_FEED = "pressure"
-    _HUMIDITY_FEED = "humidity"
     _PRECISION = 1
+    _SAMPLE_JOB = "_sample"
+    _REPORT_JOB = "_report"
+    _REPORT_INTERVAL = 3600.0
 
-    def __init__(self) -> None:
-        self.settings = Settings('config.ini')
-        self.settings.dump()
-        self.aio_logger = AIOLogger(
-            self.settings.adafruit_username,
-            self.settings.adafruit_key,
-            group_name=self._FEED_GROUP
+    def __init__(
+        self,
+        settings: Settings,
+        config: StationSettings,
+        history: Optional[TimeSeriesStore] = None,
+        breaker_factory: Callable[[str], CircuitBreaker] = CircuitBreaker,
+        rate_share: Optional[Callable[[], float]] = None
+    ) -> None:
+        """
+        Parameters
+        ----------
+        settings: The application settings.
+        config: The settings of this station.
+        history: Optional local history of this station's readings.
+        breaker_factory: Makes the circuit breaker for a sensor, given its name.
+        rate_share: Gets the data points per minute this station may upload,
+            which caps adaptive sampling; uncapped if None.
+        """
+        self.settings = settings
+        self.name = config.name
+        self.group = config.group
+        self.history = history
+        self.sensors = SensorRegistry.from_settings(config.sensors, breaker_factory)
+        self.units = dict(self.sensors.units)
+        # quantity -> the first feed measuring it, as input to the derived metrics
+        self.quantities: Dict[str, str] = {}
+        for sensor in config.sensors:
+            for feed, quantity in sensor.feeds.items():
+                self.quantities.setdefault(quantity, feed)
+        self.elevation: Optional[float] = None
+        self.delta_filter: Optional[DeltaFilter] = None
+        self.aggregator: Optional[WindowAggregator] = None
+        self.derived: Dict[str, "DerivedWindow"] = {}
+        self._underived: Set[str] = set()
+        self.rate_share = rate_share
+        self.adaptive: Optional[AdaptiveInterval] = None
+        self.scheduler = DeadlineScheduler()
+        self.reconfigure(settings)
+
+    def reconfigure(self, settings: Settings) -> None:
+        """
+        Apply the application settings, keeping whatever they don't change.
+
+        The sensors aren't reopened, and the send-on-delta filter keeps the
+        last values it sent. Only jobs whose interval changes are rescheduled,
+        and only aggregation windows whose size changes start afresh.
+
+        Parameters
+        ----------
+        settings: The application settings.
+        """
+        self.settings = settings
+        if settings.deadbands:
+            if self.delta_filter is None:
+                self.delta_filter = DeltaFilter(settings.deadbands, settings.heartbeat)
+            else:
+                self.delta_filter.deadbands = dict(settings.deadbands)
+                self.delta_filter.heartbeat = settings.heartbeat
+        else:
+            self.delta_filter = None
+        longest = max(
+            (settings.sampling_interval(feed) for feed in self.sensors.feeds), default=settings.intervals.default
         )
-        if self.settings.send_location:
-            if self.settings.has_location():
-                latitude = self.settings.latitude
-                longitude = self.settings.longitude
+        if settings.adaptive_thresholds:
+            # the feeds are never sampled less often than configured, so the
+            # interval needn't relax past the longest of theirs
+            maximum = max(settings.adaptive_min, min(settings.adaptive_max, longest))
+            adaptive = (settings.adaptive_min, maximum, settings.adaptive_thresholds)
+            if self.adaptive is None:
+                self.adaptive = AdaptiveInterval(*adaptive, initial=maximum)
+            elif (self.adaptive.minimum, self.adaptive.maximum, self.adaptive.thresholds) != adaptive:
+                self.adaptive = AdaptiveInterval(*adaptive, initial=self.adaptive.interval)
+        else:
+            self.adaptive = None
+        if settings.sampling_rate > 0:
+            capacity = math.ceil(longest / settings.sampling_rate) + 1
+            if self.aggregator is None or self.aggregator.capacity != capacity:
+                self.aggregator = WindowAggregator(capacity)
+        else:
+            self.aggregator = None
+        self._configure_derived()
+        jobs = {feed: self.sampling_interval(feed) for feed in [*self.sensors.feeds, *self.derived]}
+        if self.aggregator is not None:
+            jobs[self._SAMPLE_JOB] = settings.sampling_rate
+        if self.delta_filter is not None:
+            jobs[self._REPORT_JOB] = self._REPORT_INTERVAL
+        for job in self.scheduler.jobs:
+            if job not in jobs:
+                self.scheduler.remove(job)
+        for job, interval in jobs.items():
+            self.scheduler.add(job, interval)
+
+    def _configure_derived(self) -> None:
+        """
+        Set up a window for each derived metric the station can calculate, keeping those already set up.
+        """
+        for metric in list(self.derived):
+            if metric not in self.settings.derived_metrics:
+                del self.derived[metric]
+        if not self.settings.derived_metrics:
+            return
+        from derived import METRICS, DerivedWindow  # pylint: disable=import-outside-toplevel
+        if self.aggregator is not None:
+            every = self.settings.sampling_rate
+        elif self.adaptive is not None:
+            every = self.settings.adaptive_min
+        else:
+            every = min(self.settings.sampling_interval(feed) for feed in self.quantities.values())
+        for metric in self.settings.derived_metrics:
+            if not all(quantity in self.quantities for quantity in METRICS[metric].inputs):
+                if metric not in self._underived:
+                    eprint(f"WARN: {self.name} doesn't measure what {metric} is derived from - not sending it.")
+                    self._underived.add(metric)
+                continue
+            capacity = math.ceil(self.settings.sampling_interval(metric) / every) + 1
+            window = self.derived.get(metric)
+            if window is None or window.capacity != capacity:
+                self.derived[metric] = DerivedWindow(metric, capacity, self.elevation)
+            self.units[metric] = METRICS[metric].unit
+
+    def sampling_interval(self, feed: str) -> float:
+        """
+        Get the sampling interval for a feed, in seconds.
+
+        Adaptive sampling can shorten a sensor feed's configured interval, but
+        never lengthens it, nor shortens it past what the data rate allows.
+        """
+        configured = self.settings.sampling_interval(feed)
+        if self.adaptive is None or feed not in self.sensors.feeds:
+            return configured
+        return min(configured, max(self.adaptive.interval, self._shortest_interval()))
+
+    def _shortest_interval(self) -> float:
+        """
+        Get the shortest interval at which the sensor feeds can be sent within the station's share of the data rate.
+
+        The derived metrics, which keep their own intervals, are paid for
+        first; with a sampling rate, each feed also sends its extra statistics.
+        """
+        if self.rate_share is None:
+            return 0.0
+        share = self.rate_share() * self.settings.adaptive_budget
+        share -= sum(60.0 / self.settings.sampling_interval(metric) for metric in self.derived)
+        per_cycle = len(self.sensors.feeds)
+        if self.aggregator is not None:
+            per_cycle *= 1 + len(self.settings.sampling_statistics)
+        if share <= 0:
+            return self.settings.adaptive_max
+        return 60.0 * per_cycle / share
+
+    def adapt(self, data: Dict[str, float], timestamp: float) -> None:
+        """
+        Adjust the sampling intervals of the sensor feeds to how fast their readings are changing.
+
+        Each feed is sampled at its configured interval, or more often while
+        the readings change fast; but never more often than the station's
+        share of the Adafruit.IO data rate allows.
+
+        Parameters
+        ----------
+        data: The readings of the sensor feeds, keyed by feed name.
+        timestamp: When they were read, in seconds.
+        """
+        if self.adaptive is None or not data:
+            return
+        self.adaptive.update(data, timestamp)
+        interval = max(self.adaptive.interval, self._shortest_interval())
+        _SAMPLING_INTERVAL.labels(self.group).set(interval)
+        intervals = {feed: self.sampling_interval(feed) for feed in self.sensors.feeds}
+        changed = {feed: value for feed, value in intervals.items() if value != self.scheduler.interval(feed)}
+        if not changed:
+            return
+        volatility = self.adaptive.volatility()
+        eprint(f"Sampling {self.name} every {interval:g}s at most (volatility {volatility:.2f}).")
+        for feed, feed_interval in changed.items():
+            self.scheduler.add(feed, feed_interval)
+
+    def set_elevation(self, elevation: Optional[float]) -> None:
+        """
+        Set the station's elevation, in metres, for reducing pressure to sea level; None if unknown.
+        """
+        self.elevation = elevation
+        for window in self.derived.values():
+            window.elevation = elevation
+
+    def discover(self, aio_logger: "AIOLogger") -> None:
+        """
+        Find this station's feeds at Adafruit.IO, creating any which are missing.
+
+        With a sampling rate, the feeds for the extra summary statistics are
+        included, as are the feeds of the derived metrics.
+
+        Parameters
+        ----------
+        aio_logger: The Adafruit.IO logger shared by all stations.
+        """
+        for feed in self.sensors.feeds:
+            aio_logger.get_feed(feed, self.group)
+            if self.aggregator is not None:
+                for stat in self.settings.sampling_statistics:
+                    aio_logger.get_feed(f"{feed}-{stat}", self.group)
+        for metric in self.derived:
+            aio_logger.get_feed(metric, self.group)
+
+    def round_datum(self, datum: float) -> float:
+        """
+        Round a single sensor datum to the precision we send to Adafruit.IO.
+        """
+        return round(datum, self._PRECISION)
+
+    def read_sensors(self, feeds: Iterable[str]) -> Dict[str, float]:
+        """
+        Read the current sensor data for some feeds, keyed by feed name.
+
+        Sensors are read concurrently; feeds whose sensor fails or times out are left out.
+
+        Parameters
+        ----------
+        feeds: The names of the feeds to read data for.
+
+        Raises
+        ------
+        OSError: when no sensor could be read.
+        """
+        return self.sensors.read(feeds)
+
+    def summarize(self, feeds: Iterable[str]) -> Dict[str, float]:
+        """
+        Summarize the current aggregation window of some feeds, and start new ones.
+
+        Each feed's value is the mean of its window; the configured extra
+        statistics are added under sibling feed names, e.g. temperature-max.
+
+        Parameters
+        ----------
+        feeds: The names of the feeds to summarize.
+
+        Returns
+        -------
+        A dict of the summary data, keyed by feed name. Feeds without any
+        samples in their window are left out.
+        """
+        data: Dict[str, float] = {}
+        if self.aggregator is None:
+            return data
+        for feed in feeds:
+            aggregate = self.aggregator.flush(feed)
+            if aggregate is None:
+                continue
+            data[feed] = aggregate.mean
+            for stat in self.settings.sampling_statistics:
+                data[f"{feed}-{stat}"] = getattr(aggregate, stat)
+        return data
+
+    def describe(self, data: Dict[str, float]) -> str:
+        """
+        Describe sensor data, with units, for logging.
+        """
+        parts = []
+        for feed, value in data.items():
+            base, _sep, stat = feed.partition("-")
+            if stat == "count":
+                parts.append(f"{value:.0f} (count)")
             else:
-                positionstack = Positionstack(self.settings.geocoding_token)
-                latitude, longitude, _label = positionstack.forward_geocode(
-                    self.settings.query,
-                    self.settings.region,
-                    self.settings.country
+                parts.append(f"{value:.1f} {self.units.get(base, '')}".rstrip() + (f" ({stat})" if stat else ""))
+        return ", ".join(parts)
+
+    def derive(self, samples: Dict[str, float]) -> None:
+        """
+        Add a sample of the sensors to the windows of the derived metrics.
+
+        Parameters
+        ----------
+        samples: The values read, keyed by feed name.
+        """
+        if not self.derived:
+            return
+        values = {quantity: samples[feed] for quantity, feed in self.quantities.items() if feed in samples}
+        for window in self.derived.values():
+            window.add(values)
+
+    async def sample(self, queue: "asyncio.Queue[Reading]", stopping: asyncio.Event) -> None:
+        """
+        Read the sensors on schedule and hand the readings to the uploader.
+
+        Each feed is sampled at its own interval, on wall-clock aligned deadlines.
+        When a sampling rate is configured, all sensors are instead sampled at that
+        rate, and each feed sends a summary of its samples at the end of its interval.
+        Derived metrics send the mean over the samples taken in their interval.
+        With adaptive sampling, the sensor feeds' interval follows how fast
+        their readings change.
+        Sensor reads run on a worker thread, and the readings go into a bounded
+        queue, so a slow upload never delays the next sample. If the queue is full,
+        the oldest reading is dropped to make room.
+
+        Parameters
+        ----------
+        queue: The queue shared with the uploader.
+        stopping: Set when the monitor should shut down.
+        """
+        while not stopping.is_set():
+            due = await self.scheduler.wait(stopping)
+            if self._REPORT_JOB in due:
+                self.report()
+            feeds = [job for job in due if job in self.sensors.feeds]
+            derived = [job for job in due if job in self.derived]
+            if not feeds and not derived and self._SAMPLE_JOB not in due:
+                continue
+            started = time.perf_counter()
+            timestamp = time.time()
+            created_at = datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+            data = await self._read_due(feeds, self._SAMPLE_JOB in due)
+            for metric in derived:
+                window = self.derived.get(metric)
+                mean = window.flush() if window is not None else None
+                if mean is not None:
+                    data[metric] = mean
+            self.adapt({feed: data[feed] for feed in feeds if feed in data}, timestamp)
+            if not data:
+                continue
+            data = {feed: self.round_datum(value) for feed, value in data.items()}
+            eprint(f"Sensor data recorded for {self.name}:", self.describe(data), sampled=True)
+            STARTUP.mark("first reading")
+            for feed, value in data.items():
+                _READING.labels(self.group, feed).set(value)
+                if self.history is not None:
+                    self.history.add(feed, timestamp, value)
+            self._enqueue(queue, data, created_at)
+            _CYCLE_SECONDS.observe(time.perf_counter() - started)
+
+    async def _read_due(self, feeds: List[str], sample: bool) -> Dict[str, float]:
+        """
+        Read the sensors for the feeds which are due, or summarize their samples with a sampling rate.
+
+        Parameters
+        ----------
+        feeds: The sensor feeds due to be sent.
+        sample: Whether the sensors are due to be sampled, with a sampling rate.
+
+        Returns
+        -------
+        A dict mapping feed names to the data to send.
+        """
+        if self.aggregator is None:
+            data: Dict[str, float] = {}
+            if feeds:
+                try:
+                    data = await asyncio.to_thread(self.read_sensors, feeds)
+                except OSError:
+                    pass
+                self.derive(data)
+            return data
+        if sample:
+            try:
+                samples = await asyncio.to_thread(self.read_sensors, self.sensors.feeds)
+            except OSError:
+                pass
+            else:
+                # the settings may have been reloaded during the read
+                if self.aggregator is not None:
+                    for feed, value in samples.items():
+                        self.aggregator.add(feed, value)
+                self.derive(samples)
+        return self.summarize(feeds)
+
+    def _enqueue(self, queue: "asyncio.Queue[Reading]", data: Dict[str, float], created_at: str) -> None:
+        """
+        Hand a cycle's data to the uploader, leaving out what the send-on-delta filter suppresses.
+
+        If the queue is full, the oldest reading is dropped to make room.
+
+        Parameters
+        ----------
+        queue: The queue shared with the uploader.
+        data: A dict mapping feed names to the data to send.
+        created_at: The ISO 8601 timestamp of the data.
+        """
+        if self.delta_filter is not None:
+            sampled = len(data)
+            data = self.delta_filter.filter(data)
+            DATA_SKIPPED.labels("deadband").inc(sampled - len(data))
+        if not data:
+            return
+        if queue.full():
+            dropped = queue.get_nowait()
+            queue.task_done()
+            eprint(f"WARN: Upload queue full - dropped reading from {dropped.created_at}.")
+            DATA_SKIPPED.labels("queue_full").inc(len(dropped.data))
+        queue.put_nowait(Reading(self.group, data, created_at))
+
+    def report(self) -> None:
+        """
+        Report how much data the send-on-delta filter has saved uploading.
+        """
+        if self.delta_filter is None:
+            return
+        eprint(
+            f"Send-on-delta for {self.name}: suppressed {self.delta_filter.suppressed} of "
+            f"{self.delta_filter.sent + self.delta_filter.suppressed} data "
+            f"({self.delta_filter.suppression_ratio:.0%})."
+        )
+
+    def close(self) -> None:
+        """
+        Stop the sensor worker threads.
+        """
+        self.sensors.close()
+
+
+class TemperatureMonitor:
+    """
+    Temperature Monitor, serving one or more stations.
+    """
+    _QUEUE_SIZE = 60
+    _UPLOAD_LINGER = 0.25
+    _SHUTDOWN_TIMEOUT = 10.0
+    _CONNECT_RETRY = 5.0
+    _CONNECT_RETRY_MAX = 300.0
+
+    def __init__(self) -> None:
+        with STARTUP.phase("settings"):
+            self.settings = Settings('config.ini')
+            self.configure_logging()
+            self.settings.dump()
+        self.metrics_server: Optional[MetricsServer] = None
+        if self.settings.metrics_port:
+            self.metrics_server = MetricsServer(self.settings.metrics_port, self.settings.metrics_host)
+        self.outbox = None
+        if self.settings.outbox_path:
+            self.outbox = Outbox(self.settings.outbox_path, self.settings.outbox_max_rows)
+        self.feed_cache = None
+        if self.settings.feed_cache_path:
+            self.feed_cache = FeedCache(
+                self.settings.feed_cache_path,
+                self.settings.adafruit_username,
+                self.settings.feed_cache_ttl
+            )
+        self.limiter = TokenBucket(self.settings.data_rate)
+        self.breaker_factory = functools.partial(
+            CircuitBreaker,
+            failure_threshold=self.settings.breaker_failures,
+            reset_timeout=self.settings.breaker_reset,
+            max_reset_timeout=self.settings.breaker_max_reset
+        )
+        # set up by connect(), once sampling has started
+        self.mqtt: Optional["MQTTTransport"] = None
+        self.aio_logger: Optional["AIOLogger"] = None
+        self.positionstack: Optional["Positionstack"] = None
+        self.otd: Optional["OpenTopoData"] = None
+        self._discovered = False
+        self._ready = False
+        # groups whose location settings changed, to look up again
+        self._relocated: Set[str] = set()
+        # looks up the stations' locations, retrying until it succeeds
+        self._lookup: Optional["asyncio.Task[None]"] = None
+        self._reload_lock = asyncio.Lock()
+        self.histories: List[TimeSeriesStore] = []
+        self.stations: List[Station] = []
+        with STARTUP.phase("sensors"):
+            for config in self.settings.stations:
+                history = None
+                if self.settings.history_path:
+                    path = self.settings.history_path
+                    if len(self.settings.stations) > 1:
+                        path = os.path.join(path, config.name)
+                    history = TimeSeriesStore(path)
+                    self.histories.append(history)
+                self.stations.append(
+                    Station(self.settings, config, history, self.breaker_factory, self.rate_share)
                 )
-            otd = OpenTopoData()
-            elevation = otd.get_elevation(latitude, longitude)
-            self.aio_logger.set_metadata(latitude, longitude, elevation)
-        self.aio_logger.get_feed(self._TEMPERATURE_FEED)
-        self.aio_logger.get_feed(self._PRESSURE_FEED)
-        self.aio_logger.get_feed(self._HUMIDITY_FEED)
-        i2c = board.I2C()
-        self.sensors = Sensors(
-            adafruit_bmp3xx.BMP3XX_I2C(i2c),
-            adafruit_am2320.AM2320(i2c)
+
+    def rate_share(self) -> float:
+        """
+        Get the data points per minute each station may upload: an even share of the current data rate.
+        """
+        return self.limiter.capacity / len(self.settings.stations)
+
+    def configure_logging(self) -> None:
+        """
+        Set up the log output from the settings.
+        """
+        configure_logging(
+            self.settings.log_format,
+            self.settings.log_level,
+            self.settings.log_buffer,
+            self.settings.log_flush,
+            self.settings.log_repeats,
+            self.settings.log_sample
         )
 
-    def log_single_datum(self, datum: float, feed: str) -> None:
+    def connect(self) -> "AIOLogger":
+        """
+        Set up the Adafruit.IO logger: discover the groups and feeds.
+
+        This is the slow part of startup - the network libraries take a while
+        to import, and discovery takes several API calls - so it runs on a
+        worker thread while the stations sample. Each step which an earlier
+        attempt already finished is skipped, so it is also run again to apply
+        reloaded settings. Discovery only counts as finished if the settings
+        weren't reloaded while it ran.
+
+        Returns
+        -------
+        The Adafruit.IO logger, ready to send.
+
+        Raises
+        ------
+        ConnectionError: when Adafruit.IO can't be reached, or gives a bad response.
+        """
+        # pylint: disable=import-outside-toplevel
+        with STARTUP.phase("network imports"):
+            from Adafruit_IO import AdafruitIOError, RequestError
+            from aio_logger import AIOLogger
+            from http_transport import TRANSPORT
+            from mqtt_transport import MQTTTransport
+        TRANSPORT.configure(self.settings.http_pool_size, self.settings.http_keepalive)
+        try:
+            if self.settings.mqtt_enabled and self.mqtt is None:
+                self.mqtt = MQTTTransport(
+                    self.settings.adafruit_username,
+                    self.settings.adafruit_key,
+                    host=self.settings.mqtt_host,
+                    port=self.settings.mqtt_port,
+                    tls=self.settings.mqtt_tls,
+                    max_inflight=self.settings.mqtt_inflight,
+                    limiter=self.limiter
+                )
+            if self.aio_logger is None:
+                with STARTUP.phase("group discovery"):
+                    self.aio_logger = AIOLogger(
+                        self.settings.adafruit_username,
+                        self.settings.adafruit_key,
+                        group_name=self.settings.stations[0].group,
+                        outbox=self.outbox,
+                        feed_cache=self.feed_cache,
+                        limiter=self.limiter,
+                        mqtt=self.mqtt,
+                        breaker_factory=self.breaker_factory,
+                        send_budget=self.settings.upload_budget
+                    )
+            if not self._discovered:
+                settings = self.settings
+                with STARTUP.phase("feed discovery"):
+                    for station in self.stations:
+                        station.discover(self.aio_logger)
+                # if the settings were reloaded meanwhile, discover again with them
+                self._discovered = self.settings is settings
+        except (AdafruitIOError, RequestError, OSError, LookupError, TypeError, ValueError) as exc:
+            # requests' exceptions are all OSErrors
+            raise ConnectionError(str(exc) or type(exc).__name__) from exc
+        return self.aio_logger
+
+    def lookup_metadata(self) -> None:
+        """
+        Look up the location and elevation of each station which doesn't have
+        them yet, or whose location settings have changed.
+
+        Every station is looked up at once: geocoding concurrently, and
+        elevations in one request. The API clients, and so their sessions, are
+        kept for later lookups. If the settings are reloaded meanwhile, the
+        stations are left to be looked up again with the new ones.
+
+        Raises
+        ------
+        OSError: when a lookup API can't be reached.
+        LookupError, TypeError, ValueError: when a lookup API gives a bad response.
+        """
+        # pylint: disable=import-outside-toplevel
+        from deadline import budget
+        from opentopodata import OpenTopoData
+        from positionstack import Positionstack
+        from response_cache import ResponseCache
+        settings = self.settings
+        if self.aio_logger is None:
+            return
+        if not settings.send_location:
+            self.aio_logger.metadata.clear()
+            for station in self.stations:
+                station.set_elevation(None)
+            return
+        if self.otd is None:
+            response_cache = None
+            if self.settings.response_cache_path:
+                response_cache = ResponseCache(
+                    self.settings.response_cache_path,
+                    self.settings.response_cache_ttl,
+                    self.settings.response_cache_negative_ttl,
+                    self.settings.response_cache_max_stale
+                )
+            self.otd = OpenTopoData(cache=response_cache)
+        if self.positionstack is None or self.positionstack.token != settings.geocoding_token:
+            self.positionstack = Positionstack(settings.geocoding_token, cache=self.otd.cache)
+        pending = [
+            (config, station) for config, station in zip(settings.stations, self.stations)
+            if config.group not in self.aio_logger.metadata or config.group in self._relocated
+        ]
+        if not pending:
+            return
+        with STARTUP.phase("metadata lookup"), budget(settings.lookup_budget):
+            queries = [
+                (config.query, config.region, config.country)
+                for config, _station in pending if config.location is None
+            ]
+            geocoded = iter(self.positionstack.forward_geocode_many(queries))
+            points = []
+            for config, _station in pending:
+                if config.location is not None:
+                    points.append((config.location.latitude, config.location.longitude))
+                else:
+                    latitude, longitude, _label = next(geocoded)
+                    points.append((latitude, longitude))
+            elevations = self.otd.get_elevations(points)
+        for (config, station), (latitude, longitude), elevation in zip(pending, points, elevations):
+            self.aio_logger.set_metadata(latitude, longitude, elevation, config.group)
+            station.set_elevation(elevation)
+            if self.settings is settings:
+                self._relocated.discard(config.group)
+
+    async def look_up_metadata(self) -> None:
+        """
+        Run lookup_metadata() on a worker thread until it succeeds, backing off between attempts.
+
+        Data is sent without the stations' locations meanwhile. If the settings
+        were reloaded during a lookup, it is run again with the new ones.
+        """
+        delay = self._CONNECT_RETRY
+        while True:
+            settings = self.settings
+            try:
+                await asyncio.to_thread(self.lookup_metadata)
+            except (OSError, LookupError, TypeError, ValueError) as exc:
+                # requests' exceptions are all OSErrors
+                eprint(
+                    f"WARN: Unable to look up the stations' locations ({str(exc) or type(exc).__name__})"
+                    f" - sending without them, retrying in {delay:.0f}s."
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self._CONNECT_RETRY_MAX)
+                continue
+            if self.settings is settings:
+                return
+
+    def start_lookup(self) -> None:
         """
-        Log a single sensor datum to an Adafruit.IO feed.
+        Start look_up_metadata() in the background, unless it is already running.
         """
-        rounded = round(datum, self._PRECISION)
-        self.aio_logger.log(feed, rounded)
+        if self._lookup is None or self._lookup.done():
+            self._lookup = asyncio.create_task(self.look_up_metadata())
 
-    def log_data(self) -> None:
+    async def start_uploads(self) -> "AIOLogger":
         """
-        Log the current sensor data.
+        Run connect() on a worker thread until it succeeds, backing off between
+        attempts, then start looking up the stations' locations.
+
+        Readings go into the outbox, or wait in the upload queue, meanwhile.
+
+        Returns
+        -------
+        The Adafruit.IO logger, ready to send.
+        """
+        delay = self._CONNECT_RETRY
+        while True:
+            try:
+                aio_logger = await asyncio.to_thread(self.connect)
+            except ConnectionError as exc:
+                eprint(f"WARN: Unable to set up Adafruit.IO logging ({exc}) - retrying in {delay:.0f}s.")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self._CONNECT_RETRY_MAX)
+                continue
+            if not self._discovered:
+                # the settings were reloaded during discovery, which reload() left to us
+                continue
+            self._ready = True
+            STARTUP.mark("ready to upload")
+            self.start_lookup()
+            return aio_logger
+
+    async def upload(self, queue: "asyncio.Queue[Reading]") -> None:
         """
+        Hand readings from the queue to the Adafruit.IO logger.
+
+        With several stations, the readings which arrive within a short time of
+        each other, i.e. from the same cycle, are handed over together, so they
+        go into the outbox in one transaction and are sent in one pass. The
+        logger blocks on disk or network I/O, so it runs on a worker thread,
+        within the upload deadline budget when it sends directly.
+
+        The logger is only set up here, so the samplers start right away. Until
+        it is ready, their readings go straight into the outbox, if there is
+        one, to be sent once their groups are known; otherwise they wait in
+        the queue.
+
+        Parameters
+        ----------
+        queue: The queue shared with the samplers.
+        """
+        connecting = asyncio.create_task(self.start_uploads())
         try:
-            temp2 = self.sensors.am2320.temperature
-            self.log_single_datum(temp2, self._TEMPERATURE_FEED)
-            humidity = self.sensors.am2320.relative_humidity
-            self.log_single_datum(humidity, self._HUMIDITY_FEED)
-            pressure = self.sensors.bmp388.pressure
-            self.log_single_datum(pressure, self._PRESSURE_FEED)
-            eprint(
-                f"Sensor data recorded: {temp2:.1f} °C, {humidity:.1f} %RH, {pressure:.1f} hPa"
-            )
-        except OSError as exc:
-            eprint("Unable to read sensor.", exc.strerror, sep="\n")
+            if self.outbox is None:
+                await connecting
+            await self._hand_off(queue, connecting)
+        finally:
+            connecting.cancel()
 
+    async def _hand_off(self, queue: "asyncio.Queue[Reading]", connecting: "asyncio.Task[AIOLogger]") -> None:
+        """
+        Hand readings from the queue to the logger once connecting is done, and to the outbox until then.
+        """
+        aio_logger: Optional["AIOLogger"] = None
+        loop = asyncio.get_running_loop()
+        while True:
+            readings = [await queue.get()]
+            if len(self.stations) > 1:
+                deadline = loop.time() + self._UPLOAD_LINGER
+                while len(readings) < len(self.stations) and loop.time() < deadline:
+                    try:
+                        readings.append(await asyncio.wait_for(queue.get(), deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        break
+            try:
+                if aio_logger is None and connecting.done():
+                    aio_logger = connecting.result()
+                    # including any left over from before a restart
+                    await asyncio.to_thread(
+                        aio_logger.resolve_pending, {config.group for config in self.settings.stations}
+                    )
+                if aio_logger is not None:
+                    from deadline import budget  # pylint: disable=import-outside-toplevel
+                    with budget(self.settings.upload_budget):
+                        await asyncio.to_thread(
+                            aio_logger.queue_batches,
+                            [(reading.data, reading.created_at, reading.group) for reading in readings]
+                        )
+                elif self.outbox is not None:
+                    await asyncio.to_thread(
+                        self.outbox.put_pending,
+                        [(reading.group, reading.data, reading.created_at) for reading in readings]
+                    )
+            finally:
+                for _reading in readings:
+                    queue.task_done()
+            if aio_logger is not None:
+                STARTUP.mark("first upload")
+                STARTUP.report()
 
-def main() -> NoReturn:
-    """
-    Entry point function when run from command line.
-    """
-    def signal_handler(*args):
+    async def reload(self) -> None:
+        """
+        Re-read config.ini, and apply what has changed without stopping sampling.
+
+        Intervals, sampling, adaptive sampling, send-on-delta, derived metrics,
+        deadline budgets, logging, the data rate and locations take effect at
+        once: the stations are reconfigured in place, new feeds are discovered
+        (feeds already known are taken from the cache), and only stations whose
+        location changed are looked up again. Settings which need the sensors,
+        logger or caches to be reopened are left as they are until a restart,
+        with a warning.
+        """
+        async with self._reload_lock:
+            try:
+                settings = await asyncio.to_thread(Settings, 'config.ini')
+            except (OSError, RuntimeError) as exc:
+                eprint(str(exc))
+                eprint("WARN: Not reloading config.ini - keeping the running settings.")
+                return
+            old = self.settings
+            restart = []
+            for section in ('outbox', 'cache', 'metrics', 'mqtt', 'http', 'history', 'breaker'):
+                if getattr(settings, section) != getattr(old, section):
+                    restart.append(f"[{section}]")
+                    setattr(settings, section, getattr(old, section))
+            if (settings.adafruit.key, settings.adafruit.username) != (old.adafruit.key, old.adafruit.username):
+                restart.append("[adafruit] key and username")
+                settings.adafruit = dataclasses.replace(settings.adafruit, key=old.adafruit.key, username=old.adafruit.username)
+            if [(station.name, station.group, station.sensors) for station in settings.stations] != [
+                (station.name, station.group, station.sensors) for station in old.stations
+            ]:
+                restart.append("stations and sensors")
+                settings.stations = old.stations
+            if restart:
+                eprint(f"WARN: Changes to {', '.join(restart)} need a restart to take effect.")
+            changed = [
+                f"[{section}]"
+                for section in ('intervals', 'sampling', 'adaptive', 'deadband', 'derived', 'deadline', 'logging')
+                if getattr(settings, section) != getattr(old, section)
+            ]
+            if settings.data_rate != old.data_rate:
+                changed.append("data rate")
+                self.limiter.set_rate(settings.data_rate)
+            relocated = {
+                new.group for new, running in zip(settings.stations, old.stations)
+                if (new.location, new.query, new.region, new.country)
+                != (running.location, running.query, running.region, running.country)
+            }
+            if settings.send_location != old.send_location or settings.geocoding_token != old.geocoding_token:
+                relocated = {station.group for station in settings.stations}
+            if relocated:
+                changed.append("locations")
+            if not changed:
+                eprint("Reloaded config.ini - nothing to apply.")
+                return
+            self.settings = settings
+            if settings.logging != old.logging:
+                self.configure_logging()
+            for station in self.stations:
+                station.reconfigure(settings)
+            self._relocated |= relocated
+            self._discovered = False
+            eprint(f"Reloaded config.ini - applying changes to {', '.join(changed)}.")
+            if self.aio_logger is not None:
+                self.aio_logger.send_budget = settings.upload_budget
+            if self._ready:
+                # otherwise, start_uploads() is still connecting, and picks up the changes itself
+                try:
+                    await asyncio.to_thread(self.connect)
+                except ConnectionError as exc:
+                    eprint(f"WARN: Unable to apply the new settings at Adafruit.IO ({exc}) - will retry at the next reload.")
+                self.start_lookup()
+
+    async def run(self) -> None:
+        """
+        Run the samplers and uploader until SIGINT or SIGTERM is received.
+        SIGHUP reloads config.ini.
+
+        Sampling starts at once; the logger is set up in the background. On
+        shutdown, readings still in the queue are given a short time to be
+        handed off before the logger is closed.
+        """
+        loop = asyncio.get_running_loop()
+        stopping = asyncio.Event()
+        # the reloads under way, kept referenced until they finish
+        reloads: Set["asyncio.Task[None]"] = set()
+
+        def signal_handler(signum: int) -> None:
+            """
+            Handle various signals
+            """
+            eprint(f'Handling signal {signum} ({signal.Signals(signum).name}).')
+            if signum in (signal.SIGINT, signal.SIGTERM):
+                stopping.set()
+            elif signum == signal.SIGHUP:
+                task = loop.create_task(self.reload())
+                reloads.add(task)
+                task.add_done_callback(reloads.discard)
+            else:
+                eprint("Unknown signal received.")
+
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+            loop.add_signal_handler(signum, signal_handler, signum)
+        # sensor reads and uploads run on worker threads, at least one each per station
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=2 * len(self.stations) + 4))
+        queue: "asyncio.Queue[Reading]" = asyncio.Queue(maxsize=self._QUEUE_SIZE * len(self.stations))
+        uploader = asyncio.create_task(self.upload(queue))
+        try:
+            await asyncio.gather(*(station.sample(queue, stopping) for station in self.stations))
+            try:
+                await asyncio.wait_for(queue.join(), self._SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                eprint(f"WARN: {queue.qsize()} readings were not handed off before shutdown.")
+        finally:
+            for task in (uploader, self._lookup):
+                if task is None:
+                    continue
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            await asyncio.to_thread(self.close)
+
+    def close(self) -> None:
         """
-        Handle various signals
+        Stop background work and flush the outbound data queue and history to disk.
         """
-        signum = args[0]
-        eprint(f'Handling signal {signum} ({signal.Signals(signum).name}).')
-        if signum in (signal.SIGINT, signal.SIGTERM):
-            sys.exit(0)
+        for station in self.stations:
+            station.close()
+        if self.aio_logger is not None:
+            self.aio_logger.close()
         else:
-            eprint("Unknown signal received.")
-
-    monitor = TemperatureMonitor()
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    while True:
-        monitor.log_data()
-        time.sleep(60)
+            if self.mqtt is not None:
+                self.mqtt.close()
+            if self.outbox is not None:
+                self.outbox.close()
+        for history in self.histories:
+            history.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+
+
+def main() -> None:
+    """
+    Entry point function when run from command line.
+    """
+    STARTUP.record("imports", time.perf_counter() - STARTUP.started)
+    try:
+        monitor = TemperatureMonitor()
+        asyncio.run(monitor.run())
+    finally:
+        close_logging()
 
 
 if __name__ == '__main__':
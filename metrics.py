@@ -0,0 +1,281 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Lightweight Prometheus-style metrics, and an optional HTTP endpoint to expose them.
+"""
+
+import bisect
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar, cast
+
+# a metric type, so that a family's children are typed as the family is
+_M = TypeVar("_M", bound="_Metric")
+
+
+class _Metric:
+    """
+    Base class for a metric family: a named metric with one child per set of label values.
+
+    Metrics are updated from several threads, so each guards its value with a lock of its own.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        self._lock = threading.Lock()
+
+    def labels(self: _M, *values: str) -> _M:
+        """
+        Get the child metric for a set of label values, creating it if needed.
+        """
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return cast(_M, child)
+
+    def _new_child(self: _M) -> _M:
+        return type(self)(self.name, self.documentation)
+
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        """
+        Get the samples of an unlabelled metric, as (suffix, extra labels, value).
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        """
+        Escape a label value for the Prometheus text format.
+        """
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @classmethod
+    def _format_labels(cls, names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+        pairs = [f'{name}="{cls._escape(value)}"' for name, value in zip(names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> str:
+        """
+        Render the metric family in the Prometheus text format.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        children = list(self._children.items()) if self.labelnames else [((), self)]
+        for values, child in children:
+            with child._lock:  # pylint: disable=protected-access
+                samples = child._samples()  # pylint: disable=protected-access
+            for suffix, extra, value in samples:
+                lines.append(
+                    f"{self.name}{suffix}{self._format_labels(self.labelnames, values, extra)} {value:g}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+    """
+    A count which only goes up.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        """
+        Add to the count.
+        """
+        with self._lock:
+            self.value += amount
+
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        return [("", "", self.value)]
+
+
+class Gauge(_Metric):
+    """
+    A value which can go up and down.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = math.nan
+
+    def set(self, value: float) -> None:
+        """
+        Set the value.
+        """
+        with self._lock:
+            self.value = value
+
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        return [("", "", self.value)]
+
+
+_H = TypeVar("_H", bound="Histogram")
+
+
+class Histogram(_Metric):
+    """
+    A distribution of observed values, counted in cumulative buckets.
+    """
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def _new_child(self: "_H") -> "_H":
+        return type(self)(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float) -> None:
+        """
+        Record an observed value.
+        """
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """
+        Observe the time taken by the body of a with statement, in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            samples.append(("_bucket", f'le="{bound:g}"', float(cumulative)))
+        cumulative += self.counts[-1]
+        samples.append(("_bucket", 'le="+Inf"', float(cumulative)))
+        samples.append(("_sum", "", self.sum))
+        samples.append(("_count", "", float(cumulative)))
+        return samples
+
+
+class Registry:
+    """
+    A collection of metrics, rendered together.
+    """
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _M) -> _M:
+        return cast(_M, self._metrics.setdefault(metric.name, metric))
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """
+        Get a counter, creating it if needed.
+        """
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """
+        Get a gauge, creating it if needed.
+        """
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = Histogram.DEFAULT_BUCKETS
+    ) -> Histogram:
+        """
+        Get a histogram, creating it if needed.
+        """
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text format.
+        """
+        return "".join(metric.render() for metric in list(self._metrics.values()))
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "tempmon_http_request_seconds", "Time taken by HTTP requests, including retries.", ["method", "host"]
+)
+HTTP_RETRIES = REGISTRY.counter(
+    "tempmon_http_retries_total", "HTTP requests retried, by host.", ["host"]
+)
+DATA_SKIPPED = REGISTRY.counter(
+    "tempmon_data_skipped_total", "Data points not sent, by reason.", ["reason"]
+)
+
+
+class MetricsServer:
+    """
+    Serve the metrics of a registry over HTTP, on a background thread.
+    """
+    def __init__(self, port: int, host: str = "127.0.0.1", registry: Optional[Registry] = None):
+        """
+        Parameters
+        ----------
+        port: The TCP port to listen on.
+        host: The address to listen on; only the local host by default.
+        registry: The registry to serve; defaults to the global registry.
+        """
+        served = registry or REGISTRY
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Serve /metrics, and nothing else.
+            """
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                Handle a GET request.
+                """
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = served.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """
+        Stop serving.
+        """
+        self._server.shutdown()
+        self._server.server_close()
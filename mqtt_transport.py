@@ -0,0 +1,254 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Persistent MQTT connection to Adafruit.IO, for sending data with less overhead than REST.
+"""
+
+import functools
+import json
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Set
+
+import paho.mqtt.client as mqtt
+
+from deadline import remaining
+from eprint import eprint
+from metrics import REGISTRY
+from rate_limit import TokenBucket
+
+_MQTT_CONNECTED = REGISTRY.gauge("tempmon_mqtt_connected", "1 while connected to the MQTT broker, otherwise 0.")
+_MQTT_CONNECTS = REGISTRY.counter("tempmon_mqtt_connects_total", "Connections made to the MQTT broker.")
+_MQTT_PUBLISH_SECONDS = REGISTRY.histogram(
+    "tempmon_mqtt_publish_seconds", "Time taken to publish a batch of data over MQTT, until acknowledged."
+)
+
+
+class MQTTUnavailable(ConnectionError):
+    """
+    Data couldn't be published over MQTT, so what paho never queued should be sent over REST instead.
+    """
+    def __init__(self, message: str, unsent: Dict[str, Any]):
+        """
+        Parameters
+        ----------
+        message: Why the data couldn't be published.
+        unsent: The values paho never queued, by feed key. The others are in
+            flight: paho resends them until they are acknowledged, so they
+            mustn't be sent again.
+        """
+        super().__init__(message)
+        self.unsent = unsent
+
+
+class MQTTTransport:
+    """
+    One persistent MQTT connection to Adafruit.IO, publishing data at QoS 1.
+
+    paho's network thread keeps the connection open, and reconnects with
+    exponential backoff whenever it drops. At most max_inflight messages are
+    left unacknowledged at once. publish_data() waits for the broker to
+    acknowledge every datum it was given. If the connection is down, or the
+    acknowledgements don't arrive in time, it raises MQTTUnavailable with the
+    data paho never queued, so that the caller can send just those over REST;
+    paho resends the rest itself, once reconnected. Either way, each datum's
+    on_ack callback is only called once the broker has acknowledged it, so
+    that it isn't dropped from the outbox while it could still be lost.
+
+    Adafruit.IO reports rejected data on the {username}/errors topic, and
+    throttling on {username}/throttle; both are logged, and throttling pauses
+    the rate limiter, if one is given.
+    """
+    _THROTTLE_SECONDS = re.compile(r"(\d+) seconds")
+
+    def __init__(
+        self,
+        username: str,
+        key: str,
+        host: str = "io.adafruit.com",
+        port: int = 8883,
+        tls: bool = True,
+        max_inflight: int = 20,
+        keepalive: int = 60,
+        ack_timeout: float = 10.0,
+        limiter: Optional[TokenBucket] = None
+    ):
+        """
+        Parameters
+        ----------
+        username: Username for Adafruit.IO.
+        key: Authentication Key for Adafruit.IO.
+        host: The MQTT broker, e.g. a local one for testing.
+        port: The broker's port; 8883 for TLS, 1883 for plain MQTT.
+        tls: Whether to connect with TLS.
+        max_inflight: The most messages to leave unacknowledged at once.
+        keepalive: Seconds between keep-alive pings on an idle connection.
+        ack_timeout: The longest to wait for a batch of data to be acknowledged, in seconds.
+        limiter: Optional rate limiter, paused when Adafruit.IO reports throttling.
+        """
+        self.username = username
+        self.ack_timeout = ack_timeout
+        self.limiter = limiter
+        self._connected = threading.Event()
+        self._lock = threading.Lock()
+        # the callbacks of the messages waiting to be acknowledged, by message id
+        self._waiting: Dict[int, Optional[Callable[[], None]]] = {}
+        # messages acknowledged before their callbacks were set
+        self._acked: Set[int] = set()
+        self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv311)
+        self._client.username_pw_set(username, key)
+        if tls:
+            self._client.tls_set()
+        self._client.max_inflight_messages_set(max_inflight)
+        # bound what paho holds for resending while disconnected
+        self._client.max_queued_messages_set(max_inflight * 50)
+        self._client.reconnect_delay_set(min_delay=1, max_delay=120)
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.on_message = self._on_message
+        self._client.on_publish = self._on_publish
+        _MQTT_CONNECTED.set(0)
+        self._client.connect_async(host, port, keepalive)
+        self._client.loop_start()
+
+    @property
+    def connected(self) -> bool:
+        """
+        Check whether the connection to the broker is up
+        """
+        return self._connected.is_set()
+
+    def wait_connected(self, timeout: float) -> bool:
+        """
+        Wait for the connection to the broker to come up.
+
+        Parameters
+        ----------
+        timeout: The longest to wait, in seconds.
+
+        Returns
+        -------
+        True if connected, False if the timeout passed first.
+        """
+        return self._connected.wait(timeout)
+
+    def _on_connect(self, client: mqtt.Client, _userdata: Any, _flags: Any, reason_code: Any, _properties: Any):
+        if reason_code.is_failure:
+            eprint(f"WARN: Adafruit.IO MQTT connection refused ({reason_code}) - will retry.")
+            return
+        client.subscribe([(f"{self.username}/errors", 0), (f"{self.username}/throttle", 0)])
+        _MQTT_CONNECTS.inc()
+        _MQTT_CONNECTED.set(1)
+        self._connected.set()
+
+    def _on_disconnect(self, _client: mqtt.Client, _userdata: Any, _flags: Any, reason_code: Any, _properties: Any):
+        was_connected = self._connected.is_set()
+        self._connected.clear()
+        _MQTT_CONNECTED.set(0)
+        if was_connected and reason_code != 0:
+            eprint(f"WARN: Adafruit.IO MQTT connection lost ({reason_code}) - reconnecting.")
+
+    def _on_message(self, _client: mqtt.Client, _userdata: Any, message: mqtt.MQTTMessage):
+        text = message.payload.decode("utf-8", errors="replace")
+        if message.topic.endswith("/throttle"):
+            eprint(f"WARN: Adafruit.IO MQTT throttled: {text}")
+            if self.limiter is not None:
+                match = self._THROTTLE_SECONDS.search(text)
+                self.limiter.pause(float(match.group(1)) if match else 60.0)
+        else:
+            eprint(f"WARN: Adafruit.IO MQTT error: {text}")
+
+    def _on_publish(self, _client: mqtt.Client, _userdata: Any, mid: int, _reason_code: Any, _properties: Any):
+        with self._lock:
+            if mid not in self._waiting:
+                self._acked.add(mid)
+                return
+            on_ack = self._waiting.pop(mid)
+        if on_ack is not None:
+            on_ack()
+
+    def _wait_ack(self, mid: int, on_ack: Optional[Callable[[], None]]) -> None:
+        """
+        Call on_ack once the broker acknowledges a message, or now if it already has.
+        """
+        with self._lock:
+            if mid not in self._acked:
+                self._waiting[mid] = on_ack
+                return
+            self._acked.discard(mid)
+        if on_ack is not None:
+            on_ack()
+
+    def publish_data(
+        self,
+        group_key: str,
+        values: Dict[str, Any],
+        metadata: Optional[Dict] = None,
+        on_ack: Optional[Callable[[str], None]] = None
+    ) -> None:
+        """
+        Publish values for several feeds of a group, and wait for the broker to acknowledge them.
+
+        Each value is published as JSON to {username}/feeds/{group}.{feed}/json.
+        The wait for acknowledgements is cut short by the current deadline budget.
+
+        Parameters
+        ----------
+        group_key: The key of the group which owns the feeds.
+        values: A dict mapping feed keys (within the group) to values.
+        metadata: Optional dict with lat, lon, ele and created_at, shared by all values.
+        on_ack: Optional callback, given the feed key of each value once the
+            broker has acknowledged it; it may be called on paho's network
+            thread, after publish_data() has returned.
+
+        Raises
+        ------
+        MQTTUnavailable: when not connected, or not all values were acknowledged
+            in time; its unsent attribute holds the values which weren't queued.
+        """
+        if not self._connected.is_set():
+            raise MQTTUnavailable("not connected", dict(values))
+        extra: Dict[str, Any] = {}
+        if metadata is not None:
+            extra = {
+                field: metadata[field]
+                for field in ('lat', 'lon', 'ele', 'created_at') if metadata.get(field) is not None
+            }
+        with _MQTT_PUBLISH_SECONDS.time():
+            messages = []
+            feeds = list(values)
+            for index, feed in enumerate(feeds):
+                info = self._client.publish(
+                    f"{self.username}/feeds/{group_key}.{feed}/json",
+                    json.dumps({'value': values[feed], **extra}),
+                    qos=1
+                )
+                if info.rc in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                    self._wait_ack(info.mid, functools.partial(on_ack, feed) if on_ack is not None else None)
+                if info.rc == mqtt.MQTT_ERR_NO_CONN:
+                    # queued all the same, to go out once reconnected
+                    unsent = feeds[index + 1:]
+                elif info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    unsent = feeds[index:]
+                else:
+                    messages.append(info)
+                    continue
+                raise MQTTUnavailable(mqtt.error_string(info.rc), {key: values[key] for key in unsent})
+            left = remaining()
+            timeout = self.ack_timeout if left is None else max(0.0, min(self.ack_timeout, left))
+            deadline = time.monotonic() + timeout
+            for info in messages:
+                info.wait_for_publish(max(0.0, deadline - time.monotonic()))
+                if not info.is_published():
+                    raise MQTTUnavailable(f"no acknowledgement within {timeout:g}s", {})
+
+    def close(self) -> None:
+        """
+        Disconnect from the broker, and stop the network thread.
+        """
+        self._client.disconnect()
+        self._client.loop_stop()
+        self._connected.clear()
+        _MQTT_CONNECTED.set(0)
@@ -5,6 +5,8 @@
 Wrapper for OpenTopoData.org API.
 """
 
+from typing import Dict, List, Optional, Sequence, Tuple
+
 from get_api import GetApi
 from eprint import eprint
 
@@ -23,10 +25,13 @@ class OpenTopoData(GetApi):
     ]
     _ENDPOINT = ",".join(_DATASETS)
 
-    def _parse_json(self, json_data) -> float:
+    # the most locations the API takes in one request
+    _MAX_LOCATIONS = 100
+
+    def _parse_json(self, json_data) -> List[Optional[float]]:
         """
         Parse the OpenTopoData elevation API endpoint JSON data and
-        return the elevation.
+        return the elevations.
 
         Parameters
         ----------
@@ -34,17 +39,17 @@ class OpenTopoData(GetApi):
 
         Returns
         -------
-        The elevation returned from the API endpoint, as a float.
+        The elevations returned from the API endpoint, in the order of the
+        locations requested; None where there is no data for a location.
         """
-        data = json_data["results"][0]
-        elevation: float = data["elevation"]
-        eprint("Elevation lookup successful:", elevation)
-        return elevation
+        elevations: List[Optional[float]] = [data["elevation"] for data in json_data["results"]]
+        eprint("Elevation lookup successful:", ", ".join(str(elevation) for elevation in elevations))
+        return elevations
 
-    def get_elevation(self, latitude: float, longitude: float) -> float:
+    def get_elevation(self, latitude: float, longitude: float) -> Optional[float]:
         """
         Call the elevation API endpoint from opentopodata.org and
-        return the elevation of the location.
+        return the elevation of the location, or None if there is no data for it.
 
         Parameters
         ----------
@@ -56,6 +61,40 @@ class OpenTopoData(GetApi):
         HTTPError: when the server can't fulfill the request.
         URLError: when the server can't be reached.
         """
-        params = {"locations": f"{latitude},{longitude}"}
-        url = self.build_url(self._BASE_URL, self._ENDPOINT, params)
-        return self.call_get_api(url, self._parse_json)
+        return self.get_elevations([(latitude, longitude)])[0]
+
+    def get_elevations(self, points: Sequence[Tuple[float, float]]) -> List[Optional[float]]:
+        """
+        Call the elevation API endpoint from opentopodata.org and
+        return the elevations of several locations.
+
+        Each distinct location is only looked up once, and up to 100 are
+        looked up per request. The requests are made one after another, as
+        the public API allows only one a second.
+
+        Parameters
+        ----------
+        points: The latitude and longitude of each location.
+
+        Returns
+        -------
+        The elevation of each location, in the order given; None where there
+        is no data for a location.
+
+        Raises
+        ------
+        HTTPError: when the server can't fulfill the request.
+        URLError: when the server can't be reached.
+        ValueError: when the server doesn't return an elevation for every location.
+        """
+        unique = list(dict.fromkeys(points))
+        found: Dict[Tuple[float, float], Optional[float]] = {}
+        for start in range(0, len(unique), self._MAX_LOCATIONS):
+            chunk = unique[start:start + self._MAX_LOCATIONS]
+            params = {"locations": "|".join(f"{latitude},{longitude}" for latitude, longitude in chunk)}
+            url = self.build_url(self._BASE_URL, self._ENDPOINT, params)
+            elevations = self.call_get_api(url, self._parse_json)
+            if len(elevations) != len(chunk):
+                raise ValueError(f"Expected {len(chunk)} elevations, but got {len(elevations)}.")
+            found.update(zip(chunk, elevations))
+        return [found[point] for point in points]
@@ -0,0 +1,200 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Durable store-and-forward queue for data waiting to be sent to Adafruit.IO.
+"""
+
+import dataclasses
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from metrics import DATA_SKIPPED
+
+# data stored before its group's key was known is kept under the group's name
+# with this prefix, which no Adafruit.IO key starts with, until resolve()
+_PENDING = "?"
+
+
+@dataclasses.dataclass
+class QueuedDatum:
+    """
+    A single datum waiting in the outbox.
+    """
+    rowid: int
+    group: str
+    feed: str
+    value: str
+    created_at: str
+    lat: Optional[float]
+    lon: Optional[float]
+    ele: Optional[float]
+
+
+class Outbox:
+    """
+    On-disk outbound queue, backed by SQLite in WAL mode.
+
+    Every datum is written here before any attempt is made to send it, so data
+    survives both network outages and crashes. WAL mode with synchronous=NORMAL
+    only syncs to disk at checkpoints, which keeps SD card writes to a minimum,
+    and the queue is trimmed to max_rows so that a long outage can't fill the card.
+
+    Data can be stored before the keys of its groups are known, e.g. while
+    Adafruit.IO is unreachable at startup, with put_pending(); it is held back
+    from peek() until resolve() gives it its group's key.
+    """
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            grp TEXT NOT NULL,
+            feed TEXT NOT NULL,
+            value TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            lat REAL,
+            lon REAL,
+            ele REAL
+        );
+        CREATE INDEX IF NOT EXISTS outbox_created_at ON outbox (created_at, id);
+    """
+
+    def __init__(self, path: str, max_rows: int = 100000):
+        """
+        Parameters
+        ----------
+        path: Path to the SQLite database file.
+        max_rows: The maximum number of data to keep; the oldest are dropped first.
+        """
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA journal_size_limit=1048576")
+        self._conn.executescript(self._SCHEMA)
+
+    def put(
+        self, group: str, data: Dict[str, Any], created_at: str, metadata: Optional[Dict] = None
+    ) -> None:
+        """
+        Add the data from one sampling cycle to the outbox in a single transaction.
+
+        Parameters
+        ----------
+        group: The key of the feed group the data belongs to.
+        data: A dict mapping feed names to the data to add to each feed.
+        created_at: The ISO 8601 timestamp at which the data was recorded.
+        metadata: Optional dict with lat, lon and ele to send along with the data.
+        """
+        self.put_many([(group, data, created_at, metadata)])
+
+    def put_many(
+        self, entries: Iterable[Tuple[str, Dict[str, Any], str, Optional[Dict]]]
+    ) -> None:
+        """
+        Add the data from several sampling cycles, e.g. of different groups, in a single transaction.
+
+        Parameters
+        ----------
+        entries: (group, data, created_at, metadata) tuples, as for put().
+        """
+        rows: List[Tuple[Any, ...]] = []
+        for group, data, created_at, metadata in entries:
+            location = metadata or {}
+            rows.extend(
+                (
+                    group, feed, str(value), created_at,
+                    location.get('lat'), location.get('lon'), location.get('ele')
+                )
+                for feed, value in data.items()
+            )
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO outbox (grp, feed, value, created_at, lat, lon, ele)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            trimmed = self._conn.execute(
+                "DELETE FROM outbox WHERE id <= "
+                "(SELECT id FROM outbox ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (self.max_rows,)
+            ).rowcount
+            self._conn.execute("COMMIT")
+        if trimmed > 0:
+            DATA_SKIPPED.labels("outbox_full").inc(trimmed)
+
+    def put_pending(self, entries: Iterable[Tuple[str, Dict[str, Any], str]]) -> None:
+        """
+        Add the data from several sampling cycles whose group keys aren't known yet, in a single transaction.
+
+        Parameters
+        ----------
+        entries: (group name, data, created_at) tuples; the data is held back
+            until its group is resolved.
+        """
+        self.put_many((_PENDING + group_name, data, created_at, None) for group_name, data, created_at in entries)
+
+    def resolve(self, group_name: str, group_key: str) -> int:
+        """
+        Give the data put_pending() stored for a group its group key, so it can be sent.
+
+        Parameters
+        ----------
+        group_name: The name of the group.
+        group_key: The key of the group.
+
+        Returns
+        -------
+        The number of data resolved.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE outbox SET grp = ? WHERE grp = ?", (group_key, _PENDING + group_name)
+            ).rowcount
+
+    def peek(self, limit: int) -> List[QueuedDatum]:
+        """
+        Get the oldest data in the outbox without removing them, leaving out any not yet resolved.
+
+        Parameters
+        ----------
+        limit: The maximum number of data to return.
+
+        Returns
+        -------
+        A list of queued data, in timestamp order.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT id, grp, feed, value, created_at, lat, lon, ele FROM outbox"
+                " WHERE grp NOT LIKE ? ORDER BY created_at, id LIMIT ?",
+                (_PENDING + "%", limit)
+            )
+            return [QueuedDatum(*row) for row in cursor.fetchall()]
+
+    def remove(self, rowids: Iterable[int]) -> None:
+        """
+        Remove data from the outbox, usually once they have been sent.
+
+        Parameters
+        ----------
+        rowids: The row ids of the data to remove.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", ((rowid,) for rowid in rowids))
+            self._conn.execute("COMMIT")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def close(self) -> None:
+        """
+        Checkpoint the write-ahead log and close the database.
+        """
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
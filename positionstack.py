@@ -5,7 +5,7 @@
 Wrapper for PositionStack.com API.
 """
 
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from get_api import GetApi
 from eprint import eprint
@@ -67,6 +67,17 @@ class Positionstack(GetApi):
         eprint("Latitude:", latitude, "Longitude:", longitude)
         return (latitude, longitude, label)
 
+    def _forward_url(self, query: str, region: Optional[str] = None, country: Optional[str] = None) -> str:
+        """
+        Get the forward geocoding url for a query.
+        """
+        params = {"query": query}
+        if country is not None:
+            params["country"] = country
+        if region is not None:
+            params["region"] = region
+        return self._get_url(self._FORWARD, params)
+
     def forward_geocode(
         self, query: str, region: Optional[str] = None, country: Optional[str] = None
     ) -> Tuple[float, float, str]:
@@ -89,13 +100,32 @@ class Positionstack(GetApi):
         HTTPError: when the server can't fulfill the request.
         URLError: when the server can't be reached.
         """
-        params = {"query": query}
-        if country is not None:
-            params["country"] = country
-        if region is not None:
-            params["region"] = region
-        url = self._get_url(self._FORWARD, params)
-        return self.call_get_api(url, self._parse_forward_json)
+        return self.call_get_api(self._forward_url(query, region, country), self._parse_forward_json)
+
+    def forward_geocode_many(
+        self, queries: Sequence[Tuple[str, Optional[str], Optional[str]]]
+    ) -> List[Tuple[float, float, str]]:
+        """
+        Call the forward geocoding API endpoint from postitionstack.com for
+        several queries at once, and return their locations in the same order.
+
+        Repeated queries are only looked up once, and the others are looked up concurrently.
+
+        Parameters
+        ----------
+        queries: The query, region and country of each location, as for forward_geocode().
+
+        Returns
+        -------
+        A list of tuples containing latitude, longitude, and label of each location.
+
+        Raises
+        ------
+        HTTPError: when the server can't fulfill a request.
+        URLError: when the server can't be reached.
+        """
+        urls = [self._forward_url(query, region, country) for query, region, country in queries]
+        return self.call_get_apis(urls, self._parse_forward_json)
 
     def _parse_reverse_json(self, json_data) -> Dict:
         """
@@ -133,6 +163,28 @@ class Positionstack(GetApi):
         HTTPError: when the server can't fulfill the request.
         URLError: when the server can't be reached.
         """
-        params = {"query": f"{latitude},{longitude}"}
-        url = self._get_url(self._REVERSE, params)
+        url = self._get_url(self._REVERSE, {"query": f"{latitude},{longitude}"})
         return self.call_get_api(url, self._parse_reverse_json)
+
+    def reverse_geocode_many(self, points: Sequence[Tuple[float, float]]) -> List[Dict]:
+        """
+        Call the reverse geocoding API endpoint from postitionstack.com for
+        several locations at once, and return their data in the same order.
+
+        Repeated locations are only looked up once, and the others are looked up concurrently.
+
+        Parameters
+        ----------
+        points: The latitude and longitude of each location.
+
+        Returns
+        -------
+        A list of dicts containing the location data.
+
+        Raises
+        ------
+        HTTPError: when the server can't fulfill a request.
+        URLError: when the server can't be reached.
+        """
+        urls = [self._get_url(self._REVERSE, {"query": f"{latitude},{longitude}"}) for latitude, longitude in points]
+        return self.call_get_apis(urls, self._parse_reverse_json)
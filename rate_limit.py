@@ -0,0 +1,196 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Client-side rate limiting for Adafruit.IO data.
+"""
+
+import threading
+import time
+from typing import Mapping, Optional
+
+
+class RateLimited(Exception):
+    """
+    Raised when there isn't enough rate limit budget left to send data now.
+    """
+    def __init__(self, cost: float, wait: float):
+        super().__init__(f"Rate limit budget exhausted - {cost:g} data points must wait {wait:.1f}s.")
+        self.cost = cost
+        self.wait = wait
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, counting data points.
+
+    The bucket refills at the account's data rate (points per minute), and holds
+    at most one minute's worth. High priority sends wait a short time for tokens;
+    low priority sends only go ahead if they leave a reserve for high priority
+    ones, and otherwise fail fast so the caller can hold them back.
+    """
+    HIGH = 0
+    LOW = 1
+
+    def __init__(self, rate_per_minute: float = 30, max_wait: float = 10.0, reserve: float = 0.5):
+        """
+        Parameters
+        ----------
+        rate_per_minute: The number of data points which can be sent per minute.
+        max_wait: The longest a high priority send waits for tokens, in seconds.
+        reserve: The fraction of the bucket which low priority sends must leave unused.
+        """
+        self.max_wait = max_wait
+        self.reserve = reserve
+        self._cond = threading.Condition()
+        self._rate = rate_per_minute / 60
+        self._capacity = float(rate_per_minute)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    @property
+    def capacity(self) -> float:
+        """
+        Get the most data points which can be sent at once
+        """
+        return self._capacity
+
+    def max_cost(self, priority: int = HIGH) -> int:
+        """
+        Get the most data points a single send of the given priority can ever cost.
+
+        Parameters
+        ----------
+        priority: TokenBucket.HIGH or TokenBucket.LOW.
+        """
+        if priority == self.LOW:
+            return max(1, int(self._capacity * (1 - self.reserve)))
+        return max(1, int(self._capacity))
+
+    def _refill(self, now: float) -> None:
+        """
+        Add the tokens earned since the last refill. Call with the lock held.
+        """
+        if now > self._updated:
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+
+    def _wait_time(self, cost: float, floor: float, now: float) -> float:
+        """
+        Get how long until cost tokens can be taken while keeping floor tokens. Call with the lock held.
+        """
+        needed = max(0.0, cost + floor - self._tokens) / self._rate
+        return max(needed, self._paused_until - now)
+
+    def set_rate(self, rate_per_minute: float, used: float = 0.0) -> None:
+        """
+        Change the data rate, e.g. once the account's limit is known.
+
+        Parameters
+        ----------
+        rate_per_minute: The number of data points which can be sent per minute.
+        used: The number of data points already sent in the current minute.
+        """
+        if rate_per_minute <= 0:
+            return
+        with self._cond:
+            self._refill(time.monotonic())
+            self._rate = rate_per_minute / 60
+            self._capacity = float(rate_per_minute)
+            self._tokens = min(self._tokens, max(0.0, self._capacity - used))
+            self._cond.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Empty the bucket and stop handing out tokens for a while, e.g. after a 429 response.
+
+        Parameters
+        ----------
+        seconds: How long to stop for.
+        """
+        with self._cond:
+            now = time.monotonic()
+            self._tokens = 0.0
+            self._updated = now
+            self._paused_until = max(self._paused_until, now + seconds)
+
+    def acquire(self, cost: float, priority: int = HIGH) -> None:
+        """
+        Take tokens for sending cost data points.
+
+        Parameters
+        ----------
+        cost: The number of data points to be sent.
+        priority: TokenBucket.HIGH or TokenBucket.LOW.
+
+        Raises
+        ------
+        RateLimited: when the tokens can't be had in time.
+        """
+        if cost <= 0:
+            return
+        with self._cond:
+            floor = self.reserve * self._capacity if priority == self.LOW else 0.0
+            deadline = time.monotonic() + (self.max_wait if priority == self.HIGH else 0.0)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_time(cost, floor, now)
+                if wait <= 0:
+                    self._tokens -= cost
+                    return
+                if now + wait > deadline:
+                    raise RateLimited(cost, wait)
+                self._cond.wait(wait)
+
+    def release(self, cost: float) -> None:
+        """
+        Give back tokens taken for data points which weren't sent after all.
+
+        Parameters
+        ----------
+        cost: The number of data points which weren't sent.
+        """
+        if cost <= 0:
+            return
+        with self._cond:
+            self._refill(time.monotonic())
+            self._tokens = min(self._capacity, self._tokens + cost)
+            self._cond.notify_all()
+
+    def observe(self, status_code: int, headers: Mapping[str, str]) -> None:
+        """
+        Learn from a response: back off after a 429, and follow any rate limit headers.
+
+        Parameters
+        ----------
+        status_code: The HTTP status code of the response.
+        headers: The HTTP headers of the response.
+        """
+        limit = self._header_float(headers, "X-AIO-Datarate-Limit", "X-RateLimit-Limit")
+        remaining = self._header_float(headers, "X-AIO-Datarate-Remaining", "X-RateLimit-Remaining")
+        if limit is not None and limit != self._capacity:
+            self.set_rate(limit)
+        if remaining is not None:
+            with self._cond:
+                self._refill(time.monotonic())
+                self._tokens = min(self._tokens, remaining)
+        if status_code == 429:
+            retry_after = self._header_float(headers, "Retry-After")
+            self.pause(retry_after if retry_after is not None else 60.0)
+
+    @staticmethod
+    def _header_float(headers: Mapping[str, str], *names: str) -> Optional[float]:
+        """
+        Get the first of several headers which is present and numeric.
+        """
+        for name in names:
+            value = headers.get(name)
+            if value is None:
+                continue
+            try:
+                return float(value)
+            except ValueError:
+                continue
+        return None
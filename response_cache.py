@@ -0,0 +1,169 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+On-disk cache of GET API responses.
+"""
+
+import dataclasses
+import json
+import os
+import threading
+import time
+import urllib.parse
+from typing import Any, Dict, Optional
+
+from eprint import eprint
+
+
+@dataclasses.dataclass
+class CachedResponse:
+    """
+    A cached GET API response.
+    """
+    stored_at: float
+    ok: bool
+    body: Any
+
+    @property
+    def age(self) -> float:
+        """
+        Get the age of the response, in seconds
+        """
+        return time.time() - self.stored_at
+
+
+class ResponseCache:
+    """
+    On-disk cache of GET API responses, keyed by normalized URL.
+
+    Access keys and tokens are removed from the URL before it is used as a key,
+    so they are never written to disk. Successful responses are fresh for ttl
+    seconds; failed ones (negative entries) for negative_ttl seconds. A
+    successful response up to max_stale seconds old can still be used when the
+    server can't be reached.
+    """
+    _SECRET_PARAMS = frozenset(("access_key", "api_key", "apikey", "key", "token"))
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 2592000,
+        negative_ttl: float = 3600,
+        max_stale: float = 31536000
+    ):
+        """
+        Parameters
+        ----------
+        path: Path to the JSON cache file.
+        ttl: How long a successful response is fresh for, in seconds.
+        negative_ttl: How long a failed response is fresh for, in seconds.
+        max_stale: How old a successful response can be and still be used
+            when the server can't be reached, in seconds.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_stale = max_stale
+        self._lock = threading.Lock()
+        self._entries: Dict[str, CachedResponse] = {}
+        self._load()
+
+    def _load(self) -> None:
+        """
+        Load the cache file, if it exists.
+        """
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                cached = json.load(file)
+            self._entries = {key: CachedResponse(**entry) for key, entry in cached.items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError):
+            eprint(f"WARN: Unable to read response cache {self.path} - ignored.")
+
+    def _save(self) -> None:
+        """
+        Save the cache to disk, replacing the cache file atomically.
+        """
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as file:
+                json.dump(
+                    {key: dataclasses.asdict(entry) for key, entry in self._entries.items()},
+                    file
+                )
+            os.replace(temp_path, self.path)
+        except OSError:
+            eprint(f"WARN: Unable to write response cache {self.path} - ignored.")
+
+    @classmethod
+    def normalize(cls, url: str) -> str:
+        """
+        Normalize a URL for use as a cache key.
+
+        The scheme and host are lowercased, secret parameters are removed,
+        and the remaining query parameters are sorted.
+
+        Parameters
+        ----------
+        url: The URL to normalize.
+
+        Returns
+        -------
+        The normalized URL.
+        """
+        parts = urllib.parse.urlsplit(url)
+        params = sorted(
+            (name, value)
+            for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+            if name.lower() not in cls._SECRET_PARAMS
+        )
+        return urllib.parse.urlunsplit((
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            parts.path,
+            urllib.parse.urlencode(params),
+            ""
+        ))
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        """
+        Get the cached response for a URL, whether or not it is fresh.
+
+        Parameters
+        ----------
+        url: The URL of the request.
+
+        Returns
+        -------
+        The cached response, or None if there isn't one.
+        """
+        with self._lock:
+            return self._entries.get(self.normalize(url))
+
+    def is_fresh(self, entry: CachedResponse) -> bool:
+        """
+        Determine whether a cached response can be used without asking the server.
+        """
+        return entry.age < (self.ttl if entry.ok else self.negative_ttl)
+
+    def is_usable_stale(self, entry: CachedResponse) -> bool:
+        """
+        Determine whether a cached response can be used when the server can't be reached.
+        """
+        return entry.ok and entry.age < self.max_stale
+
+    def put(self, url: str, body: Any, ok: bool = True) -> None:
+        """
+        Store a response in the cache and save it to disk.
+
+        Parameters
+        ----------
+        url: The URL of the request.
+        body: The parsed JSON body of the response.
+        ok: False for a negative entry, i.e. a response which couldn't be used.
+        """
+        with self._lock:
+            self._entries[self.normalize(url)] = CachedResponse(time.time(), ok, body)
+            self._save()
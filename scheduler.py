@@ -0,0 +1,168 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Drift-free scheduler for periodic jobs.
+"""
+
+import asyncio
+import math
+import time
+from typing import Dict, List, Optional
+
+from eprint import eprint
+
+
+class DeadlineScheduler:
+    """
+    Schedule named jobs, each with its own interval, on wall-clock aligned boundaries.
+
+    The first deadline of each job is aligned to a multiple of its interval on the
+    wall clock (so a 60 second job fires on the minute). From then on, deadlines
+    are advanced on the monotonic clock by exactly one interval, so the time taken
+    by the work itself never causes drift, and clock steps don't cause bursts.
+    Deadlines which pass without being serviced are counted and reported rather
+    than run late. Jobs can be added, changed or removed at any time, even while
+    waiting.
+    """
+    def __init__(self, intervals: Optional[Dict[str, float]] = None):
+        """
+        Parameters
+        ----------
+        intervals: A dict mapping job names to their intervals, in seconds.
+        """
+        self._intervals: Dict[str, float] = {}
+        self._deadlines: Dict[str, float] = {}
+        self.missed: Dict[str, int] = {}
+        # set when the jobs change, to cut a wait short
+        self._changed = asyncio.Event()
+        for name, interval in (intervals or {}).items():
+            self.add(name, interval)
+
+    @staticmethod
+    def _next_boundary(interval: float) -> float:
+        """
+        Get the monotonic time of the next wall-clock boundary for an interval.
+
+        Parameters
+        ----------
+        interval: The interval, in seconds.
+
+        Returns
+        -------
+        The monotonic time of the next multiple of interval on the wall clock.
+        """
+        wall, mono = time.time(), time.monotonic()
+        return mono + (math.floor(wall / interval) + 1) * interval - wall
+
+    def add(self, name: str, interval: float) -> None:
+        """
+        Add a job, or change the interval of an existing one.
+
+        Parameters
+        ----------
+        name: The name of the job.
+        interval: How often the job is due, in seconds.
+        """
+        if interval <= 0:
+            raise ValueError(f"Interval for {name} must be positive, not {interval}.")
+        if self._intervals.get(name) == interval:
+            return
+        self._intervals[name] = interval
+        self._deadlines[name] = self._next_boundary(interval)
+        self.missed.setdefault(name, 0)
+        self._changed.set()
+
+    def remove(self, name: str) -> None:
+        """
+        Remove a job.
+
+        Parameters
+        ----------
+        name: The name of the job.
+        """
+        self._intervals.pop(name, None)
+        self._deadlines.pop(name, None)
+        self._changed.set()
+
+    @property
+    def jobs(self) -> List[str]:
+        """
+        Get the names of the jobs
+        """
+        return list(self._intervals)
+
+    def interval(self, name: str) -> float:
+        """
+        Get the interval of a job, in seconds.
+        """
+        return self._intervals[name]
+
+    def next_deadline(self) -> float:
+        """
+        Get the monotonic time at which the next job is due.
+        """
+        return min(self._deadlines.values(), default=math.inf)
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        """
+        Get the jobs which are due, and advance their deadlines.
+
+        Parameters
+        ----------
+        now: The current monotonic time; defaults to time.monotonic().
+
+        Returns
+        -------
+        A list of the names of the jobs which are due.
+        """
+        if now is None:
+            now = time.monotonic()
+        due = []
+        for name, deadline in self._deadlines.items():
+            if deadline > now:
+                continue
+            due.append(name)
+            interval = self._intervals[name]
+            deadline += interval
+            if deadline <= now:
+                missed = math.floor((now - deadline) / interval) + 1
+                deadline += missed * interval
+                self.missed[name] += missed
+                eprint(f"WARN: Missed {missed} deadline(s) for {name} ({self.missed[name]} in total).")
+            self._deadlines[name] = deadline
+        return due
+
+    async def wait(self, stopping: Optional[asyncio.Event] = None) -> List[str]:
+        """
+        Wait until one or more jobs are due.
+
+        Parameters
+        ----------
+        stopping: Optional event which cuts the wait short when set.
+            Changing the jobs also cuts it short, to wait again for the new deadlines.
+
+        Returns
+        -------
+        A list of the names of the jobs which are due, or an empty list if
+        stopping was set first.
+        """
+        while True:
+            self._changed.clear()
+            delay = self.next_deadline() - time.monotonic()
+            if delay > 0:
+                waiters = [asyncio.ensure_future(self._changed.wait())]
+                if stopping is not None:
+                    waiters.append(asyncio.ensure_future(stopping.wait()))
+                try:
+                    await asyncio.wait(
+                        waiters, timeout=None if math.isinf(delay) else delay, return_when=asyncio.FIRST_COMPLETED
+                    )
+                finally:
+                    for waiter in waiters:
+                        waiter.cancel()
+            if stopping is not None and stopping.is_set():
+                return []
+            due = self.due()
+            if due:
+                return due
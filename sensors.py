@@ -0,0 +1,287 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Registry of sensor types, and concurrent reading of sensors across I2C buses.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import dataclasses
+import importlib
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from circuit_breaker import CircuitBreaker
+from eprint import eprint
+from metrics import REGISTRY
+
+_SENSOR_READ_SECONDS = REGISTRY.histogram(
+    "tempmon_sensor_read_seconds", "Time taken to read a sensor, by sensor name.", ["sensor"]
+)
+_SENSOR_ERRORS = REGISTRY.counter(
+    "tempmon_sensor_errors_total", "Failed or timed out sensor reads, by sensor name.", ["sensor"]
+)
+
+
+@dataclasses.dataclass
+class SensorType:
+    """
+    A kind of sensor: how to open one, and what it measures.
+    """
+    factory: Callable[[Any, Optional[int]], Any]
+    # quantity name -> (driver attribute, unit)
+    quantities: Dict[str, Tuple[str, str]]
+
+
+def _driver(module: str, cls: str) -> Callable[[Any, Optional[int]], Any]:
+    """
+    Get a factory for a CircuitPython I2C driver, which imports its module when first used.
+    """
+    def create(bus: Any, address: Optional[int]) -> Any:
+        driver = getattr(importlib.import_module(module), cls)
+        return driver(bus) if address is None else driver(bus, address=address)
+    return create
+
+
+SENSOR_TYPES: Dict[str, SensorType] = {
+    'bmp388': SensorType(
+        _driver('adafruit_bmp3xx', 'BMP3XX_I2C'),
+        {'pressure': ('pressure', "hPa"), 'temperature': ('temperature', "°C")}
+    ),
+    'am2320': SensorType(
+        _driver('adafruit_am2320', 'AM2320'),
+        {'temperature': ('temperature', "°C"), 'humidity': ('relative_humidity', "%RH")}
+    ),
+}
+
+
+def register_sensor_type(name: str, sensor_type: SensorType) -> None:
+    """
+    Add a sensor type, so that it can be used in config.ini.
+
+    Parameters
+    ----------
+    name: The name to use as the type of a [sensor:*] section.
+    sensor_type: How to open the sensor, and what it measures.
+    """
+    SENSOR_TYPES[name] = sensor_type
+
+
+_BUSES: Dict[str, Any] = {}
+_BUS_LOCKS: Dict[str, threading.Lock] = {}
+
+
+def open_bus(spec: str) -> Any:
+    """
+    Open an I2C bus, or get it if it is already open.
+
+    Parameters
+    ----------
+    spec: 'default' for board.I2C(), a Linux I2C bus number such as 3 for
+        /dev/i2c-3, or a pair of board pin names such as D1,D0.
+    """
+    if spec in _BUSES:
+        return _BUSES[spec]
+    board = importlib.import_module('board')
+    if spec == 'default':
+        bus = board.I2C()
+    elif spec.isdigit():
+        bus = importlib.import_module('adafruit_extended_bus').ExtendedI2C(int(spec))
+    else:
+        scl, sda = (pin.strip() for pin in spec.split(','))
+        bus = importlib.import_module('busio').I2C(getattr(board, scl), getattr(board, sda))
+    _BUSES[spec] = bus
+    return bus
+
+
+def bus_lock(spec: str) -> threading.Lock:
+    """
+    Get the lock which serializes reads on an I2C bus, shared by every registry using the bus.
+    """
+    return _BUS_LOCKS.setdefault(spec, threading.Lock())
+
+
+@dataclasses.dataclass
+class Sensor:
+    """
+    An opened sensor, and the feeds it provides.
+    """
+    name: str
+    device: Any
+    bus: str
+    # feed name -> driver attribute
+    feeds: Dict[str, str]
+    timeout: float
+    # feed name -> unit, for logging
+    units: Dict[str, str] = dataclasses.field(default_factory=dict)
+    # extra attempts at a failed read, within the timeout
+    retries: int = 2
+
+
+class SensorRegistry:
+    """
+    The sensors of a station, read concurrently.
+
+    Each sensor is read on its own worker thread, so sensors on separate buses
+    are read at the same time, while a lock per bus keeps reads on a shared bus
+    one at a time, even across the registries of several stations. Every sensor
+    has its own timeout: a read which takes longer is abandoned, so a slow or
+    hung device only costs its own feeds, and it isn't read again until the
+    stuck read returns.
+
+    A failed read is retried a few times straight away, since I2C errors are
+    often transient. A sensor which keeps failing trips its circuit breaker,
+    and is then skipped, without touching the bus, until the breaker's next
+    probe.
+    """
+    _RETRY_DELAY = 0.1
+
+    def __init__(
+        self,
+        sensors: Iterable[Sensor],
+        breaker_factory: Callable[[str], CircuitBreaker] = CircuitBreaker
+    ):
+        """
+        Parameters
+        ----------
+        sensors: The opened sensors.
+        breaker_factory: Makes the circuit breaker for a component, given its name.
+        """
+        self.sensors = list(sensors)
+        self._breakers = {sensor.name: breaker_factory(f"sensor {sensor.name}") for sensor in self.sensors}
+        self._by_feed = {feed: sensor for sensor in self.sensors for feed in sensor.feeds}
+        self._bus_locks = {sensor.bus: bus_lock(sensor.bus) for sensor in self.sensors}
+        self._pending: Dict[str, Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.sensors)), thread_name_prefix="sensor")
+        self.units = {feed: unit for sensor in self.sensors for feed, unit in sensor.units.items()}
+
+    @classmethod
+    def from_settings(
+        cls, configs: Iterable[Any], breaker_factory: Callable[[str], CircuitBreaker] = CircuitBreaker
+    ) -> "SensorRegistry":
+        """
+        Open the buses and sensors described in the settings.
+
+        Parameters
+        ----------
+        configs: The settings of each sensor, with name, type, bus, address, feeds, timeout and retries.
+        breaker_factory: Makes the circuit breaker for a component, given its name.
+        """
+        sensors = []
+        for config in configs:
+            sensor_type = SENSOR_TYPES[config.type]
+            sensors.append(Sensor(
+                config.name,
+                sensor_type.factory(open_bus(config.bus), config.address),
+                config.bus,
+                {feed: sensor_type.quantities[quantity][0] for feed, quantity in config.feeds.items()},
+                config.timeout,
+                {feed: sensor_type.quantities[quantity][1] for feed, quantity in config.feeds.items()},
+                config.retries
+            ))
+        return cls(sensors, breaker_factory)
+
+    @property
+    def feeds(self) -> List[str]:
+        """
+        Get the names of all feeds the sensors provide
+        """
+        return list(self._by_feed)
+
+    def _read_sensor(self, sensor: Sensor, feeds: List[str], deadline: float) -> Dict[str, float]:
+        """
+        Read some feeds of one sensor, holding its bus. Runs on a worker thread.
+
+        A failed read is retried up to the sensor's retries, as long as there
+        is time left before the deadline. The bus is released between attempts.
+
+        Raises
+        ------
+        OSError: when the sensor can't be read.
+        TimeoutError: when the bus isn't free before the deadline.
+        """
+        lock = self._bus_locks[sensor.bus]
+        attempt = 0
+        while True:
+            if not lock.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise TimeoutError(f"I2C bus {sensor.bus} busy")
+            try:
+                with _SENSOR_READ_SECONDS.labels(sensor.name).time():
+                    return {feed: getattr(sensor.device, sensor.feeds[feed]) for feed in feeds}
+            except OSError:
+                if attempt >= sensor.retries or time.monotonic() + self._RETRY_DELAY >= deadline:
+                    raise
+            finally:
+                lock.release()
+            attempt += 1
+            time.sleep(self._RETRY_DELAY)
+
+    def read(self, feeds: Iterable[str]) -> Dict[str, float]:
+        """
+        Read the current sensor data for some feeds, keyed by feed name.
+
+        Feeds whose sensor fails or times out are left out, and a warning is
+        logged. Feeds whose sensor's circuit breaker is open are left out quietly.
+
+        Parameters
+        ----------
+        feeds: The names of the feeds to read data for.
+
+        Raises
+        ------
+        OSError: when none of the sensors could be read.
+        """
+        wanted: Dict[str, List[str]] = {}
+        for feed in feeds:
+            wanted.setdefault(self._by_feed[feed].name, []).append(feed)
+        start = time.monotonic()
+        futures = {}
+        errors = []
+        skipped = 0
+        for sensor in self.sensors:
+            if sensor.name not in wanted:
+                continue
+            breaker = self._breakers[sensor.name]
+            if not breaker.allow():
+                skipped += 1
+                continue
+            pending = self._pending.get(sensor.name)
+            if pending is not None and not pending.done():
+                errors.append(f"{sensor.name}: still busy with an earlier read")
+                _SENSOR_ERRORS.labels(sensor.name).inc()
+                breaker.record_failure()
+                continue
+            futures[sensor.name] = self._executor.submit(
+                self._read_sensor, sensor, wanted[sensor.name], start + sensor.timeout
+            )
+            self._pending[sensor.name] = futures[sensor.name]
+        data: Dict[str, float] = {}
+        for sensor in self.sensors:
+            future = futures.get(sensor.name)
+            if future is None:
+                continue
+            breaker = self._breakers[sensor.name]
+            try:
+                data.update(future.result(timeout=max(0.0, start + sensor.timeout - time.monotonic())))
+            except FutureTimeoutError:
+                errors.append(f"{sensor.name}: timed out after {sensor.timeout:g}s")
+                _SENSOR_ERRORS.labels(sensor.name).inc()
+                breaker.record_failure()
+            except OSError as exc:
+                errors.append(f"{sensor.name}: {exc.strerror or exc}")
+                _SENSOR_ERRORS.labels(sensor.name).inc()
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        if errors:
+            eprint("WARN: Unable to read sensor.", *errors, sep="\n")
+        if not data and (errors or skipped):
+            raise OSError("No sensors could be read.")
+        return data
+
+    def close(self) -> None:
+        """
+        Stop the worker threads, without waiting for reads still in progress.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -7,9 +7,12 @@ Application settings parser.
 
 import configparser
 import dataclasses
-from typing import Optional
+import os
+from typing import Dict, List, Optional
 
-from eprint import eprint
+from aggregator import WindowAggregator
+from eprint import FORMATS, LEVELS, eprint
+from sensors import SENSOR_TYPES
 
 
 @dataclasses.dataclass
@@ -29,6 +32,7 @@ class Adafruit:
     key: str
     username: str
     send_location: bool
+    data_rate: float
 
 
 @dataclasses.dataclass
@@ -42,10 +46,187 @@ class Positionstack:
     country: str
 
 
+@dataclasses.dataclass
+class Outbox:
+    """
+    Settings for the durable outbound data queue
+    """
+    path: str
+    max_rows: int
+
+
+@dataclasses.dataclass
+class Intervals:
+    """
+    Sampling intervals, in seconds
+    """
+    default: float
+    feeds: Dict[str, float]
+
+
+@dataclasses.dataclass
+class Cache:
+    """
+    Settings for on-disk caches
+    """
+    feeds_path: str
+    feeds_ttl: float
+    responses_path: str
+    responses_ttl: float
+    responses_negative_ttl: float
+    responses_max_stale: float
+
+
+@dataclasses.dataclass
+class Sampling:
+    """
+    Settings for high-rate sampling with windowed aggregation
+    """
+    rate: float
+    statistics: List[str]
+
+
+@dataclasses.dataclass
+class Derived:
+    """
+    Settings for metrics derived from the measured ones
+    """
+    metrics: List[str]
+
+
+@dataclasses.dataclass
+class Deadband:
+    """
+    Settings for send-on-delta reporting
+    """
+    feeds: Dict[str, float]
+    heartbeat: float
+
+
+@dataclasses.dataclass
+class Adaptive:
+    """
+    Settings for adapting the sampling interval to how fast the readings change
+    """
+    # feed name -> rate of change per minute at which to sample faster
+    feeds: Dict[str, float]
+    minimum: float
+    maximum: float
+    budget: float
+
+
+@dataclasses.dataclass
+class History:
+    """
+    Settings for the local history of readings
+    """
+    path: str
+
+
+@dataclasses.dataclass
+class Metrics:
+    """
+    Settings for the metrics endpoint
+    """
+    port: int
+    host: str
+
+
+@dataclasses.dataclass
+class Logging:
+    """
+    Settings for the log output
+    """
+    format: str
+    level: str
+    buffer: int
+    flush: float
+    repeats: float
+    sample: int
+
+
+@dataclasses.dataclass
+class Mqtt:
+    """
+    Settings for sending data over MQTT
+    """
+    enabled: bool
+    host: str
+    port: int
+    tls: bool
+    inflight: int
+
+
+@dataclasses.dataclass
+class Http:
+    """
+    Settings for the HTTP connections shared by the API clients
+    """
+    pool_size: int
+    keepalive: float
+
+
+@dataclasses.dataclass
+class Deadline:
+    """
+    Deadline budgets for network calls, in seconds, including retries
+    """
+    upload: float
+    lookup: float
+
+
+@dataclasses.dataclass
+class Breaker:
+    """
+    Settings for the circuit breakers of sensors and feeds
+    """
+    failures: int
+    reset: float
+    max_reset: float
+
+
+@dataclasses.dataclass
+class Sensor:
+    """
+    Settings for one sensor
+    """
+    name: str
+    type: str
+    bus: str
+    address: Optional[int]
+    # feed name -> quantity measured
+    feeds: Dict[str, str]
+    timeout: float
+    # the [station:*] section the sensor belongs to, if any
+    station: str = ''
+    # extra attempts at a failed read, within the timeout
+    retries: int = 2
+
+
+@dataclasses.dataclass
+class Station:
+    """
+    Settings for one station: a stack of sensors sending to its own feed group
+    """
+    name: str
+    group: str
+    location: Optional[Location]
+    query: str
+    region: str
+    country: str
+    sensors: List[Sensor]
+
+
 class Settings:
     """
     A class to read a settings/ini file and parse the required values.
     """
+    _DEFAULT_GROUP = 'outdoor'
+    _DEFAULT_SENSORS = [
+        Sensor('am2320', 'am2320', 'default', None, {'temperature': 'temperature', 'humidity': 'humidity'}, 2.0),
+        Sensor('bmp388', 'bmp388', 'default', None, {'pressure': 'pressure'}, 2.0)
+    ]
+
     def __init__(self, inifilepath: str):
         """
         Parameters
@@ -53,6 +234,13 @@ class Settings:
         inifilepath: A string containing a path to the settings file.
         """
         config = configparser.ConfigParser()
+        # relative paths are relative to the settings file, not the working directory
+        base = os.path.dirname(os.path.abspath(inifilepath))
+
+        def path(section: str, option: str) -> str:
+            value = config.get(section, option, fallback='').strip()
+            return os.path.join(base, value) if value else ''
+
         with open(inifilepath, encoding="utf-8") as file:
             config.read_file(file)
             try:
@@ -60,7 +248,8 @@ class Settings:
                 self.adafruit = Adafruit(
                     adafruit.get('key'),
                     adafruit.get('username'),
-                    adafruit.getboolean('sendlocation', True)
+                    adafruit.getboolean('sendlocation', True),
+                    adafruit.getfloat('datarate', 30.0)
                 )
                 self.location: Optional[Location] = None
                 if "location" in config:
@@ -69,45 +258,295 @@ class Settings:
                     longitude = location.getfloat('longitude', fallback=None)
                     if latitude is not None and longitude is not None:
                         self.location = Location(latitude, longitude)
-                if self.location is None:
+                self.outbox = Outbox(
+                    path('outbox', 'path'),
+                    config.getint('outbox', 'maxrows', fallback=100000)
+                )
+                self.cache = Cache(
+                    path('cache', 'feeds'),
+                    config.getfloat('cache', 'feedsttl', fallback=86400.0),
+                    path('cache', 'responses'),
+                    config.getfloat('cache', 'responsesttl', fallback=2592000.0),
+                    config.getfloat('cache', 'negativettl', fallback=3600.0),
+                    config.getfloat('cache', 'maxstale', fallback=31536000.0)
+                )
+                self.metrics = Metrics(
+                    config.getint('metrics', 'port', fallback=0),
+                    config.get('metrics', 'host', fallback='127.0.0.1')
+                )
+                self.logging = Logging(
+                    config.get('logging', 'format', fallback='plain').strip().lower(),
+                    config.get('logging', 'level', fallback='info').strip().lower(),
+                    config.getint('logging', 'buffer', fallback=0),
+                    config.getfloat('logging', 'flush', fallback=10.0),
+                    config.getfloat('logging', 'repeats', fallback=0.0),
+                    config.getint('logging', 'sample', fallback=1)
+                )
+                self.mqtt = Mqtt(
+                    config.getboolean('mqtt', 'enabled', fallback=False),
+                    config.get('mqtt', 'host', fallback='io.adafruit.com'),
+                    config.getint('mqtt', 'port', fallback=8883),
+                    config.getboolean('mqtt', 'tls', fallback=True),
+                    config.getint('mqtt', 'inflight', fallback=20)
+                )
+                self.http = Http(
+                    config.getint('http', 'poolsize', fallback=4),
+                    config.getfloat('http', 'keepalive', fallback=60.0)
+                )
+                self.deadline = Deadline(
+                    config.getfloat('deadline', 'upload', fallback=20.0),
+                    config.getfloat('deadline', 'lookup', fallback=30.0)
+                )
+                self.breaker = Breaker(
+                    config.getint('breaker', 'failures', fallback=3),
+                    config.getfloat('breaker', 'reset', fallback=30.0),
+                    config.getfloat('breaker', 'maxreset', fallback=600.0)
+                )
+                self.history = History(path('history', 'path'))
+                self.intervals = Intervals(
+                    config.getfloat('intervals', 'default', fallback=60.0),
+                    {
+                        feed: config.getfloat('intervals', feed)
+                        for feed in (config['intervals'] if 'intervals' in config else {})
+                        if feed != 'default'
+                    }
+                )
+                self.sampling = Sampling(
+                    config.getfloat('sampling', 'rate', fallback=0.0),
+                    [
+                        stat.strip()
+                        for stat in config.get('sampling', 'statistics', fallback='').split(',')
+                        if stat.strip()
+                    ]
+                )
+                self.derived = Derived([
+                    metric.strip()
+                    for metric in config.get('derived', 'metrics', fallback='').split(',')
+                    if metric.strip()
+                ])
+                self.deadband = Deadband(
+                    {
+                        feed: config.getfloat('deadband', feed)
+                        for feed in (config['deadband'] if 'deadband' in config else {})
+                        if feed != 'heartbeat'
+                    },
+                    config.getfloat('deadband', 'heartbeat', fallback=900.0)
+                )
+                self.adaptive = Adaptive(
+                    {
+                        feed: config.getfloat('adaptive', feed)
+                        for feed in (config['adaptive'] if 'adaptive' in config else {})
+                        if feed not in ('min', 'max', 'budget')
+                    },
+                    config.getfloat('adaptive', 'min', fallback=15.0),
+                    config.getfloat('adaptive', 'max', fallback=300.0),
+                    config.getfloat('adaptive', 'budget', fallback=0.8)
+                )
+                self.positionstack = Positionstack('', '', '', '')
+                if 'positionstack' in config:
                     positionstack = config['positionstack']
                     self.positionstack = Positionstack(
-                        positionstack.get('token'),
-                        positionstack.get('query'),
-                        positionstack.get('region'),
-                        positionstack.get('country')
+                        positionstack.get('token', ''),
+                        positionstack.get('query', ''),
+                        positionstack.get('region', ''),
+                        positionstack.get('country', '')
                         )
-            except configparser.Error as exc:
+                sensors = [
+                    self._parse_sensor(name.partition(':')[2].strip(), config[name])
+                    for name in config.sections() if name.startswith('sensor:')
+                ]
+                self.stations = [
+                    self._parse_station(name.partition(':')[2].strip(), config[name], sensors)
+                    for name in config.sections() if name.startswith('station:')
+                ]
+                if self.stations:
+                    names = sorted(station.name for station in self.stations)
+                    for sensor in sensors:
+                        if sensor.station not in names:
+                            raise RuntimeError(
+                                f"ERR: [sensor:{sensor.name}] must name its station, one of: {', '.join(names)}."
+                            )
+                else:
+                    self.stations = [self._default_station(sensors)]
+            except (configparser.Error, ValueError) as exc:
                 raise RuntimeError(
                     "ERR: Invalid settings file. Please use config.ini.sample to create a\nproperly formatted file."
                 ) from exc
         if (
             self.adafruit.send_location
-            and self.location is None
+            and any(station.location is None for station in self.stations)
             and len(self.positionstack.token) == 0
         ):
             raise RuntimeError(
                 "ERR: You need to set your PositionStack token first. If you\ndon't already have one, you can register for a free account at\nhttps://positionstack.com/signup/free"
             )
+        if self.intervals.default <= 0 or any(value <= 0 for value in self.intervals.feeds.values()):
+            raise RuntimeError("ERR: Sampling intervals in the [intervals] section must be positive.")
+        if self.http.pool_size < 1 or self.http.keepalive < 0:
+            raise RuntimeError("ERR: The [http] section needs a poolsize of at least 1, and a keepalive of at least 0.")
+        if self.deadline.upload <= 0 or self.deadline.lookup <= 0:
+            raise RuntimeError("ERR: Deadline budgets in the [deadline] section must be positive.")
+        if self.breaker.failures < 1 or self.breaker.reset <= 0 or self.breaker.max_reset < self.breaker.reset:
+            raise RuntimeError(
+                "ERR: The [breaker] section needs failures of at least 1, a positive reset,\nand a maxreset no shorter than reset."
+            )
+        if self.logging.format not in FORMATS or self.logging.level not in LEVELS:
+            raise RuntimeError(
+                f"ERR: The [logging] section needs a format of {', '.join(FORMATS)},\nand a level of {', '.join(LEVELS)}."
+            )
+        if self.logging.buffer < 0 or self.logging.flush <= 0 or self.logging.repeats < 0 or self.logging.sample < 1:
+            raise RuntimeError(
+                "ERR: The [logging] section needs a buffer and repeats of at least 0,\na positive flush, and a sample of at least 1."
+            )
+        if self.mqtt.inflight < 1:
+            raise RuntimeError("ERR: The inflight window in the [mqtt] section must be at least 1.")
+        if self.sampling.rate < 0:
+            raise RuntimeError("ERR: The sampling rate in the [sampling] section can't be negative.")
+        unknown = set(self.sampling.statistics) - set(WindowAggregator.STATISTICS)
+        if unknown:
+            raise RuntimeError(
+                f"ERR: Unknown statistics in the [sampling] section: {', '.join(sorted(unknown))}.\nChoose from {', '.join(WindowAggregator.STATISTICS)}."
+            )
+        if self.adaptive.feeds and (
+            any(value <= 0 for value in self.adaptive.feeds.values())
+            or not 0 < self.adaptive.minimum <= self.adaptive.maximum
+            or not 0 < self.adaptive.budget <= 1
+        ):
+            raise RuntimeError(
+                "ERR: The [adaptive] section needs positive thresholds, a positive min no longer\nthan max, and a budget between 0 and 1."
+            )
+        if self.derived.metrics:
+            # NumPy is slow to import, so only when there is something to derive
+            from derived import METRICS  # pylint: disable=import-outside-toplevel
+            unknown = set(self.derived.metrics) - set(METRICS)
+            if unknown:
+                raise RuntimeError(
+                    f"ERR: Unknown metrics in the [derived] section: {', '.join(sorted(unknown))}.\nChoose from {', '.join(METRICS)}."
+                )
+            if 'sealevelpressure' in self.derived.metrics and not self.adafruit.send_location:
+                raise RuntimeError(
+                    "ERR: sealevelpressure in the [derived] section needs the station elevation,\nwhich is only looked up with sendlocation = yes."
+                )
+        groups = [station.group for station in self.stations]
+        if len(set(groups)) < len(groups):
+            raise RuntimeError("ERR: Each [station:*] section needs a different feed group.")
+        for station in self.stations:
+            feeds = [feed for sensor in station.sensors for feed in sensor.feeds]
+            duplicates = {feed for feed in feeds if feeds.count(feed) > 1}
+            if duplicates:
+                raise RuntimeError(
+                    f"ERR: More than one sensor of station {station.name} provides the feeds {', '.join(sorted(duplicates))}."
+                )
         if len(self.adafruit.key) == 0 or len(self.adafruit.username) == 0:
             raise RuntimeError(
                 "ERR: You need to set your Adafruit IO key and username first.\nIf you don't already have one, you can register for a free account at\nhttps://io.adafruit.com/"
             )
 
+    @staticmethod
+    def _parse_sensor(name: str, section: configparser.SectionProxy) -> Sensor:
+        """
+        Parse a [sensor:name] section.
+
+        Raises
+        ------
+        RuntimeError: when the sensor type or a quantity is unknown.
+        ValueError: when a value can't be parsed.
+        """
+        sensor_type = section.get('type', '')
+        if sensor_type not in SENSOR_TYPES:
+            raise RuntimeError(
+                f"ERR: Unknown type for [sensor:{name}]: {sensor_type or '(none)'}.\nChoose from {', '.join(SENSOR_TYPES)}."
+            )
+        quantities = SENSOR_TYPES[sensor_type].quantities
+        feeds: Dict[str, str] = {}
+        for item in section.get('feeds', ','.join(quantities)).split(','):
+            quantity, _sep, feed = (part.strip() for part in item.partition(':'))
+            if not quantity:
+                continue
+            if quantity not in quantities:
+                raise RuntimeError(
+                    f"ERR: A {sensor_type} sensor doesn't measure {quantity}.\nChoose from {', '.join(quantities)}."
+                )
+            feeds[feed or quantity] = quantity
+        address = section.get('address', '').strip()
+        timeout = section.getfloat('timeout', 2.0)
+        if timeout <= 0:
+            raise ValueError(f"timeout for [sensor:{name}] must be positive")
+        retries = section.getint('retries', 2)
+        if retries < 0:
+            raise ValueError(f"retries for [sensor:{name}] can't be negative")
+        return Sensor(
+            name,
+            sensor_type,
+            section.get('bus', 'default').strip() or 'default',
+            int(address, 0) if address else None,
+            feeds,
+            timeout,
+            section.get('station', '').strip(),
+            retries
+        )
+
+    def _default_station(self, sensors: List[Sensor]) -> Station:
+        """
+        Build the only station, when there are no [station:*] sections.
+
+        Raises
+        ------
+        RuntimeError: when a sensor names a station.
+        """
+        for sensor in sensors:
+            if sensor.station:
+                raise RuntimeError(f"ERR: [sensor:{sensor.name}] names an unknown station: {sensor.station}.")
+        return Station(
+            self._DEFAULT_GROUP,
+            self._DEFAULT_GROUP,
+            self.location,
+            self.positionstack.query,
+            self.positionstack.region,
+            self.positionstack.country,
+            sensors or list(self._DEFAULT_SENSORS)
+        )
+
+    def _parse_station(
+        self, name: str, section: configparser.SectionProxy, sensors: List[Sensor]
+    ) -> Station:
+        """
+        Parse a [station:name] section. Location settings not given fall back
+        to the [location] and [positionstack] sections.
+
+        Raises
+        ------
+        RuntimeError: when the station has no sensors.
+        ValueError: when a value can't be parsed.
+        """
+        own_sensors = [sensor for sensor in sensors if sensor.station == name]
+        if not own_sensors:
+            raise RuntimeError(f"ERR: [station:{name}] has no [sensor:*] sections.")
+        location = self.location
+        latitude = section.getfloat('latitude', fallback=None)
+        longitude = section.getfloat('longitude', fallback=None)
+        if latitude is not None and longitude is not None:
+            location = Location(latitude, longitude)
+        return Station(
+            name,
+            section.get('group', name),
+            location,
+            section.get('query', self.positionstack.query),
+            section.get('region', self.positionstack.region),
+            section.get('country', self.positionstack.country),
+            own_sensors
+        )
+
     def dump(self):
         """
         Dump the parsed settings file to stderr for debugging.
         """
         eprint("Parsed settings file")
-        if self.location is not None:
-            eprint("Location to use:", self.location.latitude, self.location.longitude)
-        else:
-            eprint(
-                "Location to look up:",
-                self.positionstack.query,
-                self.positionstack.region,
-                self.positionstack.country
-            )
+        for station in self.stations:
+            if station.location is not None:
+                eprint(f"Location to use for {station.name}:", station.location.latitude, station.location.longitude)
+            else:
+                eprint(f"Location to look up for {station.name}:", station.query, station.region, station.country)
 
     @property
     def geocoding_token(self) -> str:
@@ -158,6 +597,13 @@ class Settings:
         """
         return self.adafruit.send_location
 
+    @property
+    def data_rate(self) -> float:
+        """
+        Get the Adafruit.IO data rate limit, in data points per minute
+        """
+        return self.adafruit.data_rate
+
     @property
     def latitude(self) -> float:
         """
@@ -176,6 +622,278 @@ class Settings:
             return self.location.longitude
         return float('nan')
 
+    @property
+    def outbox_path(self) -> str:
+        """
+        Get the path of the outbound data queue, or an empty string if disabled
+        """
+        return self.outbox.path
+
+    @property
+    def outbox_max_rows(self) -> int:
+        """
+        Get the maximum number of data to keep in the outbound data queue
+        """
+        return self.outbox.max_rows
+
+    @property
+    def feed_cache_path(self) -> str:
+        """
+        Get the path of the feed key cache, or an empty string if disabled
+        """
+        return self.cache.feeds_path
+
+    @property
+    def feed_cache_ttl(self) -> float:
+        """
+        Get how long cached feed keys can be used for, in seconds
+        """
+        return self.cache.feeds_ttl
+
+    @property
+    def response_cache_path(self) -> str:
+        """
+        Get the path of the API response cache, or an empty string if disabled
+        """
+        return self.cache.responses_path
+
+    @property
+    def response_cache_ttl(self) -> float:
+        """
+        Get how long cached API responses are fresh for, in seconds
+        """
+        return self.cache.responses_ttl
+
+    @property
+    def response_cache_negative_ttl(self) -> float:
+        """
+        Get how long failed API responses are cached for, in seconds
+        """
+        return self.cache.responses_negative_ttl
+
+    @property
+    def response_cache_max_stale(self) -> float:
+        """
+        Get how old a cached API response can be and still be used when offline, in seconds
+        """
+        return self.cache.responses_max_stale
+
+    @property
+    def sampling_rate(self) -> float:
+        """
+        Get how often to take samples for aggregation, in seconds, or 0 if disabled
+        """
+        return self.sampling.rate
+
+    @property
+    def sampling_statistics(self) -> List[str]:
+        """
+        Get the extra statistics to send for each aggregated window
+        """
+        return self.sampling.statistics
+
+    @property
+    def derived_metrics(self) -> List[str]:
+        """
+        Get the metrics to derive from the measured ones, e.g. dewpoint
+        """
+        return self.derived.metrics
+
+    @property
+    def history_path(self) -> str:
+        """
+        Get the directory of the local history of readings, or an empty string if disabled
+        """
+        return self.history.path
+
+    @property
+    def metrics_port(self) -> int:
+        """
+        Get the TCP port of the metrics endpoint, or 0 if disabled
+        """
+        return self.metrics.port
+
+    @property
+    def metrics_host(self) -> str:
+        """
+        Get the address the metrics endpoint listens on
+        """
+        return self.metrics.host
+
+    @property
+    def log_format(self) -> str:
+        """
+        Get the format of the log output: plain, json or logfmt
+        """
+        return self.logging.format
+
+    @property
+    def log_level(self) -> str:
+        """
+        Get the least level of message to log
+        """
+        return self.logging.level
+
+    @property
+    def log_buffer(self) -> int:
+        """
+        Get the most log messages to buffer before writing them, or 0 to write each at once
+        """
+        return self.logging.buffer
+
+    @property
+    def log_flush(self) -> float:
+        """
+        Get the longest to keep a log message buffered, in seconds
+        """
+        return self.logging.flush
+
+    @property
+    def log_repeats(self) -> float:
+        """
+        Get how long to suppress repeats of a log message for, in seconds, or 0 to never
+        """
+        return self.logging.repeats
+
+    @property
+    def log_sample(self) -> int:
+        """
+        Get how many of each routine log message to log only one of, e.g. per-cycle readings
+        """
+        return self.logging.sample
+
+    @property
+    def mqtt_enabled(self) -> bool:
+        """
+        Check whether to send data over MQTT, rather than only over REST
+        """
+        return self.mqtt.enabled
+
+    @property
+    def mqtt_host(self) -> str:
+        """
+        Get the MQTT broker to send data to
+        """
+        return self.mqtt.host
+
+    @property
+    def mqtt_port(self) -> int:
+        """
+        Get the TCP port of the MQTT broker
+        """
+        return self.mqtt.port
+
+    @property
+    def mqtt_tls(self) -> bool:
+        """
+        Check whether to connect to the MQTT broker with TLS
+        """
+        return self.mqtt.tls
+
+    @property
+    def mqtt_inflight(self) -> int:
+        """
+        Get the most MQTT messages to leave unacknowledged at once
+        """
+        return self.mqtt.inflight
+
+    @property
+    def http_pool_size(self) -> int:
+        """
+        Get the most HTTP connections to keep open to each host
+        """
+        return self.http.pool_size
+
+    @property
+    def http_keepalive(self) -> float:
+        """
+        Get how long an HTTP connection is idle before TCP keep-alive probes are sent, in seconds, or 0 to send none
+        """
+        return self.http.keepalive
+
+    @property
+    def upload_budget(self) -> float:
+        """
+        Get the deadline budget for uploading a sampling cycle's data, in seconds
+        """
+        return self.deadline.upload
+
+    @property
+    def lookup_budget(self) -> float:
+        """
+        Get the deadline budget for looking up a station's location and elevation, in seconds
+        """
+        return self.deadline.lookup
+
+    @property
+    def breaker_failures(self) -> int:
+        """
+        Get the failures in a row which open a circuit breaker
+        """
+        return self.breaker.failures
+
+    @property
+    def breaker_reset(self) -> float:
+        """
+        Get how long a circuit breaker first stays open before probing, in seconds
+        """
+        return self.breaker.reset
+
+    @property
+    def breaker_max_reset(self) -> float:
+        """
+        Get the longest a circuit breaker stays open before probing, in seconds
+        """
+        return self.breaker.max_reset
+
+    @property
+    def deadbands(self) -> Dict[str, float]:
+        """
+        Get the smallest change worth sending, per feed
+        """
+        return self.deadband.feeds
+
+    @property
+    def heartbeat(self) -> float:
+        """
+        Get the longest time to go without sending a feed's value, in seconds
+        """
+        return self.deadband.heartbeat
+
+    @property
+    def adaptive_thresholds(self) -> Dict[str, float]:
+        """
+        Get the rate of change per minute at which to sample faster, per feed; empty if sampling doesn't adapt
+        """
+        return self.adaptive.feeds
+
+    @property
+    def adaptive_min(self) -> float:
+        """
+        Get the shortest adaptive sampling interval, in seconds
+        """
+        return self.adaptive.minimum
+
+    @property
+    def adaptive_max(self) -> float:
+        """
+        Get the longest adaptive sampling interval, in seconds
+        """
+        return self.adaptive.maximum
+
+    @property
+    def adaptive_budget(self) -> float:
+        """
+        Get the share of the Adafruit.IO data rate adaptive sampling may use, between 0 and 1
+        """
+        return self.adaptive.budget
+
+    def sampling_interval(self, feed: str) -> float:
+        """
+        Get the sampling interval for a feed, in seconds
+        """
+        return self.intervals.feeds.get(feed, self.intervals.default)
+
     def has_location(self) -> bool:
         """
         Determine whether location data is present
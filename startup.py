@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Startup timing, broken down by phase.
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from eprint import eprint
+from metrics import REGISTRY
+
+_STARTUP_SECONDS = REGISTRY.gauge(
+    "tempmon_startup_seconds", "Time taken by each phase of startup, or until each milestone.", ["phase"]
+)
+
+
+class StartupTimer:
+    """
+    Record how long each phase of startup takes, and when milestones are reached.
+
+    Phases are timed spans of work, e.g. opening sensors; milestones are the
+    time since the timer started at which something first happened, e.g. the
+    first reading. Phases may run on any thread, including concurrently with
+    each other. Everything is also exported as the tempmon_startup_seconds gauge.
+    """
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._phases: List[Tuple[str, float]] = []
+        self._milestones: Dict[str, float] = {}
+        self._reported = False
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time the body of a with statement as a phase of startup.
+
+        Parameters
+        ----------
+        name: The name of the phase, e.g. feed discovery.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        Record a phase of startup timed elsewhere.
+
+        Parameters
+        ----------
+        name: The name of the phase.
+        seconds: How long it took.
+        """
+        with self._lock:
+            self._phases.append((name, seconds))
+        _STARTUP_SECONDS.labels(name).set(seconds)
+
+    def mark(self, name: str) -> None:
+        """
+        Record the time since startup at which a milestone was first reached; later calls are ignored.
+
+        Parameters
+        ----------
+        name: The name of the milestone, e.g. first reading.
+        """
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            if name in self._milestones:
+                return
+            self._milestones[name] = elapsed
+        _STARTUP_SECONDS.labels(name).set(elapsed)
+
+    def report(self) -> None:
+        """
+        Log the phases and milestones recorded so far, once.
+        """
+        with self._lock:
+            if self._reported:
+                return
+            self._reported = True
+            phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self._phases)
+            milestones = ", ".join(
+                f"{name} at {seconds:.2f}s" for name, seconds in sorted(self._milestones.items(), key=lambda item: item[1])
+            )
+        eprint(f"Startup timing: {phases}; {milestones}.")
+
+
+# started as early as possible: main imports this before anything else of its own
+STARTUP = StartupTimer()
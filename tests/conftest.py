@@ -0,0 +1,27 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Shared fixtures for the tests, which run against the fake Adafruit.IO server.
+"""
+
+import os
+import sys
+from typing import Iterator
+
+import pytest
+
+# the modules live at the top of the repository, rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeAdafruitIO  # pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def server() -> Iterator[FakeAdafruitIO]:
+    """
+    Serve a fake Adafruit.IO for the length of a test.
+    """
+    fake = FakeAdafruitIO(data_rate=1000)
+    yield fake
+    fake.close()
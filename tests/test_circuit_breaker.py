@@ -0,0 +1,114 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Tests for the circuit breakers, on their own and guarding sends to Adafruit.IO.
+"""
+
+import functools
+
+from aio_logger import AIOLogger
+from circuit_breaker import CircuitBreaker
+from deadline import budget
+
+
+class Clock:
+    """
+    A clock which only moves when told to.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_opens_after_failures_in_a_row():
+    """
+    The breaker opens after failure_threshold failures in a row, and no fewer.
+    """
+    breaker = CircuitBreaker("test", failure_threshold=3, clock=Clock())
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_probes_once_after_reset_timeout():
+    """
+    An open breaker lets one probe through after reset_timeout, and closes if it succeeds.
+    """
+    clock = Clock()
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 30
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_doubles_wait():
+    """
+    Each failed probe doubles the wait before the next, up to max_reset_timeout.
+    """
+    clock = Clock()
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30, max_reset_timeout=100, clock=clock)
+    breaker.record_failure()
+    for retry_at in (30, 90, 190, 290):
+        clock.now = retry_at - 1
+        assert not breaker.allow()
+        clock.now = retry_at
+        assert breaker.allow()
+        breaker.record_failure()
+
+
+def test_server_breaker_stops_sends(server):
+    """
+    While the server keeps failing, sends are skipped without a request.
+    """
+    clock = Clock()
+    logger = AIOLogger(
+        'user', 'key', 'grp', base_url=server.url,
+        breaker_factory=functools.partial(CircuitBreaker, failure_threshold=2, reset_timeout=30, clock=clock)
+    )
+    logger.get_feed('a')
+    server.error_rate = 1.0
+    for _ in range(2):
+        with budget(1.0):
+            assert not logger.log('a', 1)
+    requests = server.requests
+    assert not logger.log('a', 1)
+    assert logger.log_batch({'a': 1}) == ['a']
+    assert server.requests == requests
+    server.error_rate = 0.0
+    clock.now = 30
+    assert logger.log('a', 1)
+    assert server.data['grp.a'][-1]['value'] == '1'
+
+
+def test_feed_breaker_stops_only_its_feed(server):
+    """
+    A feed whose data keeps being rejected is skipped, without holding up the rest.
+    """
+    logger = AIOLogger(
+        'user', 'key', 'grp', base_url=server.url,
+        breaker_factory=functools.partial(CircuitBreaker, failure_threshold=2, clock=Clock())
+    )
+    logger.get_feed('a')
+    logger.get_feed('b')
+    # feed c was never created, so Adafruit.IO rejects its data
+    for _ in range(2):
+        assert not logger.log('c', 1)
+    requests = server.requests
+    assert not logger.log('c', 1)
+    assert server.requests == requests
+    assert logger.log_batch({'a': 1, 'b': 2, 'c': 3}) == ['c']
+    assert len(server.data['grp.a']) == 1
@@ -0,0 +1,62 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Tests for eprint() and the logging layer behind it.
+"""
+
+import io
+
+import pytest
+
+from eprint import close_logging, configure_logging, eprint
+
+
+@pytest.fixture(autouse=True)
+def _restore_logging():
+    """
+    Send eprint() straight to stderr again after each test.
+    """
+    yield
+    close_logging()
+
+
+def test_repeats_reported_when_another_message_is_logged():
+    """
+    The repeats of a message are reported as soon as a different message is logged.
+    """
+    stream = io.StringIO()
+    configure_logging(repeat_window=300, stream=stream)
+    for _ in range(3):
+        eprint("WARN: sensor failed")
+    eprint("Sensor data recorded")
+    assert stream.getvalue().splitlines() == [
+        "WARN: sensor failed", "WARN: sensor failed (repeated 2 more times)", "Sensor data recorded"
+    ]
+
+
+def test_repeats_reported_on_close():
+    """
+    The repeats still being counted are reported when logging is closed.
+    """
+    stream = io.StringIO()
+    configure_logging(buffer=10, repeat_window=300, stream=stream)
+    for _ in range(2):
+        eprint("WARN: sensor failed")
+    close_logging()
+    assert stream.getvalue().splitlines() == ["WARN: sensor failed", "WARN: sensor failed (repeated 1 more times)"]
+
+
+def test_print_arguments():
+    """
+    sep and end are honoured, and a message for another stream goes there.
+    """
+    stream = io.StringIO()
+    other = io.StringIO()
+    configure_logging(stream=stream)
+    eprint("a", "b", sep="-", end="!\n")
+    eprint("elsewhere", file=other)
+    assert stream.getvalue() == "a-b!\n"
+    assert other.getvalue() == "elsewhere\n"
+    with pytest.raises(TypeError):
+        eprint("a", colour="red")  # pylint: disable=unexpected-keyword-arg
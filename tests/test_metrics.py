@@ -0,0 +1,37 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Tests for the metrics and their exposition.
+"""
+
+import threading
+
+from metrics import Registry
+
+
+def test_counts_from_threads_add_up():
+    """
+    No increment is lost when several threads count at once.
+    """
+    counter = Registry().counter("test_total", "Test.", ["label"])
+
+    def count():
+        for _ in range(10000):
+            counter.labels("a").inc()
+
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.labels("a").value == 80000
+
+
+def test_label_values_escaped():
+    """
+    Backslashes, double quotes and newlines in label values are escaped.
+    """
+    registry = Registry()
+    registry.gauge("test_reading", "Test.", ["feed"]).labels('a\\b"c\nd').set(1)
+    assert 'test_reading{feed="a\\\\b\\"c\\nd"} 1\n' in registry.render()
@@ -0,0 +1,146 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Tests for the outbox, and for draining it to Adafruit.IO.
+"""
+
+# pylint: disable=redefined-outer-name
+
+import json
+from typing import Iterator
+
+import pytest
+
+from aio_logger import AIOLogger
+from fakes import FakeAdafruitIO
+from outbox import Outbox
+
+
+@pytest.fixture
+def outbox(tmp_path) -> Iterator[Outbox]:
+    """
+    Make an empty outbox for the length of a test.
+    """
+    queue = Outbox(str(tmp_path / "outbox.sqlite3"))
+    yield queue
+    queue.close()
+
+
+def _logger(server: FakeAdafruitIO, outbox: Outbox) -> AIOLogger:
+    """
+    Make a logger for group grp with feeds a and b, which drains the outbox only when drain() is called.
+    """
+    logger = AIOLogger('user', 'key', 'grp', base_url=server.url)
+    logger.get_feed('a')
+    logger.get_feed('b')
+    # given after construction, so that no drainer thread races the test
+    logger.outbox = outbox
+    return logger
+
+
+def test_peek_is_oldest_first(outbox):
+    """
+    Queued data comes out in timestamp order.
+    """
+    outbox.put('grp', {'a': 2}, "2026-01-01T00:00:02+00:00")
+    outbox.put('grp', {'a': 1, 'b': 1}, "2026-01-01T00:00:01+00:00")
+    assert [(datum.feed, datum.value) for datum in outbox.peek(10)] == [('a', '1'), ('b', '1'), ('a', '2')]
+    assert len(outbox) == 3
+
+
+def test_remove(outbox):
+    """
+    Removed data is gone from the outbox.
+    """
+    outbox.put('grp', {'a': 1, 'b': 2}, "2026-01-01T00:00:00+00:00")
+    first = outbox.peek(1)
+    outbox.remove(datum.rowid for datum in first)
+    assert [datum.feed for datum in outbox.peek(10)] == ['b']
+
+
+def test_oldest_trimmed_past_max_rows(tmp_path):
+    """
+    The oldest data is dropped to keep within max_rows.
+    """
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"), max_rows=3)
+    for second in range(5):
+        outbox.put('grp', {'a': second}, f"2026-01-01T00:00:{second:02d}+00:00")
+    assert [datum.value for datum in outbox.peek(10)] == ['2', '3', '4']
+    outbox.close()
+
+
+def test_pending_held_back_until_resolved(outbox):
+    """
+    Data stored before its group's key is known is only sent once resolved.
+    """
+    outbox.put_pending([('Group', {'a': 1}, "2026-01-01T00:00:00+00:00")])
+    assert not outbox.peek(10)
+    assert outbox.resolve('Group', 'group') == 1
+    assert [datum.group for datum in outbox.peek(10)] == ['group']
+
+
+def test_survives_reopening(tmp_path):
+    """
+    Queued data survives a restart.
+    """
+    path = str(tmp_path / "outbox.sqlite3")
+    outbox = Outbox(path)
+    outbox.put('grp', {'a': 1}, "2026-01-01T00:00:00+00:00")
+    outbox.close()
+    outbox = Outbox(path)
+    assert len(outbox) == 1
+    outbox.close()
+
+
+def test_drain_sends_everything(server, outbox):
+    """
+    Draining sends the whole backlog, and empties the outbox.
+    """
+    logger = _logger(server, outbox)
+    outbox.put_many(
+        ('grp', {'a': second, 'b': -second}, f"2026-01-01T00:00:{second:02d}+00:00", None) for second in range(10)
+    )
+    assert logger.drain()
+    assert len(outbox) == 0
+    assert [datum['value'] for datum in server.data['grp.a']] == [str(second) for second in range(10)]
+    # with their original timestamps
+    assert server.data['grp.b'][0]['created_at'] == "2026-01-01T00:00:00+00:00"
+
+
+def test_drain_keeps_data_while_server_fails(server, outbox):
+    """
+    Data stays queued while the server fails, and goes out once it recovers.
+    """
+    logger = _logger(server, outbox)
+    logger.send_budget = 1.0
+    outbox.put('grp', {'a': 1, 'b': 2}, "2026-01-01T00:00:00+00:00")
+    server.error_rate = 1.0
+    assert not logger.drain()
+    assert len(outbox) == 2
+    server.error_rate = 0.0
+    assert logger.drain()
+    assert len(outbox) == 0
+    assert len(server.data['grp.a']) == 1
+
+
+def test_drain_drops_only_rejected_data(server, outbox, monkeypatch):
+    """
+    Only the datum Adafruit.IO rejects is dropped from a chunk.
+    """
+    route_data = server._route_data  # pylint: disable=protected-access
+
+    def reject_bad(method, parts, query, payload, now):
+        if method == "POST" and 'bad' in json.dumps(payload):
+            return 422, {'error': "invalid value"}, {}
+        return route_data(method, parts, query, payload, now)
+
+    monkeypatch.setattr(server, '_route_data', reject_bad)
+    logger = _logger(server, outbox)
+    outbox.put_many(
+        ('grp', {'a': 'bad' if second == 6 else second}, f"2026-01-01T00:00:{second:02d}+00:00", None)
+        for second in range(10)
+    )
+    assert logger.drain()
+    assert len(outbox) == 0
+    assert [datum['value'] for datum in server.data['grp.a']] == [str(second) for second in range(10) if second != 6]
@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Tests for the rate limiter, on its own and in front of Adafruit.IO.
+"""
+
+import pytest
+
+from aio_logger import AIOLogger
+from rate_limit import RateLimited, TokenBucket
+
+
+def test_acquire_within_capacity():
+    """
+    A minute's worth of data can be sent at once, but no more.
+    """
+    bucket = TokenBucket(60, max_wait=0.0)
+    bucket.acquire(60)
+    with pytest.raises(RateLimited):
+        bucket.acquire(1)
+
+
+def test_high_priority_waits_for_tokens():
+    """
+    A high priority send waits for the bucket to refill.
+    """
+    bucket = TokenBucket(600, max_wait=1.0)
+    bucket.acquire(600)
+    # 600 a minute refills one token every 0.1s
+    bucket.acquire(1)
+
+
+def test_low_priority_leaves_reserve():
+    """
+    Low priority sends leave the reserve to high priority ones.
+    """
+    bucket = TokenBucket(60, reserve=0.5)
+    assert bucket.max_cost(TokenBucket.LOW) == 30
+    bucket.acquire(30, TokenBucket.LOW)
+    with pytest.raises(RateLimited):
+        bucket.acquire(1, TokenBucket.LOW)
+    # high priority sends can still use the reserve
+    bucket.acquire(30)
+
+
+def test_release_gives_tokens_back():
+    """
+    Tokens for data which wasn't sent can be used again.
+    """
+    bucket = TokenBucket(60, max_wait=0.0)
+    bucket.acquire(60)
+    bucket.release(10)
+    bucket.acquire(10)
+
+
+def test_429_pauses_for_retry_after():
+    """
+    A 429 response stops sends for its Retry-After time.
+    """
+    bucket = TokenBucket(60, max_wait=0.0)
+    bucket.observe(429, {"Retry-After": "30"})
+    with pytest.raises(RateLimited) as excinfo:
+        bucket.acquire(1)
+    assert excinfo.value.wait == pytest.approx(30, abs=1)
+
+
+def test_follows_rate_headers():
+    """
+    The data rate headers set the rate and what is left of it.
+    """
+    bucket = TokenBucket(30, max_wait=0.0)
+    bucket.observe(200, {"X-AIO-Datarate-Limit": "60", "X-AIO-Datarate-Remaining": "5"})
+    assert bucket.capacity == 60
+    bucket.acquire(5)
+    with pytest.raises(RateLimited):
+        bucket.acquire(1)
+
+
+def test_logger_learns_data_rate(server):
+    """
+    The logger's limiter learns the account's data rate from Adafruit.IO.
+    """
+    limiter = TokenBucket(30, max_wait=0.0)
+    logger = AIOLogger('user', 'key', 'grp', base_url=server.url, limiter=limiter)
+    logger.get_feed('a')
+    assert logger.log_batch({'a': 1}) == []
+    assert limiter.capacity == server.data_rate
+
+
+def test_logger_skips_batch_when_limited(server):
+    """
+    A batch which the limiter holds back isn't sent.
+    """
+    limiter = TokenBucket(1000, max_wait=0.0)
+    logger = AIOLogger('user', 'key', 'grp', base_url=server.url, limiter=limiter)
+    for feed in ('a', 'b', 'c'):
+        logger.get_feed(feed)
+    limiter.pause(60)
+    requests = server.requests
+    assert sorted(logger.log_batch({'a': 1, 'b': 2, 'c': 3})) == ['a', 'b', 'c']
+    assert server.requests == requests
+
+
+def test_logger_skips_throttled_batch(server):
+    """
+    A throttled batch is skipped, rather than sent a feed at a time.
+    """
+    limiter = TokenBucket(1000, max_wait=0.0)
+    logger = AIOLogger('user', 'key', 'grp', base_url=server.url, limiter=limiter)
+    for feed in ('a', 'b', 'c'):
+        logger.get_feed(feed)
+    server.throttle_rate = 1.0
+    requests = server.requests
+    assert sorted(logger.log_batch({'a': 1, 'b': 2, 'c': 3})) == ['a', 'b', 'c']
+    # neither retried nor sent again a feed at a time, and the limiter backs off
+    assert server.requests == requests + 1
+    with pytest.raises(RateLimited):
+        limiter.acquire(1)
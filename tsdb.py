@@ -0,0 +1,344 @@
+# SPDX-FileCopyrightText: © 2024 Stacey Adams <stacey.belle.rose@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Compact local time-series store with multi-resolution rollups.
+
+Usage:
+    python3 tsdb.py summary temperature --since 24h
+    python3 tsdb.py query pressure --since 6h --resolution 1h
+"""
+
+import argparse
+import dataclasses
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class RingFile:
+    """
+    Fixed-width records in a memory-mapped ring file.
+
+    Records must be appended in timestamp order, with the timestamp as their
+    first field. Once the ring is full, each new record overwrites the oldest.
+    """
+    _HEADER = struct.Struct('<4sIIIQ')
+    _MAGIC = b'TSR1'
+
+    def __init__(self, path: str, record: struct.Struct, capacity: int, writable: bool = True):
+        """
+        Parameters
+        ----------
+        path: Path to the ring file; created if it doesn't exist.
+        record: The layout of a record.
+        capacity: The number of records to keep, if the file is created.
+        writable: Whether records will be written.
+        """
+        self.record = record
+        self.writable = writable
+        exists = os.path.exists(path)
+        if not exists and not writable:
+            raise FileNotFoundError(path)
+        mode = ('r+b' if writable else 'rb') if exists else 'w+b'
+        self._file = open(path, mode)  # pylint: disable=consider-using-with
+        if exists:
+            magic, _version, record_size, capacity, self._count = self._HEADER.unpack(
+                self._file.read(self._HEADER.size)
+            )
+            if magic != self._MAGIC or record_size != record.size:
+                self._file.close()
+                raise ValueError(f"{path} is not a ring file of {record.size} byte records.")
+        else:
+            self._count = 0
+            self._file.write(self._HEADER.pack(self._MAGIC, 1, record.size, capacity, 0))
+            self._file.truncate(self._HEADER.size + capacity * record.size)
+        self.capacity = capacity
+        self._map = mmap.mmap(
+            self._file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        )
+
+    def _offset(self, index: int) -> int:
+        """
+        Get the file offset of a record, by its index since the ring was created.
+        """
+        return self._HEADER.size + (index % self.capacity) * self.record.size
+
+    def _set_count(self, count: int) -> None:
+        """
+        Update the number of records ever written, in memory and in the header.
+        """
+        self._count = count
+        self._map[self._HEADER.size - 8:self._HEADER.size] = struct.pack('<Q', count)
+
+    @property
+    def first_index(self) -> int:
+        """
+        Get the index of the oldest record still kept
+        """
+        return max(0, self._count - self.capacity)
+
+    def __len__(self) -> int:
+        return self._count - self.first_index
+
+    def get(self, index: int) -> Tuple:
+        """
+        Get a record, by its index since the ring was created.
+        """
+        return self.record.unpack_from(self._map, self._offset(index))
+
+    def last(self) -> Optional[Tuple]:
+        """
+        Get the newest record, if any.
+        """
+        return self.get(self._count - 1) if self._count else None
+
+    def append(self, *fields) -> None:
+        """
+        Add a record, overwriting the oldest one if the ring is full.
+        """
+        self.record.pack_into(self._map, self._offset(self._count), *fields)
+        self._set_count(self._count + 1)
+
+    def replace_last(self, *fields) -> None:
+        """
+        Overwrite the newest record.
+        """
+        self.record.pack_into(self._map, self._offset(self._count - 1), *fields)
+
+    def _bisect(self, timestamp: float) -> int:
+        """
+        Get the index of the first record at or after a timestamp.
+        """
+        low, high = self.first_index, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self.get(middle)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def between(self, start: float, end: float) -> Iterator[Tuple]:
+        """
+        Get the records with timestamps from start up to, but not including, end.
+        """
+        for index in range(self._bisect(start), self._count):
+            record = self.get(index)
+            if record[0] >= end:
+                break
+            yield record
+
+    def close(self) -> None:
+        """
+        Flush the ring to disk and close it.
+        """
+        if self._map.closed:
+            return
+        if self.writable:
+            self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+@dataclasses.dataclass
+class Summary:
+    """
+    Summary statistics over a time range.
+    """
+    count: int
+    min: float
+    max: float
+    mean: float
+
+
+class TimeSeriesStore:
+    """
+    Local store of every reading, with 1 minute, 1 hour and 1 day rollups.
+
+    Each feed has a ring file of raw readings and one per rollup resolution, so
+    disk usage is fixed. Rollups are updated in place as readings arrive, so
+    summaries over long ranges only need to read a few records.
+    """
+    RAW = struct.Struct('<dd')
+    ROLLUP = struct.Struct('<dQddd')
+    RESOLUTIONS = {'1m': 60, '1h': 3600, '1d': 86400}
+    CAPACITIES = {'raw': 10080, '1m': 10080, '1h': 8784, '1d': 3660}
+
+    def __init__(self, directory: str, writable: bool = True):
+        """
+        Parameters
+        ----------
+        directory: The directory holding the ring files.
+        writable: Whether readings will be added.
+        """
+        self.directory = directory
+        self.writable = writable
+        if writable:
+            os.makedirs(directory, exist_ok=True)
+        self._rings: Dict[Tuple[str, str], RingFile] = {}
+
+    def _ring(self, feed: str, resolution: str) -> RingFile:
+        """
+        Get the ring file of a feed for a resolution ('raw' or a rollup), opening it if needed.
+        """
+        ring = self._rings.get((feed, resolution))
+        if ring is None:
+            name = re.sub(r'[^A-Za-z0-9_.-]', '_', feed)
+            ring = RingFile(
+                os.path.join(self.directory, f"{name}.{resolution}"),
+                self.RAW if resolution == 'raw' else self.ROLLUP,
+                self.CAPACITIES[resolution],
+                self.writable
+            )
+            self._rings[(feed, resolution)] = ring
+        return ring
+
+    def add(self, feed: str, timestamp: float, value: float) -> None:
+        """
+        Store a reading, and update the rollups.
+
+        Parameters
+        ----------
+        feed: The name of the feed.
+        timestamp: The time of the reading, in seconds since the epoch.
+        value: The value of the reading.
+        """
+        raw = self._ring(feed, 'raw')
+        last = raw.last()
+        if last is not None and timestamp < last[0]:
+            # readings must be in order, so drop any from before a clock step
+            return
+        raw.append(timestamp, value)
+        for resolution, seconds in self.RESOLUTIONS.items():
+            ring = self._ring(feed, resolution)
+            start = math.floor(timestamp / seconds) * seconds
+            bucket = ring.last()
+            if bucket is not None and bucket[0] == start:
+                ring.replace_last(
+                    start, bucket[1] + 1, bucket[2] + value, min(bucket[3], value), max(bucket[4], value)
+                )
+            else:
+                ring.append(start, 1, value, value, value)
+
+    def query(
+        self, feed: str, start: float, end: float, resolution: str = 'raw'
+    ) -> List[Tuple]:
+        """
+        Get the stored records of a feed in a time range.
+
+        Parameters
+        ----------
+        feed: The name of the feed.
+        start: The start of the range, in seconds since the epoch.
+        end: The end of the range (exclusive), in seconds since the epoch.
+        resolution: 'raw' for (timestamp, value) records, or one of '1m', '1h'
+            and '1d' for (start, count, sum, min, max) rollup records.
+
+        Returns
+        -------
+        A list of records, oldest first.
+        """
+        return list(self._ring(feed, resolution).between(start, end))
+
+    def _covering_rollup(self, feed: str, start: float) -> Tuple[RingFile, int]:
+        """
+        Get the finest rollup of a feed which still holds data from start, and its resolution in seconds.
+        """
+        for resolution, seconds in self.RESOLUTIONS.items():
+            ring = self._ring(feed, resolution)
+            if len(ring) and ring.get(ring.first_index)[0] <= start:
+                return ring, seconds
+        return self._ring(feed, '1d'), self.RESOLUTIONS['1d']
+
+    def summary(self, feed: str, start: float, end: float) -> Optional[Summary]:
+        """
+        Summarize a feed over a time range, from the finest rollup which covers it.
+
+        The range is widened to whole rollup buckets.
+
+        Parameters
+        ----------
+        feed: The name of the feed.
+        start: The start of the range, in seconds since the epoch.
+        end: The end of the range (exclusive), in seconds since the epoch.
+
+        Returns
+        -------
+        The summary statistics, or None if there is no data in the range.
+        """
+        ring, seconds = self._covering_rollup(feed, start)
+        first = math.floor(start / seconds) * seconds
+        count, total, low, high = 0, 0.0, math.inf, -math.inf
+        for _start, bucket_count, bucket_sum, bucket_min, bucket_max in ring.between(first, end):
+            count += bucket_count
+            total += bucket_sum
+            low = min(low, bucket_min)
+            high = max(high, bucket_max)
+        if count == 0:
+            return None
+        return Summary(count, low, high, total / count)
+
+    def close(self) -> None:
+        """
+        Flush all ring files to disk and close them.
+        """
+        for ring in self._rings.values():
+            ring.close()
+        self._rings = {}
+
+
+def parse_duration(text: str) -> float:
+    """
+    Parse a duration such as 90s, 15m, 24h or 7d into seconds.
+    """
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smhd]?)', text.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"invalid duration: {text}")
+    return float(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+
+
+def main() -> None:
+    """
+    Entry point function when run from command line.
+    """
+    parser = argparse.ArgumentParser(description="Query the local history of sensor readings.")
+    parser.add_argument('--dir', default='history', help="history directory (default: history)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    summary_parser = commands.add_parser('summary', help="min/max/mean of a feed over a time range")
+    query_parser = commands.add_parser('query', help="records of a feed over a time range")
+    query_parser.add_argument(
+        '--resolution', choices=['raw', *TimeSeriesStore.RESOLUTIONS], default='raw'
+    )
+    for command in (summary_parser, query_parser):
+        command.add_argument('feed')
+        command.add_argument('--since', type=parse_duration, default=86400.0, help="e.g. 24h (default)")
+    args = parser.parse_args()
+
+    store = TimeSeriesStore(args.dir, writable=False)
+    end = time.time()
+    start = end - args.since
+    try:
+        if args.command == 'summary':
+            summary = store.summary(args.feed, start, end)
+            if summary is None:
+                print("No data.")
+            else:
+                print(f"count={summary.count} min={summary.min:g} max={summary.max:g} mean={summary.mean:.2f}")
+        else:
+            for record in store.query(args.feed, start, end, args.resolution):
+                print(time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record[0])), *record[1:], sep=',')
+    except FileNotFoundError:
+        print(f"No history for {args.feed} in {args.dir}.", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()